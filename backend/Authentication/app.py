@@ -2,9 +2,10 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import jwt
 import os
+import logging
 import requests
+from common import db, http_client, responses, tracing, log
 from datetime import datetime, timedelta
-from supabase import create_client, Client
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from dotenv import load_dotenv
@@ -13,6 +14,11 @@ from dotenv import load_dotenv
 load_dotenv()
 
 app = Flask(__name__)
+responses.init_app(app)
+tracing.init_app(app, "auth-service")
+log.init_app(app, "auth-service")
+db.init_app(app)
+logger = logging.getLogger(__name__)
 app.config['PROPAGATE_EXCEPTIONS'] = True  # add this
 app.config['DEBUG'] = True  # optional: shows errors during dev
 CORS(app, resources={
@@ -30,19 +36,16 @@ AUTHENTICATION_TABLE = "authentication"
 supabase_url = os.getenv("SUPABASE_URL")
 supabase_key = os.getenv("SUPABASE_KEY")
 
-print(f"[DEBUG] Initializing Supabase client with URL: {supabase_url}")
+logger.debug("Initializing Supabase client with URL: %s", supabase_url)
 try:
     # Initialize global Supabase client
     global supabase
-    supabase = create_client(supabase_url, supabase_key)
-    print("[DEBUG] Successfully initialized Supabase client")
-    
+    supabase = tracing.trace_supabase(db.create_client(supabase_url, supabase_key))
     # Try to validate connection by performing a simple query
-    print("[DEBUG] Validating Supabase connection...")
     test_response = supabase.table(AUTHENTICATION_TABLE).select("count").limit(1).execute()
-    print(f"[DEBUG] Supabase connection test response: {test_response}")
+    logger.debug("Supabase connection test response: %s", test_response.data)
 except Exception as e:
-    print(f"[ERROR] Failed to initialize Supabase client: {str(e)}")
+    logger.error("Failed to initialize Supabase client: %s", e)
     raise
 
 
@@ -88,8 +91,6 @@ def token_required(f):
 def register():
     data = request.get_json()
 
-    print("[DEBUG] Received data:", data)
-    
     if not all(k in data for k in ['username', 'email', 'password']):
         return jsonify({'error': 'Missing required fields'}), 400
     
@@ -97,7 +98,6 @@ def register():
         password_hash = generate_password_hash(data['password'])  
 
         # Insert new user in auth database with is_first_login flag set to true
-        print("[DEBUG] Attempting to insert user into Supabase")
         try:
             response = supabase.table(AUTHENTICATION_TABLE).insert({
                 "username": data['username'],
@@ -105,9 +105,8 @@ def register():
                 "password_hash": password_hash,
                 "is_first_login": True  # Add is_first_login flag
             }).execute()
-            print("[DEBUG] Supabase response:", response)
         except Exception as e:
-            print(f"[ERROR] Supabase insert error: {str(e)}")
+            logger.error("Supabase insert error: %s", e)
             raise
 
         # Check response before accessing it
@@ -126,7 +125,7 @@ def register():
             }
             
             # Send request to user service through Kong
-            user_service_response = requests.post(
+            user_service_response = http_client.post(
                 f"{KONG_URL}/api/internal/user/create",
                 json=user_data,
                 headers={"Content-Type": "application/json"}
@@ -136,11 +135,11 @@ def register():
             if user_service_response.status_code not in (200, 201):
                 # If user service fails, we should log this but still return success
                 # as the auth part worked
-                print(f"Warning: User service creation failed: {user_service_response.text}")
+                logger.warning("User service creation failed: %s", user_service_response.text)
         
         except Exception as e:
             # Log error but don't fail the registration if user service is unavailable
-            print(f"Error creating user in user service: {str(e)}")
+            logger.error("Error creating user in user service: %s", e)
         
         return jsonify({
             'message': 'User registered successfully',
@@ -154,7 +153,7 @@ def register():
         }), 201
         
     except Exception as e:
-        print(f"[ERROR] Registration error: {str(e)}")
+        logger.exception("Registration error")
         return jsonify({'error': str(e)}), 500
 
 # User Login & JWT Token Generation (POST)
@@ -238,15 +237,11 @@ def delete_user(user_id):
         return jsonify({"error": "Unauthorized access"}), 403
     
     try:
-        print(f"Attempting to delete user ID: {user_id} (type: {type(user_id)})")
-        
         # Convert user_id to int if it's a string to match database type
         user_id_int = int(user_id) if isinstance(user_id, str) and user_id.isdigit() else user_id
-        print(f"Converted user ID: {user_id_int} (type: {type(user_id_int)})")
 
         # First check if user exists in auth database
-        check_result = supabase.table(AUTHENTICATION_TABLE).select("*").eq("id", user_id_int).execute()
-        print(f"Check result: {check_result.data}")
+        check_result = supabase.table(AUTHENTICATION_TABLE).select("id").eq("id", user_id_int).execute()
         
         if len(check_result.data) == 0:
             return jsonify({"error": "User not found in auth database"}), 404
@@ -262,43 +257,43 @@ def delete_user(user_id):
 
         # Delete user from User service
         try:
-            user_service_response = requests.delete(
+            user_service_response = http_client.delete(
                 f"{KONG_URL}/api/user/{user_id}",
                 headers={"Authorization": auth_header}
             )
-            print(f"User service deletion response: {user_service_response.status_code} - {user_service_response.text}")
+            logger.info("User service deletion response: %s", user_service_response.status_code)
         except Exception as e:
-            print(f"Error deleting user profile: {str(e)}")
+            logger.error("Error deleting user profile: %s", e)
 
         # Delete user's itineraries
         try:
-            itinerary_service_response = requests.delete(
+            itinerary_service_response = http_client.delete(
                 f"{KONG_URL}/api/itineraries/{user_id}/all",
                 headers={"Authorization": auth_header}
             )
-            print(f"Itinerary service deletion response: {itinerary_service_response.status_code} - {itinerary_service_response.text}")
+            logger.info("Itinerary service deletion response: %s", itinerary_service_response.status_code)
         except Exception as e:
-            print(f"Error deleting user itineraries: {str(e)}")
+            logger.error("Error deleting user itineraries: %s", e)
         
         # Delete user's social data (likes and comments)
         try:
-            social_service_response = requests.delete(
+            social_service_response = http_client.delete(
                 f"{KONG_URL}/api/social/user/{user_id}",
                 headers={"Authorization": auth_header}
             )
-            print(f"Social service deletion response: {social_service_response.status_code} - {social_service_response.text}")
+            logger.info("Social service deletion response: %s", social_service_response.status_code)
         except Exception as e:
-            print(f"Error deleting user social data: {str(e)}")
+            logger.error("Error deleting user social data: %s", e)
 
         # Delete user posts
         try:
-            posts_service_response = requests.delete(
+            posts_service_response = http_client.delete(
                 f"{KONG_URL}/api/posts/user/{user_id}",
                 headers={"Authorization": auth_header}
             )
-            print(f"Posts service deletion response: {posts_service_response.status_code} - {posts_service_response.text}")
+            logger.info("Posts service deletion response: %s", posts_service_response.status_code)
         except Exception as e:
-            print(f"Error deleting user posts: {str(e)}")
+            logger.error("Error deleting user posts: %s", e)
         # Store all service responses with detailed status
         service_responses = {}
         service_failures = []
@@ -322,7 +317,8 @@ def delete_user(user_id):
         # Check Social service
         if social_service_response is not None:
             service_responses["social_service"] = social_service_response.status_code
-            if social_service_response.status_code not in [200, 204]:
+            # The social service purges in the background and answers 202 once the job is queued
+            if social_service_response.status_code not in [200, 202, 204]:
                 service_failures.append(f"social_service ({social_service_response.status_code})")
         else:
             service_responses["social_service"] = "unreachable"
@@ -337,12 +333,11 @@ def delete_user(user_id):
 
         if service_failures:
             error_msg = f"Failed to delete from services: {', '.join(service_failures)}"
-            print(error_msg)
+            logger.error(error_msg)
             return jsonify({"error": error_msg, "service_status": service_responses}), 500
 
         # All services processed, now delete from auth database
         result = supabase.table(AUTHENTICATION_TABLE).delete().eq("id", user_id_int).execute()
-        print(f"Auth database delete result: {result.data}")
         
         if not result.data or len(result.data) == 0:
             return jsonify({"error": "Failed to delete user from auth database"}), 500
@@ -357,7 +352,7 @@ def delete_user(user_id):
         }), 200
         
     except Exception as e:
-        print(f"Error deleting user from auth database: {str(e)}")
+        logger.exception("Error deleting user from auth database")
         return jsonify({"error": f"Error deleting user from auth database: {str(e)}"}), 500
 
 # Add this new endpoint to update is_first_login status
@@ -365,12 +360,8 @@ def delete_user(user_id):
 @token_required
 def update_first_login():
     try:
-        # Debug: Print the request.user object to see what we're working with
-        print("[DEBUG] request.user:", request.user)
-        
         # Get user_id from the token payload
         user_id = request.user.get('user_id')
-        print("[DEBUG] Extracted user_id:", user_id)
         
         if not user_id:
             return jsonify({'error': 'User ID not found in token'}), 400
@@ -378,18 +369,14 @@ def update_first_login():
         # Convert user_id to int if it's a string
         if isinstance(user_id, str) and user_id.isdigit():
             user_id = int(user_id)
-            print("[DEBUG] Converted user_id to int:", user_id)
         
         # Update the is_first_login flag to False
-        print("[DEBUG] Executing Supabase query with user_id:", user_id)
         result = supabase.table(AUTHENTICATION_TABLE).update({
             "is_first_login": False
         }).eq("id", user_id).execute()
         
-        print("[DEBUG] Supabase result:", result)
-        
         if not result.data or len(result.data) == 0:
-            print("[DEBUG] No data returned from update query")
+            logger.warning("No rows updated for user %s", user_id)
             return jsonify({'error': 'Failed to update user status'}), 500
             
         return jsonify({
@@ -398,7 +385,7 @@ def update_first_login():
         }), 200
         
     except Exception as e:
-        print("[DEBUG] Exception in update_first_login:", str(e))
+        logger.exception("Error in update_first_login")
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
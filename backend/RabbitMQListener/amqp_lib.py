@@ -5,9 +5,17 @@ References:
 https://pika.readthedocs.io/en/stable/_modules/pika/exceptions.html#ConnectionClosed
 """
 
+import logging
 import time
 import pika
 
+logger = logging.getLogger(__name__)
+
+# AMQP reply code of a channel closed because the queue does not exist
+NOT_FOUND = 404
+# Pause before reopening a channel the broker closed, so a persistent error does not spin
+RECONNECT_INTERVAL = 5
+
 
 def connect_from_url(amqp_url, max_retries=12, retry_interval=5):
     retries = 0
@@ -15,45 +23,93 @@ def connect_from_url(amqp_url, max_retries=12, retry_interval=5):
     while retries < max_retries:
         retries += 1
         try:
-            print(f"Connecting to RabbitMQ via URL...")
+            logger.info("Connecting to RabbitMQ via URL")
             params = pika.URLParameters(amqp_url)
             connection = pika.BlockingConnection(params)
-            
-            if connection.is_open:
-                print("✅ Connected to RabbitMQ successfully.")
-            else:
-                print("❌ Connection object exists but not open.")
+            if not connection.is_open:
+                logger.warning("Connection object exists but not open")
             channel = connection.channel()
 
-            print("Connected via AMQP_URL.")
+            logger.info("Connected to RabbitMQ")
             return connection, channel
 
         except pika.exceptions.AMQPConnectionError as exception:
-            print(f"Failed to connect: {exception=}")
-            print(f"Retrying in {retry_interval} seconds... ({retries}/{max_retries})")
+            logger.warning("Failed to connect: %r; retrying in %ss (%d/%d)", exception, retry_interval, retries, max_retries)
             time.sleep(retry_interval)
 
     raise Exception(f"Max {max_retries} retries exceeded.")
 
 
-def start_consuming_from_url(amqp_url, queue_name, callback):
+def retry_queue_arguments(queue_name, delay):
+    # Messages expire after `delay` seconds and are dead-lettered back onto queue_name
+    return {
+        "x-message-ttl": int(delay * 1000),
+        "x-dead-letter-exchange": "",
+        "x-dead-letter-routing-key": queue_name,
+    }
+
+
+def declare_retry_topology(channel, queue_name, retry_delays):
+    """
+    Declare one delay queue per retry attempt plus a dead-letter queue.
+
+    A message published to "<queue>.retry.<n>" sits there for retry_delays[n]
+    seconds, then expires and is dead-lettered straight back onto queue_name.
+    Returns (retry queue names, dead-letter queue name).
+    """
+    retry_queues = []
+    for attempt, delay in enumerate(retry_delays):
+        retry_queue = f"{queue_name}.retry.{attempt}"
+        channel.queue_declare(
+            queue=retry_queue,
+            durable=True,
+            arguments=retry_queue_arguments(queue_name, delay),
+        )
+        retry_queues.append(retry_queue)
+
+    dead_letter_queue = f"{queue_name}.dead"
+    channel.queue_declare(queue=dead_letter_queue, durable=True)
+    return retry_queues, dead_letter_queue
+
+
+def start_consuming_from_url(amqp_url, queue_name, callback, prefetch_count=None, auto_ack=True,
+                             on_consume=None):
+    # With auto_ack=False the callback is responsible for acking each delivery;
+    # prefetch_count bounds how many unacked messages the broker hands us at once.
+    # on_consume(connection, channel, consumer_tag) runs on every (re)connect.
     while True:
         try:
             connection, channel = connect_from_url(amqp_url)
 
-            print(f"Consuming from queue: {queue_name}")
-            channel.basic_consume(
-                queue=queue_name, on_message_callback=callback, auto_ack=True
+            if prefetch_count:
+                channel.basic_qos(prefetch_count=prefetch_count)
+
+            logger.info("Consuming from queue: %s (prefetch=%s, auto_ack=%s)", queue_name, prefetch_count, auto_ack)
+            consumer_tag = channel.basic_consume(
+                queue=queue_name, on_message_callback=callback, auto_ack=auto_ack
             )
-            channel.start_consuming()
+            if on_consume:
+                on_consume(connection, channel, consumer_tag)
+            # Unlike channel.start_consuming(), keep serving I/O and callbacks while
+            # the consumer is cancelled (paused) so it can be resumed on this channel.
+            while True:
+                connection.process_data_events(time_limit=1)
 
         except pika.exceptions.ChannelClosedByBroker as exception:
-            message = f"Queue {queue_name} not found."
-            connection.close()
-            raise Exception(message) from exception
+            if connection.is_open:
+                connection.close()
+            if exception.reply_code == NOT_FOUND:
+                raise Exception(f"Queue {queue_name} not found.") from exception
+            # E.g. an ack with an unknown delivery tag, or a queue redeclared with different
+            # arguments (PRECONDITION_FAILED); unacked deliveries come back after reconnecting
+            logger.warning("Channel closed by broker: %s %s. Reconnecting in %ss...",
+                           exception.reply_code, exception.reply_text, RECONNECT_INTERVAL)
+            time.sleep(RECONNECT_INTERVAL)
+            continue
 
-        except pika.exceptions.ConnectionClosedByBroker:
-            print("Connection closed. Reconnecting...")
+        except (pika.exceptions.ConnectionClosedByBroker, pika.exceptions.AMQPConnectionError):
+            # Unacked deliveries are redelivered by the broker after reconnecting
+            logger.warning("Connection closed. Reconnecting...")
             continue
 
         except KeyboardInterrupt:
@@ -0,0 +1,302 @@
+"""
+asyncio entry point for the notification listener.
+
+Same queue, message format, event_type handling, batching/coalescing, retry
+queues and circuit breaker as listener.py, but built on aio-pika and a single
+aiohttp session, so one process keeps up to ASYNC_MAX_IN_FLIGHT deliveries to
+OutSystems in flight instead of one per worker thread.
+
+Run with: python -u async_listener.py
+"""
+
+import asyncio
+import json
+import logging
+import os
+from collections import namedtuple
+import aio_pika
+import aiohttp
+from common import tracing, log
+from amqp_lib import retry_queue_arguments
+from batching import coalesce
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from outsystems import DeliveryError, RejectedError, to_payload, to_bulk_payload, \
+    is_retriable_status, check_status
+from metrics import start_metrics_server, published_at, record_consumed, record_settled, \
+    record_queue_depth, PUBLISHED_AT_HEADER, QUEUE_DEPTH_INTERVAL
+from settings import ASYNC_RABBITMQ_PREFETCH, OUTSYSTEMS_TIMEOUT, NOTIFY_BATCH_WINDOW, \
+    NOTIFY_BATCH_MAX, OUTSYSTEMS_BULK_NOTIFY_URL, RETRY_DELAYS, CIRCUIT_FAILURE_THRESHOLD, \
+    CIRCUIT_RESET_TIMEOUT, ASYNC_MAX_IN_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+# A message as received, with what the metrics and tracing need when it is settled
+Delivery = namedtuple("Delivery", ["message", "event_type", "published_at", "trace"])
+
+
+class AsyncListener:
+    def __init__(self, amqp_url, queue_name, notify_url):
+        self.amqp_url = amqp_url
+        self.queue_name = queue_name
+        self.notify_url = notify_url
+
+        self.connection = None
+        self.channel = None
+        self.queue = None
+        self.consumer_tag = None
+        self.retry_queues = []
+        self.dead_letter_queue = None
+
+        self.http = None
+        self.pending = None
+        self.in_flight = set()
+        self.breaker = CircuitBreaker(
+            failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=CIRCUIT_RESET_TIMEOUT,
+            on_state_change=self.on_circuit_change
+        )
+
+    async def setup(self):
+        self.connection = await aio_pika.connect_robust(self.amqp_url)
+        self.channel = await self.connection.channel()
+        await self.channel.set_qos(prefetch_count=ASYNC_RABBITMQ_PREFETCH)
+
+        self.queue = await self.channel.declare_queue(self.queue_name, durable=True)
+        for attempt, delay in enumerate(RETRY_DELAYS):
+            name = f"{self.queue_name}.retry.{attempt}"
+            await self.channel.declare_queue(
+                name, durable=True, arguments=retry_queue_arguments(self.queue_name, delay)
+            )
+            self.retry_queues.append(name)
+        self.dead_letter_queue = f"{self.queue_name}.dead"
+        await self.channel.declare_queue(self.dead_letter_queue, durable=True)
+
+        # One pooled, keep-alive session for every outbound call
+        self.http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=ASYNC_MAX_IN_FLIGHT),
+            timeout=aiohttp.ClientTimeout(connect=OUTSYSTEMS_TIMEOUT[0], sock_read=OUTSYSTEMS_TIMEOUT[1])
+        )
+        self.pending = asyncio.Queue()
+
+    async def close(self):
+        if self.http is not None:
+            await self.http.close()
+        if self.connection is not None:
+            await self.connection.close()
+
+    # Outbound
+
+    async def post_to_outsystems(self, url, body):
+        self.breaker.before_request()
+        try:
+            async with self.http.post(url, json=body, headers=tracing.inject({})) as res:
+                text = await res.text()
+                status = res.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.breaker.record_failure()
+            raise DeliveryError(f"Failed to notify OutSystems: {str(e)}") from e
+
+        if is_retriable_status(status):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        check_status(status, text)
+        return status
+
+    async def notify_outsystems(self, event_type, data):
+        logger.debug("Forwarding to OutSystems | Type: %s", event_type)
+        status = await self.post_to_outsystems(self.notify_url, to_payload(event_type, data))
+        logger.debug("Notification sent: %s", status)
+
+    async def notify_outsystems_bulk(self, notifications):
+        logger.debug("Forwarding %d notifications to OutSystems in bulk", len(notifications))
+        status = await self.post_to_outsystems(OUTSYSTEMS_BULK_NOTIFY_URL, to_bulk_payload(notifications))
+        logger.debug("Bulk notification sent: %s", status)
+
+    # Settling
+
+    async def republish(self, delivery, routing_key, attempt):
+        headers = {"x-attempt": attempt}
+        if delivery.published_at is not None:
+            # Keep the original publish time so latency covers the retries too
+            headers[PUBLISHED_AT_HEADER] = delivery.published_at
+        if delivery.trace[0]:
+            headers[tracing.AMQP_REQUEST_ID_HEADER] = delivery.trace[0]
+            if delivery.trace[1]:
+                headers[tracing.AMQP_PARENT_SPAN_HEADER] = delivery.trace[1]
+        await self.channel.default_exchange.publish(
+            aio_pika.Message(
+                delivery.message.body,
+                headers=headers,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+            ),
+            routing_key=routing_key
+        )
+
+    async def settle(self, deliveries, outcome):
+        for delivery in deliveries:
+            message = delivery.message
+            attempt = message.headers.get("x-attempt", 0) if message.headers else 0
+            record_settled(delivery.event_type, outcome, delivery.published_at)
+            if outcome == "ack":
+                await message.ack()
+            elif outcome == "requeue":
+                # Refused by the open circuit: not an attempt, just put it back
+                await message.nack(requeue=True)
+            elif outcome == "retry" and attempt < len(self.retry_queues):
+                await self.republish(delivery, self.retry_queues[attempt], attempt + 1)
+                await message.ack()
+                logger.info("Retrying delivery via %s (attempt %d)", self.retry_queues[attempt], attempt + 1)
+            else:
+                await self.republish(delivery, self.dead_letter_queue, attempt + 1)
+                await message.ack()
+                logger.warning("Dead-lettered delivery after %d attempts (%s)", attempt + 1, outcome)
+
+    async def deliver(self, deliveries, send):
+        outcome = "ack"
+        # Continue the trace of the first message; any others folded in are listed by request ID
+        trace_id, parent_id = deliveries[0].trace
+        request_ids = sorted({d.trace[0] for d in deliveries if d.trace[0]})
+        try:
+            with tracing.span("outsystems.notify", trace_id=trace_id, parent_id=parent_id,
+                              messages=len(deliveries), request_ids=request_ids):
+                await send
+        except CircuitOpenError:
+            outcome = "requeue"
+        except DeliveryError as e:
+            logger.warning("%s", e)
+            outcome = "retry"
+        except RejectedError as e:
+            logger.warning("%s", e)
+            outcome = "rejected"
+        except Exception as e:
+            logger.error("Error delivering notification: %s", e)
+            outcome = "error"
+
+        try:
+            await self.settle(deliveries, outcome)
+        except Exception as e:
+            # The channel went away; the broker redelivers unacked messages
+            logger.error("Could not settle %d deliveries: %s", len(deliveries), e)
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+
+    # Batching
+
+    async def batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.pending.get()]
+            deadline = loop.time() + NOTIFY_BATCH_WINDOW
+            while len(items) < NOTIFY_BATCH_MAX:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.pending.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            self.flush_batch(items)
+
+    def flush_batch(self, items):
+        merged = coalesce(items)
+        logger.debug("Flushing %d events as %d notifications", len(items), len(merged))
+
+        if OUTSYSTEMS_BULK_NOTIFY_URL:
+            deliveries = [d for group, _, _ in merged for d in group]
+            notifications = [(event_type, data) for _, event_type, data in merged]
+            self.spawn(self.deliver(deliveries, self.notify_outsystems_bulk(notifications)))
+            return
+
+        for deliveries, event_type, data in merged:
+            self.spawn(self.deliver(deliveries, self.notify_outsystems(event_type, data)))
+
+    # Consuming
+
+    async def on_message(self, message):
+        try:
+            payload = json.loads(message.body)
+            event_type = payload.get("event_type")
+            data = payload.get("data", {})
+        except Exception as e:
+            # Malformed message: park it instead of redelivering forever
+            logger.exception("Error processing message")
+            record_consumed("unknown")
+            await self.settle([self.to_delivery(message, "unknown")], "malformed")
+            return
+
+        logger.debug("New RabbitMQ Message: %s", event_type)
+        record_consumed(event_type)
+        await self.pending.put((self.to_delivery(message, event_type), event_type, data))
+
+    @staticmethod
+    def to_delivery(message, event_type):
+        return Delivery(message, event_type, published_at(message.headers),
+                        tracing.extract(message.headers, amqp=True))
+
+    async def poll_queue_depth(self):
+        queues = [self.queue_name, *self.retry_queues, self.dead_letter_queue]
+        while True:
+            try:
+                for name in queues:
+                    queue = await self.channel.declare_queue(name, passive=True)
+                    record_queue_depth(name, queue.declaration_result.message_count)
+            except Exception as e:
+                logger.warning("Could not read queue depth: %s", e)
+            await asyncio.sleep(QUEUE_DEPTH_INTERVAL)
+
+    async def start_consuming(self):
+        self.consumer_tag = await self.queue.consume(self.on_message)
+
+    def on_circuit_change(self, old_state, new_state):
+        if new_state == CircuitBreaker.OPEN:
+            self.spawn(self.pause_consuming())
+        elif new_state == CircuitBreaker.CLOSED:
+            self.spawn(self.restore_prefetch())
+
+    async def pause_consuming(self):
+        if self.consumer_tag is None:
+            return
+        logger.warning("Pausing consumption for %ss while OutSystems is unhealthy", CIRCUIT_RESET_TIMEOUT)
+        await self.queue.cancel(self.consumer_tag)
+        self.consumer_tag = None
+        await asyncio.sleep(CIRCUIT_RESET_TIMEOUT)
+
+        self.breaker.half_open()
+        # One message at a time until a probe succeeds
+        await self.channel.set_qos(prefetch_count=1)
+        await self.start_consuming()
+        logger.info("Resumed consumption with a single probe in flight")
+
+    async def restore_prefetch(self):
+        await self.channel.set_qos(prefetch_count=ASYNC_RABBITMQ_PREFETCH)
+        logger.info("OutSystems healthy again; consuming at full prefetch")
+
+    async def run(self):
+        await self.setup()
+        try:
+            await self.start_consuming()
+            self.spawn(self.poll_queue_depth())
+            logger.info("Consuming from queue: %s (prefetch=%s, asyncio)", self.queue_name, ASYNC_RABBITMQ_PREFETCH)
+            await self.batch_loop()
+        finally:
+            await self.close()
+
+
+if __name__ == "__main__":
+    log.setup("rabbitmq-listener")
+    tracing.configure("rabbitmq-listener")
+    logger.info("Async listener is running... waiting for messages.")
+    listener = AsyncListener(
+        os.environ["AMQP_URL"],
+        os.environ["RABBITMQ_QUEUE"],
+        os.environ["OUTSYSTEMS_NOTIFY_URL"]
+    )
+    start_metrics_server()
+    try:
+        asyncio.run(listener.run())
+    except KeyboardInterrupt:
+        pass
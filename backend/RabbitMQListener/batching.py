@@ -0,0 +1,148 @@
+"""
+Windowed batching and coalescing of notification events.
+
+Deliveries are collected for a short window (or until the batch is full) and
+handed off together. Bursts of the same kind of event for the same recipient
+and post, e.g. fifty new_like events on a post going viral, are merged into one
+"X and N others" notification before anything is sent to OutSystems.
+
+Comments carry text, so a merged new_comment keeps every comment in
+"comments" (text, author, id, time; oldest first) and its comment_text
+becomes a count ("3 new comments") rather than one comment's text.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# event_type -> (recipient field, actor username field, summary verb)
+COALESCIBLE_EVENTS = {
+    "new_like": ("post_owner_id", "liked_by_username", "liked your post"),
+    "new_comment": ("recipient_id", "commenter_username", "commented on your post"),
+}
+
+# event_type -> fields of each merged event kept in data["comments"]
+MERGED_ITEM_FIELDS = {
+    "new_comment": ("comment_id", "comment_text", "commenter_username", "commenter_id", "created_at"),
+}
+
+MAX_ACTORS_LISTED = 10
+
+
+def coalesce(items):
+    """
+    Merge coalescible events per (event_type, recipient, post).
+
+    items is a list of (delivery_tag, event_type, data). Returns a list of
+    (delivery_tags, event_type, data) in first-seen order, where delivery_tags
+    are all the deliveries folded into that notification.
+    """
+    groups = {}
+    order = []
+    for delivery_tag, event_type, data in items:
+        spec = COALESCIBLE_EVENTS.get(event_type)
+        if spec is None or not isinstance(data, dict):
+            key = ("single", delivery_tag)
+        else:
+            key = (event_type, str(data.get(spec[0])), str(data.get("post_id")))
+
+        if key not in groups:
+            groups[key] = ([], event_type, [])
+            order.append(key)
+        groups[key][0].append(delivery_tag)
+        groups[key][2].append(data)
+
+    merged = []
+    for key in order:
+        delivery_tags, event_type, events = groups[key]
+        if len(events) == 1:
+            merged.append((delivery_tags, event_type, events[0]))
+            continue
+
+        _, actor_field, verb = COALESCIBLE_EVENTS[event_type]
+        actors = []
+        for data in reversed(events):
+            actor = data.get(actor_field)
+            if actor and actor not in actors:
+                actors.append(actor)
+
+        # Keep the newest event's fields so the payload stays compatible
+        data = dict(events[-1])
+        data["actor_count"] = len(actors)
+        data["actors"] = actors[:MAX_ACTORS_LISTED]
+        data["coalesced_count"] = len(events)
+        if len(actors) > 1:
+            others = len(actors) - 1
+            data["summary"] = f"{actors[0]} and {others} {'other' if others == 1 else 'others'} {verb}"
+        elif actors:
+            data["summary"] = f"{actors[0]} {verb}"
+        if event_type in MERGED_ITEM_FIELDS:
+            fields = MERGED_ITEM_FIELDS[event_type]
+            data["comments"] = [{field: event.get(field) for field in fields} for event in events]
+            data["comment_text"] = f"{len(events)} new comments"
+        published = [event["bench_published_at"] for event in events if "bench_published_at" in event]
+        if published:
+            # Benchmark messages (bench/): every folded event's publish time, so latency counts each one
+            data["bench_published_ats"] = published
+        merged.append((delivery_tags, event_type, data))
+
+    return merged
+
+
+class Batcher:
+    def __init__(self, flush_fn, window=0.5, max_size=32):
+        # flush_fn(items) is called from the batcher thread with a non-empty list
+        self.flush_fn = flush_fn
+        self.window = window
+        self.max_size = max_size
+
+        self._items = []
+        self._first_at = None
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="notify-batcher", daemon=True)
+        self._thread.start()
+
+    def add(self, item):
+        with self._cond:
+            if not self._items:
+                self._first_at = time.monotonic()
+            self._items.append(item)
+            if len(self._items) == 1 or len(self._items) >= self.max_size:
+                self._cond.notify()
+
+    def _take(self):
+        with self._cond:
+            while not self._stopped:
+                if self._items:
+                    remaining = self._first_at + self.window - time.monotonic()
+                    if len(self._items) >= self.max_size or remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                else:
+                    self._cond.wait()
+            items = self._items[:self.max_size]
+            self._items = self._items[self.max_size:]
+            # Leftovers are already due, so they go out on the next pass
+            self._first_at = self._first_at if self._items else None
+            return items
+
+    def _run(self):
+        while True:
+            items = self._take()
+            if items:
+                try:
+                    self.flush_fn(items)
+                except Exception as e:
+                    logger.exception("Error flushing notification batch")
+            if self._stopped:
+                return
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
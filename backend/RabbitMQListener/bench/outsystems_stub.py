@@ -0,0 +1,130 @@
+"""
+Local stand-in for the OutSystems notification API.
+
+Accepts the single (OUTSYSTEMS_NOTIFY_URL) and bulk (OUTSYSTEMS_BULK_NOTIFY_URL)
+payload shapes on any path, sleeps for a configurable latency, fails a
+configurable fraction of requests with 503, and records when each benchmark
+message arrived so end-to-end latency can be computed.
+
+Run standalone:
+    python bench/outsystems_stub.py --port 8099 --latency-ms 50 --error-rate 0.01
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.notifications = 0
+        # Source messages covered, counting every event folded into a coalesced notification
+        self.messages = 0
+        # Publish-to-arrival seconds, one sample per source message (every folded event)
+        self.latencies = []
+
+    def record(self, notification):
+        data = notification.get("data")
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except ValueError:
+                data = {}
+        if not isinstance(data, dict):
+            data = {}
+
+        now = time.time()
+        with self.lock:
+            self.notifications += 1
+            self.messages += data.get("coalesced_count", 1)
+            if "bench_published_ats" in data:
+                self.latencies.extend(now - published for published in data["bench_published_ats"])
+            elif "bench_published_at" in data:
+                self.latencies.append(now - data["bench_published_at"])
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "notifications": self.notifications,
+                "messages": self.messages,
+            }
+
+
+def make_handler(stats, latency_ms, jitter_ms, error_rate):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length)
+
+            delay = max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000
+            time.sleep(delay)
+
+            with stats.lock:
+                stats.requests += 1
+                failed = random.random() < error_rate
+                if failed:
+                    stats.errors += 1
+
+            if failed:
+                self.reply(503, {"error": "stub failure"})
+                return
+
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                self.reply(400, {"error": "invalid json"})
+                return
+
+            for notification in payload.get("notifications", [payload]):
+                stats.record(notification)
+            self.reply(200, {"status": "ok"})
+
+        def reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_stub(port=8099, latency_ms=50, jitter_ms=10, error_rate=0.0):
+    """Start the stub on a background thread; returns (server, stats)."""
+    stats = StubStats()
+    server = ThreadingHTTPServer(("0.0.0.0", port), make_handler(stats, latency_ms, jitter_ms, error_rate))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="outsystems-stub", daemon=True).start()
+    return server, stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, stats = start_stub(args.port, args.latency_ms, args.jitter_ms, args.error_rate)
+    print(f"OutSystems stub listening on :{args.port}")
+    try:
+        while True:
+            time.sleep(5)
+            print(stats.snapshot())
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,87 @@
+"""
+Circuit breaker around the OutSystems notification endpoint.
+
+closed    -> requests flow; CIRCUIT_FAILURE_THRESHOLD consecutive failures open it
+open      -> requests are refused without being sent; after reset_timeout it goes half-open
+half_open -> a single probe request at a time; success closes it, failure re-opens it
+
+on_state_change(old, new) is called outside the lock so the listener can pause
+and resume consumption.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """The downstream is considered unhealthy; the request was not attempted."""
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, on_state_change=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = on_state_change
+
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _transition(self, new_state):
+        # Caller holds the lock; returns the change to report once it is released
+        old_state = self.state
+        if old_state == new_state:
+            return None
+        self.state = new_state
+        if new_state == self.OPEN:
+            self._opened_at = time.monotonic()
+        if new_state != self.HALF_OPEN:
+            self._probe_in_flight = False
+        return (old_state, new_state)
+
+    def _report(self, change):
+        if change and self.on_state_change:
+            logger.warning("Circuit breaker %s -> %s", change[0], change[1])
+            self.on_state_change(*change)
+
+    def before_request(self):
+        """Raise CircuitOpenError unless a request may be sent now."""
+        change = None
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError("OutSystems circuit is open")
+                change = self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    raise CircuitOpenError("OutSystems circuit is half-open; probe in flight")
+                self._probe_in_flight = True
+        self._report(change)
+
+    def half_open(self):
+        with self._lock:
+            change = self._transition(self.HALF_OPEN) if self.state == self.OPEN else None
+        self._report(change)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            change = self._transition(self.CLOSED)
+        self._report(change)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            change = None
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                change = self._transition(self.OPEN)
+        self._report(change)
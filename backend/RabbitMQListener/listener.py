@@ -1,48 +1,265 @@
 import json
+import logging
 import os
+import functools
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import pika
 import requests
-from amqp_lib import start_consuming_from_url
+from common import http_client, tracing, log
+from amqp_lib import start_consuming_from_url, declare_retry_topology
+from batching import Batcher, coalesce
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from outsystems import DeliveryError, RejectedError, to_payload, to_bulk_payload, \
+    is_retriable_status, check_status
+from metrics import start_metrics_server, published_at, record_consumed, record_settled, \
+    record_queue_depth, PUBLISHED_AT_HEADER, QUEUE_DEPTH_INTERVAL
+from settings import LISTENER_WORKERS, RABBITMQ_PREFETCH, OUTSYSTEMS_TIMEOUT, \
+    NOTIFY_BATCH_WINDOW, NOTIFY_BATCH_MAX, OUTSYSTEMS_BULK_NOTIFY_URL, RETRY_DELAYS, \
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=LISTENER_WORKERS, thread_name_prefix="notify")
+
+# One keep-alive connection per worker thread; failed deliveries are retried
+# through the retry queues, not by the HTTP client
+session = http_client.create_session(pool_hosts=1, pool_maxsize=LISTENER_WORKERS, max_retries=0)
+
+# A message as received; attempt counts earlier failed deliveries, trace is (trace_id, parent_span_id)
+Delivery = namedtuple(
+    "Delivery", ["channel", "delivery_tag", "body", "attempt", "event_type", "published_at", "trace"]
+)
+
+# Current consumer; only touched on the connection thread
+consumer = {"queue": None, "connection": None, "channel": None, "tag": None, "on_message": None}
+topology = {"retry_queues": [], "dead_letter_queue": None}
+
+
+def post_to_outsystems(url, body):
+    breaker.before_request()
+    try:
+        res = session.post(url, json=body, headers=tracing.inject({}), timeout=OUTSYSTEMS_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        breaker.record_failure()
+        raise DeliveryError(f"Failed to notify OutSystems: {str(e)}") from e
+
+    if is_retriable_status(res.status_code):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    check_status(res.status_code, res.text)
+    return res
 
 def notify_outsystems(event_type, data):
-    print(f"Forwarding to OutSystems | Type: {event_type}")
+    logger.debug("Forwarding to OutSystems | Type: %s", event_type)
+    res = post_to_outsystems(os.environ['OUTSYSTEMS_NOTIFY_URL'], to_payload(event_type, data))
+    logger.debug("Notification sent: %s", res.status_code)
 
-    payload = {
-        "event_type": event_type,
-        "data": json.dumps(data) 
-    }
-    print("Sending payload:")
-    print(json.dumps(payload, indent=2))
+def notify_outsystems_bulk(notifications):
+    logger.debug("Forwarding %d notifications to OutSystems in bulk", len(notifications))
+    res = post_to_outsystems(OUTSYSTEMS_BULK_NOTIFY_URL, to_bulk_payload(notifications))
+    logger.debug("Bulk notification sent: %s", res.status_code)
 
-    headers = {
-        "Content-Type": "application/json"
-    }
+def traced_notify(deliveries, fn, *args):
+    # Continue the trace of the first message; any others folded in are listed by request ID
+    trace_id, parent_id = deliveries[0].trace
+    request_ids = sorted({d.trace[0] for d in deliveries if d.trace[0]})
+    with tracing.span("outsystems.notify", trace_id=trace_id, parent_id=parent_id,
+                      messages=len(deliveries), request_ids=request_ids):
+        return fn(*args)
 
+def republish(delivery, routing_key, attempt):
+    headers = {"x-attempt": attempt}
+    if delivery.published_at is not None:
+        # Keep the original publish time so latency covers the retries too
+        headers[PUBLISHED_AT_HEADER] = delivery.published_at
+    if delivery.trace[0]:
+        headers[tracing.AMQP_REQUEST_ID_HEADER] = delivery.trace[0]
+        if delivery.trace[1]:
+            headers[tracing.AMQP_PARENT_SPAN_HEADER] = delivery.trace[1]
+    delivery.channel.basic_publish(
+        exchange='',
+        routing_key=routing_key,
+        body=delivery.body,
+        properties=pika.BasicProperties(delivery_mode=2, headers=headers)
+    )
+
+def settle(deliveries, outcome):
+    # Runs on the connection thread; deliveries from a dead channel are redelivered anyway
+    for delivery in deliveries:
+        ch = delivery.channel
+        if not ch.is_open:
+            continue
+        record_settled(delivery.event_type, outcome, delivery.published_at)
+
+        if outcome == "ack":
+            ch.basic_ack(delivery_tag=delivery.delivery_tag)
+        elif outcome == "requeue":
+            # Refused by the open circuit: not an attempt, just put it back
+            ch.basic_nack(delivery_tag=delivery.delivery_tag, requeue=True)
+        elif outcome == "retry" and delivery.attempt < len(topology["retry_queues"]):
+            retry_queue = topology["retry_queues"][delivery.attempt]
+            republish(delivery, retry_queue, delivery.attempt + 1)
+            ch.basic_ack(delivery_tag=delivery.delivery_tag)
+            logger.info("Retrying delivery via %s (attempt %d)", retry_queue, delivery.attempt + 1)
+        else:
+            republish(delivery, topology["dead_letter_queue"], delivery.attempt + 1)
+            ch.basic_ack(delivery_tag=delivery.delivery_tag)
+            logger.warning("Dead-lettered delivery after %d attempts (%s)", delivery.attempt + 1, outcome)
+
+def schedule_settle(deliveries, outcome):
+    connections = {d.channel.connection for d in deliveries}
+    for connection in connections:
+        try:
+            connection.add_callback_threadsafe(functools.partial(
+                settle, [d for d in deliveries if d.channel.connection is connection], outcome
+            ))
+        except Exception as e:
+            logger.error("Could not settle %d deliveries: %s", len(deliveries), e)
+
+def on_delivered(deliveries, future):
+    outcome = "ack"
     try:
-        res = requests.post(
-            os.environ['OUTSYSTEMS_NOTIFY_URL'],
-            json=payload,
-            headers=headers
-        )
-        print(f"Notification sent: {res.status_code}")
-        print("OutSystems response:")
-        print(res.text)
+        future.result()
+    except CircuitOpenError:
+        outcome = "requeue"
+    except DeliveryError as e:
+        logger.warning("%s", e)
+        outcome = "retry"
+    except RejectedError as e:
+        logger.warning("%s", e)
+        outcome = "rejected"
     except Exception as e:
-        print("Failed to notify OutSystems:", str(e))
+        logger.error("Error delivering notification: %s", e)
+        outcome = "error"
+    schedule_settle(deliveries, outcome)
+
+def flush_batch(items):
+    merged = coalesce(items)
+    logger.debug("Flushing %d events as %d notifications", len(items), len(merged))
+
+    if OUTSYSTEMS_BULK_NOTIFY_URL:
+        deliveries = [d for group, _, _ in merged for d in group]
+        future = executor.submit(
+            traced_notify, deliveries, notify_outsystems_bulk,
+            [(event_type, data) for _, event_type, data in merged]
+        )
+        future.add_done_callback(functools.partial(on_delivered, deliveries))
+        return
+
+    for deliveries, event_type, data in merged:
+        future = executor.submit(traced_notify, deliveries, notify_outsystems, event_type, data)
+        future.add_done_callback(functools.partial(on_delivered, deliveries))
+
+batcher = Batcher(flush_batch, window=NOTIFY_BATCH_WINDOW, max_size=NOTIFY_BATCH_MAX)
+
+def pause_consuming():
+    ch = consumer["channel"]
+    if ch is None or not ch.is_open or consumer["tag"] is None:
+        return
+    logger.warning("Pausing consumption for %ss while OutSystems is unhealthy", CIRCUIT_RESET_TIMEOUT)
+    ch.basic_cancel(consumer["tag"])
+    consumer["tag"] = None
+    consumer["connection"].call_later(CIRCUIT_RESET_TIMEOUT, resume_probing)
+
+def resume_probing():
+    ch = consumer["channel"]
+    if ch is None or not ch.is_open or consumer["tag"] is not None:
+        return
+    breaker.half_open()
+    # One message at a time until a probe succeeds
+    ch.basic_qos(prefetch_count=1)
+    consumer["tag"] = ch.basic_consume(queue=consumer["queue"], on_message_callback=consumer["on_message"])
+    logger.info("Resumed consumption with a single probe in flight")
+
+def restore_prefetch():
+    ch = consumer["channel"]
+    if ch is None or not ch.is_open:
+        return
+    ch.basic_qos(prefetch_count=RABBITMQ_PREFETCH)
+    logger.info("OutSystems healthy again; consuming at full prefetch")
+
+def on_circuit_change(old_state, new_state):
+    connection = consumer["connection"]
+    if connection is None:
+        return
+    if new_state == CircuitBreaker.OPEN:
+        connection.add_callback_threadsafe(pause_consuming)
+    elif new_state == CircuitBreaker.CLOSED:
+        connection.add_callback_threadsafe(restore_prefetch)
+
+breaker = CircuitBreaker(
+    failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=CIRCUIT_RESET_TIMEOUT,
+    on_state_change=on_circuit_change
+)
+
+def to_delivery(ch, method, properties, body, event_type):
+    headers = properties.headers or {}
+    return Delivery(
+        ch, method.delivery_tag, body, headers.get("x-attempt", 0), event_type, published_at(headers),
+        tracing.extract(headers, amqp=True)
+    )
 
 def callback(ch, method, properties, body):
     try:
         message = json.loads(body)
         event_type = message.get("event_type")
         data = message.get("data", {})
-        print(f"New RabbitMQ Message: {event_type}")
-        notify_outsystems(event_type, data)
     except Exception as e:
-        print("Error processing message:", str(e))
+        # Malformed message: park it instead of redelivering forever
+        logger.exception("Error processing message")
+        record_consumed("unknown")
+        settle([to_delivery(ch, method, properties, body, "unknown")], "malformed")
+        return
 
-if __name__ == "__main__":
-    print("Listener is running... waiting for messages.")
-    start_consuming_from_url(
-        os.environ["AMQP_URL"],
-        os.environ["RABBITMQ_QUEUE"],
-        callback
+    logger.debug("New RabbitMQ Message: %s", event_type)
+    record_consumed(event_type)
+    batcher.add((to_delivery(ch, method, properties, body, event_type), event_type, data))
+
+def poll_queue_depth():
+    ch = consumer["channel"]
+    if ch is None or not ch.is_open:
+        return
+    try:
+        for queue in [consumer["queue"], *topology["retry_queues"], topology["dead_letter_queue"]]:
+            result = ch.queue_declare(queue=queue, passive=True)
+            record_queue_depth(queue, result.method.message_count)
+    except Exception as e:
+        logger.warning("Could not read queue depth: %s", e)
+        return
+    consumer["connection"].call_later(QUEUE_DEPTH_INTERVAL, poll_queue_depth)
+
+def on_consume(connection, channel, consumer_tag):
+    retry_queues, dead_letter_queue = declare_retry_topology(
+        channel, consumer["queue"], RETRY_DELAYS
     )
+    topology["retry_queues"] = retry_queues
+    topology["dead_letter_queue"] = dead_letter_queue
+    consumer.update(connection=connection, channel=channel, tag=consumer_tag)
+    poll_queue_depth()
+
+    # Reconnected while OutSystems is still down: stay paused
+    if breaker.state == CircuitBreaker.OPEN:
+        pause_consuming()
+
+if __name__ == "__main__":
+    log.setup("rabbitmq-listener")
+    tracing.configure("rabbitmq-listener")
+    logger.info("Listener is running... waiting for messages.")
+    consumer["queue"] = os.environ["RABBITMQ_QUEUE"]
+    consumer["on_message"] = callback
+    start_metrics_server()
+    try:
+        start_consuming_from_url(
+            os.environ["AMQP_URL"],
+            consumer["queue"],
+            callback,
+            prefetch_count=RABBITMQ_PREFETCH,
+            auto_ack=False,
+            on_consume=on_consume
+        )
+    finally:
+        batcher.stop()
+        executor.shutdown(wait=True)
@@ -0,0 +1,72 @@
+"""
+Prometheus metrics for the notification pipeline, shared by both entry points.
+
+Delivery latency is measured from the x-published-at header the social service
+stamps on every message (epoch seconds) to the moment the listener settles it,
+so it includes time spent queued, batched and in retry queues.
+"""
+
+import logging
+import os
+import time
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9102"))
+QUEUE_DEPTH_INTERVAL = float(os.environ.get("QUEUE_DEPTH_INTERVAL", "15"))
+
+PUBLISHED_AT_HEADER = "x-published-at"
+
+CONSUMED = Counter(
+    "notifications_consumed_total",
+    "Messages received from RabbitMQ",
+    ["event_type"]
+)
+DELIVERED = Counter(
+    "notifications_delivered_total",
+    "Messages delivered to OutSystems (acked)",
+    ["event_type"]
+)
+FAILED = Counter(
+    "notifications_failed_total",
+    "Messages that were not delivered, by outcome (retry, rejected, error, malformed, requeue)",
+    ["event_type", "outcome"]
+)
+DELIVERY_LATENCY = Histogram(
+    "notification_delivery_latency_seconds",
+    "Time from publish in the social service to delivery to OutSystems",
+    ["event_type"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+)
+QUEUE_DEPTH = Gauge(
+    "notifications_queue_depth",
+    "Messages ready in each notification queue",
+    ["queue"]
+)
+
+
+def start_metrics_server():
+    start_http_server(METRICS_PORT)
+    logger.info("Metrics available on :%s/metrics", METRICS_PORT)
+
+def published_at(headers):
+    try:
+        return float((headers or {})[PUBLISHED_AT_HEADER])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def record_consumed(event_type):
+    CONSUMED.labels(event_type=str(event_type)).inc()
+
+def record_settled(event_type, outcome, published):
+    event_type = str(event_type)
+    if outcome == "ack":
+        DELIVERED.labels(event_type=event_type).inc()
+        if published is not None:
+            DELIVERY_LATENCY.labels(event_type=event_type).observe(max(0.0, time.time() - published))
+    else:
+        FAILED.labels(event_type=event_type, outcome=outcome).inc()
+
+def record_queue_depth(queue, message_count):
+    QUEUE_DEPTH.labels(queue=queue).set(message_count)
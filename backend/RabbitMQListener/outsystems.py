@@ -0,0 +1,33 @@
+"""
+OutSystems notification API payloads and response classification.
+"""
+
+import json
+
+
+class DeliveryError(Exception):
+    """OutSystems could not take the notification right now; the message should be retried."""
+
+
+class RejectedError(Exception):
+    """OutSystems refused the notification; retrying will not help."""
+
+
+def to_payload(event_type, data):
+    return {
+        "event_type": event_type,
+        "data": json.dumps(data)
+    }
+
+def to_bulk_payload(notifications):
+    return {"notifications": [to_payload(event_type, data) for event_type, data in notifications]}
+
+def is_retriable_status(status_code):
+    return status_code >= 500 or status_code == 429
+
+def check_status(status_code, text):
+    """Raise for a response that did not deliver the notification."""
+    if is_retriable_status(status_code):
+        raise DeliveryError(f"OutSystems returned {status_code}")
+    if status_code >= 400:
+        raise RejectedError(f"OutSystems rejected notification: {status_code} {text[:200]}")
@@ -0,0 +1,38 @@
+"""
+Listener configuration, shared by the threaded (listener.py) and asyncio
+(async_listener.py) entry points.
+"""
+
+import os
+
+# Outbound deliveries run on a bounded worker pool; the broker never hands us
+# more than RABBITMQ_PREFETCH unacked messages, so the pool queue stays bounded too.
+LISTENER_WORKERS = int(os.environ.get("LISTENER_WORKERS", "16"))
+RABBITMQ_PREFETCH = int(os.environ.get("RABBITMQ_PREFETCH", str(LISTENER_WORKERS * 2)))
+OUTSYSTEMS_TIMEOUT = (
+    float(os.environ.get("OUTSYSTEMS_CONNECT_TIMEOUT", "3")),
+    float(os.environ.get("OUTSYSTEMS_READ_TIMEOUT", "10"))
+)
+
+# Events are gathered for NOTIFY_BATCH_WINDOW seconds (or NOTIFY_BATCH_MAX events)
+# and bursts for the same recipient and post are merged before sending.
+NOTIFY_BATCH_WINDOW = float(os.environ.get("NOTIFY_BATCH_WINDOW", "0.5"))
+NOTIFY_BATCH_MAX = int(os.environ.get("NOTIFY_BATCH_MAX", str(RABBITMQ_PREFETCH)))
+# Optional bulk endpoint taking {"notifications": [...]}; without it each merged
+# notification is posted to OUTSYSTEMS_NOTIFY_URL on its own.
+OUTSYSTEMS_BULK_NOTIFY_URL = os.environ.get("OUTSYSTEMS_BULK_NOTIFY_URL")
+
+# Failed deliveries are retried through delay queues with exponential backoff
+# (base, 2*base, 4*base, ...) and dead-lettered after NOTIFY_MAX_ATTEMPTS.
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get("NOTIFY_MAX_ATTEMPTS", "5"))
+NOTIFY_RETRY_BASE_DELAY = float(os.environ.get("NOTIFY_RETRY_BASE_DELAY", "5"))
+RETRY_DELAYS = [NOTIFY_RETRY_BASE_DELAY * 2 ** n for n in range(NOTIFY_MAX_ATTEMPTS - 1)]
+
+# Consumption is paused while OutSystems is failing
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# asyncio mode: cap on concurrent outbound requests (shared connection pool size)
+ASYNC_MAX_IN_FLIGHT = int(os.environ.get("ASYNC_MAX_IN_FLIGHT", "200"))
+# No thread pool to size against, so prefetch defaults to the in-flight cap
+ASYNC_RABBITMQ_PREFETCH = int(os.environ.get("RABBITMQ_PREFETCH", str(ASYNC_MAX_IN_FLIGHT)))
@@ -0,0 +1,524 @@
+"""
+asyncio variant of social.py: the same routes and responses on aiohttp, with
+the async PostgREST client and one robust aio-pika connection for
+notifications (instead of a pika connection per publish). Independent lookups
+run concurrently: the post owner and the existing like in like_post, the post
+and the parent comment in comment_post. Everything but request parsing and
+I/O is shared with social.py (social_core.py).
+
+The like buffer and purge worker keep their background threads; the buffer's
+flush runs on the event loop, the purge worker uses a blocking client of its
+own. Live streams use asyncio queues (live.py).
+
+Run with:
+    gunicorn -c common/gunicorn_conf.py async_social:app    (WEB_WORKER_CLASS=aiohttp.GunicornWebWorker)
+    python async_social.py                                  (development)
+"""
+
+from aiohttp import web
+import aio_pika
+import asyncio
+import os
+import logging
+import json
+from datetime import datetime
+from live import EventRelay
+from comment_tree import build_comment_tree
+from notification_dedup import NotificationDedup, metrics
+import social_core
+from social_core import BULK_TABLES
+from common import aio, bulk, cache, db, events, idempotency, lifecycle, singleflight, tracing
+
+
+app = web.Application()
+aio.init_app(app, "social-service")
+logger = logging.getLogger(__name__)
+routes = web.RouteTableDef()
+
+# Initialise Supabase
+supabase_url = os.environ.get("SUPABASE_URL")
+supabase_key = os.environ.get("SUPABASE_KEY")
+supabase = tracing.trace_async_supabase(db.create_async_client(supabase_url, supabase_key))
+
+def authenticate(request):
+    return social_core.authenticate(request.headers.get('Authorization'))
+
+def unauthorized():
+    return aio.json_response({'error': 'Invalid or missing token'}, 401)
+
+# RabbitMQ connection, opened on first publish and reconnected by aio-pika
+class NotificationPublisher:
+    def __init__(self, amqp_url, queue_name='notifications'):
+        self.amqp_url = amqp_url
+        self.queue_name = queue_name
+        self.connection = None
+        self.channel = None
+        self._lock = None
+        self.dedup = NotificationDedup()
+
+    async def _channel(self):
+        if self._lock is None:
+            # Created on the running loop (Python 3.9 binds locks when they are made)
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.channel is None:
+                self.connection = await aio_pika.connect_robust(self.amqp_url)
+                self.channel = await self.connection.channel()
+                await self.channel.declare_queue(self.queue_name, durable=True)
+            return self.channel
+
+    async def publish(self, notifications):
+        # notifications is a list of (event_type, data); all are sent over the shared channel
+        admitted = social_core.admit_notifications(self.dedup, notifications)
+        if not admitted:
+            return
+        with tracing.span("amqp.publish", queue=self.queue_name, messages=len(admitted),
+                          suppressed=len(notifications) - len(admitted)):
+            try:
+                channel = await self._channel()
+                headers = social_core.notification_headers()
+                for event_type, data in admitted:
+                    await channel.default_exchange.publish(
+                        aio_pika.Message(
+                            json.dumps(social_core.notification_message(event_type, data)).encode("utf-8"),
+                            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                            headers=headers
+                        ),
+                        routing_key=self.queue_name
+                    )
+            except Exception:
+                self.dedup.release(admitted)
+                raise
+        self.dedup.published(admitted)
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+
+publisher = NotificationPublisher(os.environ.get("AMQP_URL"))
+
+async def publish_notification(event_type, data):
+    await publisher.publish([(event_type, data)])
+
+async def flush_likes_async(entries):
+    inserts, deletes = social_core.like_changes(entries)
+
+    await asyncio.gather(*(
+        supabase.table("likes")
+            .delete()
+            .eq("post_id", post_id)
+            .in_("liked_by_user_id", social_core.liked_by(post_entries))
+            .execute()
+        for post_id, post_entries in deletes.items()
+    ))
+    for post_id, post_entries in deletes.items():
+        social_core.likes_removed(post_id, post_entries)
+
+    existing = await asyncio.gather(*(
+        supabase.table("likes")
+            .select("liked_by_user_id")
+            .eq("post_id", post_id)
+            .in_("liked_by_user_id", social_core.liked_by(post_entries))
+            .execute()
+        for post_id, post_entries in inserts.items()
+    ))
+    rows = []
+    for post_entries, result in zip(inserts.values(), existing):
+        rows.extend(social_core.not_yet_liked(post_entries, result.data))
+
+    if not rows:
+        return
+
+    await supabase.table("likes").insert([social_core.like_row(e) for e in rows]).execute()
+
+    try:
+        await publisher.publish([social_core.like_notification(e) for e in rows])
+    except Exception as e:
+        # The likes are stored; a lost notification must not make the flush retry them
+        logger.error("Error publishing buffered like notifications: %s", e)
+
+# Set when the app starts; the like buffer's thread hands flushes to it
+event_loop = None
+
+like_buffer = None
+if social_core.LIKE_WRITE_BEHIND:
+    def flush_likes(entries):
+        asyncio.run_coroutine_threadsafe(flush_likes_async(entries), event_loop).result()
+
+    like_buffer = social_core.create_like_buffer(flush_likes)
+    lifecycle.on_shutdown(like_buffer.stop)
+
+# Live like/comment deltas for subscribed clients (SSE)
+live_events = social_core.create_live_hub()
+# Close open streams on shutdown; EventSource reconnects to another worker
+lifecycle.on_drain(live_events.close)
+# Changes reach the streams of every worker through the domain events exchange
+live_relay = EventRelay(live_events)
+
+# Concurrent reads of one post's likes or comments share a single query (results are read-only)
+post_reads = singleflight.AsyncSingleFlight()
+
+# The purge worker runs on its own thread, with a blocking client of its own
+purge_worker = social_core.create_purge_worker(tracing.trace_supabase(db.create_client(supabase_url, supabase_key)))
+
+# Responses to like/comment POSTs, replayed when a client retries with the same Idempotency-Key
+# Shared by all workers through the database; its queries run on a worker thread
+idempotency_store = idempotency.create_store(tracing.trace_supabase(db.create_client(supabase_url, supabase_key)))
+
+def find_post_owner(post_id):
+    return supabase.table("post").select("user_id").eq("id", post_id).single().execute()
+
+def find_existing_like(post_id, user_id, columns="*"):
+    return supabase.table("likes") \
+        .select(columns) \
+        .eq("post_id", post_id) \
+        .eq("liked_by_user_id", user_id) \
+        .execute()
+
+@routes.post('/api/social/like')
+@idempotency.idempotent_async(idempotency_store)
+async def like_post(request):
+    payload = authenticate(request)
+    if not payload:
+        return unauthorized()
+
+    data = await aio.read_json(request) or {}
+    post_id = data.get('post_id')
+    if not post_id:
+        return aio.json_response({'error': 'Missing post_id'}, 400)
+
+    if like_buffer is not None:
+        return await buffered_like(post_id, payload)
+
+    # The post owner and this user's existing like are independent lookups
+    post_resp, existing_like = await asyncio.gather(
+        find_post_owner(post_id), find_existing_like(post_id, payload["user_id"])
+    )
+    if not post_resp.data:
+        return aio.json_response({"error": "Post not found"}, 404)
+
+    post_owner_id = post_resp.data["user_id"]
+
+    if existing_like.data:
+        # Unlike: delete the like
+        await supabase.table("likes") \
+            .delete() \
+            .eq("post_id", post_id) \
+            .eq("liked_by_user_id", payload["user_id"]) \
+            .execute()
+        events.publish("like_removed", {"post_id": post_id, "liked_by_user_id": payload["user_id"]})
+        return aio.json_response(*social_core.like_toggled(post_reads, live_relay, post_id, payload, liked=False))
+
+    # Insert like into Supabase
+    like = social_core.like_entry(post_id, payload, post_owner_id)
+    await supabase.table("likes").insert(social_core.like_row(like)).execute()
+    body, status = social_core.like_toggled(post_reads, live_relay, post_id, payload, liked=True)
+
+    # Send event to RabbitMQ
+    await publish_notification(*social_core.like_notification(like))
+    return aio.json_response(body, status)
+
+async def buffered_like(post_id, payload):
+    liked = like_buffer.state(post_id, payload["user_id"])
+    if liked is None:
+        post_resp, existing_like = await asyncio.gather(
+            find_post_owner(post_id), find_existing_like(post_id, payload["user_id"], "liked_by_user_id")
+        )
+        liked = bool(existing_like.data)
+    else:
+        post_resp = await find_post_owner(post_id)
+    if not post_resp.data:
+        return aio.json_response({"error": "Post not found"}, 404)
+
+    # The toggle is journaled before we answer, so it survives a crash before the flush;
+    # the journal write blocks, so it runs on a worker thread
+    await asyncio.to_thread(
+        like_buffer.record,
+        post_id,
+        payload["user_id"],
+        payload["username"],
+        post_resp.data["user_id"],
+        liked=not liked,
+        base=liked,
+        created_at=datetime.now().isoformat()
+    )
+    # get_likes overlays the buffered toggle, so cached responses are already stale
+    return aio.json_response(*social_core.like_toggled(post_reads, live_relay, post_id, payload, liked=not liked))
+
+async def find_reply_target(parent_comment_id):
+    parent_resp = await supabase.table("comments").select("user_id").eq("id", parent_comment_id).single().execute()
+    return parent_resp.data["user_id"] if parent_resp.data else None
+
+@routes.post('/api/social/comment')
+@idempotency.idempotent_async(idempotency_store)
+async def comment_post(request):
+    payload = authenticate(request)
+    if not payload:
+        return unauthorized()
+
+    data = await aio.read_json(request) or {}
+    post_id = data.get('post_id')
+    comment_text = data.get('comment')
+    parent_comment_id = data.get('parent_comment_id')
+    reply_to_user_id = data.get('reply_to_user_id')
+
+    if not post_id or not comment_text:
+        return aio.json_response({'error': 'Missing post_id or comment'}, 400)
+
+    # Post owner and, if the frontend did not send it, the user being replied to
+    if not reply_to_user_id and parent_comment_id:
+        post_resp, reply_to_user_id = await asyncio.gather(
+            find_post_owner(post_id), find_reply_target(parent_comment_id)
+        )
+    else:
+        post_resp = await find_post_owner(post_id)
+    if not post_resp.data:
+        return aio.json_response({"error": "Post not found"}, 404)
+    post_owner_id = post_resp.data["user_id"]
+
+    # Insert comment (with reply info)
+    row = social_core.comment_row(post_id, payload, comment_text, parent_comment_id, reply_to_user_id)
+    result = await supabase.table("comments").insert(row).execute()
+
+    if not result.data:
+        return aio.json_response({'error': 'Failed to insert comment'}, 500)
+
+    comment = result.data[0]
+    body, status = social_core.comment_added(post_reads, live_relay, post_id, comment, payload)
+
+    notification = social_core.comment_notification(row, comment, payload, post_owner_id)
+    if notification:
+        await publish_notification(*notification)
+
+    return aio.json_response(body, status)
+
+# Short-lived ticket for opening a stream; EventSource cannot send the access token in a header
+@routes.post('/api/social/stream/ticket')
+async def stream_ticket(request):
+    payload = authenticate(request)
+    if not payload:
+        return unauthorized()
+
+    response = aio.json_response(social_core.stream_ticket(payload))
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# Server-Sent Events stream of like/comment deltas for the given posts
+@routes.get('/api/social/stream')
+async def stream_post_events(request):
+    payload = social_core.verify_stream_ticket(request.query.get('ticket'))
+    if not payload:
+        return aio.json_response({'error': 'Invalid or expired stream ticket'}, 401)
+
+    post_ids, error = social_core.stream_post_ids(request.query.get('post_ids'))
+    if error:
+        return aio.json_response(*error)
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        tracing.REQUEST_ID_HEADER: tracing.current_trace_id()
+    })
+    await response.prepare(request)
+    live_relay.start(asyncio.get_running_loop())
+    subscription = live_events.subscribe(post_ids, asyncio.Queue)
+    try:
+        async for frame in live_events.astream(subscription):
+            await response.write(frame.encode("utf-8"))
+    except ConnectionResetError:
+        pass
+    return response
+
+async def load_likes(post_id):
+    response = await supabase.table("likes").select("*").eq("post_id", post_id).execute()
+    return response.data
+
+# get likes for the post
+@routes.get('/api/social/likes/{post_id}')
+async def get_likes(request):
+    payload = authenticate(request)
+    if not payload:
+        return unauthorized()
+    post_id = request.match_info['post_id']
+
+    try:
+        # Concurrent requests for the same post share one query
+        likes_data = await post_reads.do(("likes", str(post_id)), lambda: load_likes(post_id))
+
+        pending = like_buffer.pending_for_post(post_id) if like_buffer is not None else []
+        return aio.json_response(social_core.likes_response(likes_data, pending, payload['user_id']),
+                                 headers=cache.cacheable(cache.post_key(post_id), cache.likes_key(post_id), per_user=True))
+
+    except Exception as e:
+        logger.exception("Error in get_likes")
+        return aio.json_response({'error': str(e)}, 500)
+
+async def load_comment_tree(post_id):
+    """Top-level comments of a post, each with its (flattened) replies."""
+    comments = await supabase.table("comments") \
+        .select("*") \
+        .eq("post_id", post_id) \
+        .order("created_at", desc=False) \
+        .execute()
+    return build_comment_tree(comments.data)
+
+# get all the comments under the post
+@routes.get('/api/social/comments/{post_id}')
+async def get_comments(request):
+    payload = authenticate(request)
+    if not payload:
+        return unauthorized()
+    post_id = request.match_info['post_id']
+
+    try:
+        # Concurrent requests for the same post share one query and one tree
+        structured_comments = await post_reads.do(("comments", str(post_id)), lambda: load_comment_tree(post_id))
+        return aio.json_response({'comments': structured_comments},
+                                 headers=cache.cacheable(cache.post_key(post_id), cache.comments_key(post_id)))
+
+    except Exception as e:
+        logger.exception("Error in get_comments")
+        return aio.json_response({'error': str(e)}, 500)
+
+@routes.delete('/api/social/posts')
+async def delete_post_social_data(request):
+    payload = authenticate(request)
+    if not payload:
+        return unauthorized()
+
+    data = await aio.read_json(request)
+    if not data or 'post_id' not in data:
+        return aio.json_response({'error': 'Missing post_id in request body'}, 400)
+
+    post_id = data['post_id']
+    # The like buffer and the purge worker write their files; keep that off the event loop
+    if like_buffer is not None:
+        await asyncio.to_thread(like_buffer.discard, post_id=post_id)
+    social_core.post_data_purging(post_reads, post_id)
+
+    try:
+        job = await asyncio.to_thread(purge_worker.submit, "post", post_id, payload['user_id'])
+        return aio.json_response({
+            'message': 'Post social data deletion started',
+            'job': job
+        }, 202)
+
+    except Exception as e:
+        logger.exception("Error deleting post social data")
+        return aio.json_response({'error': str(e)}, 500)
+
+@routes.delete('/api/social/user/{user_id}')
+async def delete_user_social_data(request):
+    payload = authenticate(request)
+    if not payload:
+        return unauthorized()
+    user_id = request.match_info['user_id']
+
+    # Check if the authenticated user matches the requested user_id
+    if str(payload.get('user_id')) != str(user_id):
+        logger.warning("User %s may not delete the social data of user %s", payload.get('user_id'), user_id)
+        return aio.json_response({'error': 'Unauthorized to delete this data'}, 403)
+
+    if like_buffer is not None:
+        await asyncio.to_thread(like_buffer.discard, user_id=user_id)
+
+    try:
+        # Likes and comments are deleted in chunks by the purge worker
+        job = await asyncio.to_thread(purge_worker.submit, "user", user_id, payload['user_id'])
+        logger.info("Queued purge job %s for user %s", job['id'], user_id)
+        return aio.json_response({
+            'message': 'User social data deletion started',
+            'job': job
+        }, 202)
+
+    except Exception as e:
+        logger.exception("Error deleting user social data")
+        return aio.json_response({'error': str(e)}, 500)
+
+# Progress of a background purge
+@routes.get('/api/social/purge/{job_id}')
+async def get_purge_job(request):
+    payload = authenticate(request)
+    if not payload:
+        return unauthorized()
+
+    # get() waits for the worker thread while it saves the job file
+    job = await asyncio.to_thread(purge_worker.get, request.match_info['job_id'])
+    error = social_core.purge_job_error(job, payload, "view")
+    if error:
+        return aio.json_response(*error)
+
+    return aio.json_response({'job': job})
+
+# Re-queue a purge that gave up after repeated chunk failures
+@routes.post('/api/social/purge/{job_id}/resume')
+async def resume_purge_job(request):
+    payload = authenticate(request)
+    if not payload:
+        return unauthorized()
+    job_id = request.match_info['job_id']
+
+    job = await asyncio.to_thread(purge_worker.get, job_id)
+    error = social_core.purge_job_error(job, payload, "resume")
+    if error:
+        return aio.json_response(*error)
+
+    job = await asyncio.to_thread(purge_worker.resume, job_id)
+    if not job:
+        return aio.json_response({'error': 'Only failed jobs can be resumed'}, 409)
+
+    return aio.json_response({'job': job}, 202)
+
+# Bulk export of likes or comments as NDJSON, for backfills and analytics (common/bulk.py)
+@routes.get('/api/social/admin/export/{table}')
+async def export_social_data(request):
+    payload = authenticate(request)
+    if not payload:
+        return unauthorized()
+    table = request.match_info['table']
+    error = social_core.bulk_request_error(payload, table)
+    if error:
+        return aio.json_response(*error)
+
+    return await bulk.export_response_async(request, supabase, table, BULK_TABLES[table])
+
+# Bulk import of NDJSON likes or comments in batches; streams a report line per batch
+@routes.post('/api/social/admin/import/{table}')
+async def import_social_data(request):
+    payload = authenticate(request)
+    if not payload:
+        return unauthorized()
+    table = request.match_info['table']
+    error = social_core.bulk_request_error(payload, table)
+    if error:
+        return aio.json_response(*error)
+
+    logger.info("User %s is importing %s", payload.get('user_id'), table)
+    return await bulk.import_response_async(request, supabase, table, BULK_TABLES[table],
+                                            after_batch=lambda rows: social_core.social_data_imported(post_reads, table, rows))
+
+# Internal: not routed by the gateway
+@routes.get('/metrics')
+async def get_metrics(request):
+    body, content_type = metrics()
+    return web.Response(body=body, headers={'Content-Type': content_type})
+
+async def start_background_work(app):
+    global event_loop
+    event_loop = asyncio.get_running_loop()
+    purge_worker.start()
+    if like_buffer is not None:
+        like_buffer.start()
+
+async def close_clients(app):
+    # After lifecycle.shutdown(), which flushes the like buffer through these clients
+    await publisher.close()
+    await supabase.aclose()
+
+app.add_routes(routes)
+app.on_startup.append(start_background_work)
+app.on_cleanup.append(close_clients)
+
+if __name__ == '__main__':
+    web.run_app(app, host='0.0.0.0', port=5003, access_log=None)
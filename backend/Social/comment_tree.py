@@ -0,0 +1,59 @@
+"""
+Threads a post's comments for display: top-level comments, each with every
+reply under it (at any depth) flattened into its "replies", oldest first.
+Shared by social.py and async_social.py.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def build_comment_tree(comments):
+    """comments: the post's rows ordered by created_at; they are modified in place."""
+    # If no comments exist, return empty array
+    if not comments:
+        return []
+
+    # Organize comments into a simplified structure
+    structured_comments = []
+    replies_map = {}
+
+    for comment in comments:
+        if comment.get('parent_comment_id') is None:
+            # This is an original comment
+            comment['replies'] = []
+            structured_comments.append(comment)
+            replies_map[comment['id']] = comment['replies']
+        else:
+            # This is a reply - add it to the parent's replies
+            try:
+                # Find the original parent comment
+                original_parent_id = find_original_parent(comments, comment['parent_comment_id'])
+                if original_parent_id in replies_map:
+                    # Don't modify the comment text here - the frontend will handle the mention
+                    replies_map[original_parent_id].append(comment)
+            except Exception as e:
+                logger.warning("Error processing reply %s: %s", comment['id'], e)
+                continue
+
+    # Sort replies by timestamp for each parent comment
+    for comment in structured_comments:
+        if 'replies' in comment:
+            comment['replies'].sort(key=lambda x: x.get('created_at', ''))
+
+    return structured_comments
+
+
+def find_original_parent(comments, reply_id):
+    """
+    Recursively find the original parent comment ID
+    """
+    try:
+        comment = next((c for c in comments if c['id'] == reply_id), None)
+        if not comment or comment.get('parent_comment_id') is None:
+            return reply_id
+        return find_original_parent(comments, comment['parent_comment_id'])
+    except Exception as e:
+        logger.warning("Error in find_original_parent: %s", e)
+        return reply_id
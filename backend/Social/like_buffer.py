@@ -0,0 +1,315 @@
+"""
+Write-behind buffer for like/unlike toggles.
+
+Like state changes are held in memory per (post, user) and flushed in batches.
+Toggling a like back and forth before a flush collapses to no change at all, so
+only the net difference against the database is written.
+
+Every change is appended to a journal file before the request is acknowledged,
+and the journal is replayed on start-up, so a crash of the process between the
+acknowledgement and the flush does not lose likes. The journal is fsync'd once
+per flush interval by the flusher thread (group commit) rather than per toggle:
+the social service runs in one process (a single gevent worker), where an fsync
+per toggle would stall every request on disk. An OS crash or power loss can
+therefore lose the toggles of the last flush interval.
+
+When a batch fails it is written again one post at a time, and a post that
+still fails one change at a time, so one bad row (a like on a post deleted in
+the meantime) does not hold back the rest. A change the database rejects for
+good (SQLSTATE class 22 or 23) or keeps rejecting for max_attempts flushes is
+dropped and appended to the dead-letter file (<journal>.dead). Failures that
+carry no database error code (connection errors, timeouts) are retried without
+limit.
+"""
+
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# SQLSTATE classes a retry cannot fix: data exceptions and integrity constraint violations
+PERMANENT_SQLSTATE_CLASSES = ("22", "23")
+
+
+def database_error_code(exc):
+    """The SQLSTATE/PostgREST code of an error the database answered with, else None."""
+    code = getattr(exc, "code", None)
+    return str(code) if code else None
+
+
+def is_permanent(exc):
+    code = database_error_code(exc)
+    return code is not None and len(code) == 5 and code[:2] in PERMANENT_SQLSTATE_CLASSES
+
+
+class LikeBuffer:
+    def __init__(self, flush_fn, journal_path, flush_interval=1.0, max_pending=500, max_attempts=5):
+        # flush_fn(entries) receives a list of net changes and must raise on failure;
+        # it must be safe to call again with changes that already landed
+        self.flush_fn = flush_fn
+        self.journal_path = journal_path
+        self.dead_letter_path = journal_path + ".dead"
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+
+        self._pending = {}
+        # Batch currently being written; still the source of truth until it lands
+        self._inflight = {}
+        # Journal has writes that are not fsync'd yet
+        self._unsynced = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        journal_dir = os.path.dirname(journal_path)
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok=True)
+        self._replay()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    @staticmethod
+    def _key(post_id, user_id):
+        return (str(post_id), str(user_id))
+
+    def _replay(self):
+        # A leftover ".flushing" file is an interrupted flush; it is older than the journal
+        for path in (self.journal_path + ".flushing", self.journal_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn final write from a crash; everything before it is intact
+                        logger.warning("Skipping corrupt like journal line in %s", path)
+                        continue
+                    self._merge(entry)
+
+        if self._pending:
+            logger.info("Recovered %d buffered like changes from journal", len(self._pending))
+        self._rewrite_journal()
+        if os.path.exists(self.journal_path + ".flushing"):
+            os.remove(self.journal_path + ".flushing")
+
+    def _merge(self, entry):
+        key = self._key(entry["post_id"], entry["liked_by_user_id"])
+        current = self._pending.get(key)
+        if current is not None:
+            # Keep the state the database had before the first buffered change
+            entry = dict(entry, base=current["base"])
+        if entry["liked"] == entry["base"]:
+            # Flip-flop: net change is nothing
+            self._pending.pop(key, None)
+        else:
+            self._pending[key] = entry
+
+    def _rewrite_journal(self, path=None, entries=None):
+        path = path or self.journal_path
+        entries = self._pending if entries is None else entries
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in entries.values():
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def state(self, post_id, user_id):
+        """Buffered like state for (post, user), or None if nothing is pending."""
+        key = self._key(post_id, user_id)
+        with self._lock:
+            entry = self._pending.get(key) or self._inflight.get(key)
+            return None if entry is None else entry["liked"]
+
+    def pending_for_post(self, post_id):
+        with self._lock:
+            merged = dict(self._inflight)
+            merged.update(self._pending)
+            return [dict(e) for (p, _), e in merged.items() if p == str(post_id)]
+
+    def discard(self, post_id=None, user_id=None):
+        """Drop buffered changes for a post or user whose social data is being purged."""
+        def matches(key):
+            return (post_id is not None and key[0] == str(post_id)) or \
+                (user_id is not None and key[1] == str(user_id))
+
+        with self._lock:
+            dropped = [key for key in self._pending if matches(key)]
+            for key in dropped:
+                del self._pending[key]
+            # A batch being written keeps going, but its dropped changes are not
+            # merged back if it fails, nor replayed after a crash
+            inflight = [key for key in self._inflight if matches(key)]
+            for key in inflight:
+                del self._inflight[key]
+            if dropped:
+                self._journal.close()
+                self._rewrite_journal()
+                self._journal = open(self.journal_path, "a", encoding="utf-8")
+                self._unsynced = False
+            if inflight:
+                self._rewrite_journal(self.journal_path + ".flushing", self._inflight)
+
+    def _sync_journal(self):
+        if self._unsynced:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._unsynced = False
+
+    def sync(self):
+        """fsync the changes journaled since the last sync; run by the flusher each interval."""
+        with self._lock:
+            self._sync_journal()
+
+    def record(self, post_id, user_id, username, post_owner_id, liked, base, created_at):
+        """Journal a like state change; returns once it survives a crash of the process."""
+        entry = {
+            "post_id": post_id,
+            "liked_by_user_id": user_id,
+            "liked_by_username": username,
+            "post_owner_id": post_owner_id,
+            "liked": liked,
+            "base": base,
+            "created_at": created_at,
+        }
+        with self._lock:
+            self._journal.write(json.dumps(entry) + "\n")
+            # In the OS page cache from here on; the flusher fsyncs it (sync())
+            self._journal.flush()
+            self._unsynced = True
+            self._merge(entry)
+            size = len(self._pending)
+
+        if size >= self.max_pending:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch = self._pending
+                self._pending = {}
+                self._inflight = batch
+                # Changes arriving during the flush go to a fresh journal; the batch
+                # must be on disk before it is written, in case the write lands partly
+                self._sync_journal()
+                self._journal.close()
+                os.replace(self.journal_path, self.journal_path + ".flushing")
+                self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+            try:
+                self.flush_fn(list(batch.values()))
+                failed, dropped = {}, 0
+            except Exception as e:
+                logger.warning("Like buffer flush of %d changes failed, writing them separately: %s",
+                               len(batch), e)
+                failed, dropped = self._flush_separately(batch, e)
+
+            if failed:
+                with self._lock:
+                    # Newer changes win over the failed ones; discarded ones are gone from the batch
+                    for key, entry in failed.items():
+                        if key not in batch:
+                            continue
+                        if key in self._pending:
+                            self._pending[key]["base"] = entry["base"]
+                            if self._pending[key]["liked"] == entry["base"]:
+                                del self._pending[key]
+                        else:
+                            self._pending[key] = entry
+                    self._inflight = {}
+                    self._journal.close()
+                    self._rewrite_journal()
+                    self._journal = open(self.journal_path, "a", encoding="utf-8")
+                    self._unsynced = False
+                    os.remove(self.journal_path + ".flushing")
+                return len(batch) - len(failed) - dropped
+
+            with self._lock:
+                self._inflight = {}
+            os.remove(self.journal_path + ".flushing")
+            return len(batch) - dropped
+
+    def _flush_separately(self, batch, error):
+        """Write a failed batch per post, then per change; returns (changes to retry, number dropped)."""
+        with self._lock:
+            by_post = {}
+            for key, entry in batch.items():
+                by_post.setdefault(key[0], {})[key] = entry
+
+        failures = []
+        for post_entries in by_post.values():
+            if len(post_entries) == len(batch) == 1:
+                # Already written on its own
+                failures.extend((key, entry, error) for key, entry in post_entries.items())
+                continue
+            # With a single post its changes were the whole batch
+            if len(post_entries) > 1 and len(by_post) > 1:
+                try:
+                    self.flush_fn(list(post_entries.values()))
+                    continue
+                except Exception:
+                    pass
+            for key, entry in post_entries.items():
+                try:
+                    self.flush_fn([entry])
+                except Exception as e:
+                    failures.append((key, entry, e))
+
+        retry = {}
+        dead = []
+        for key, entry, e in failures:
+            attempts = entry.get("attempts", 0)
+            if database_error_code(e) is not None:
+                # The database answered, so the error is about this change
+                attempts += 1
+            if is_permanent(e) or attempts >= self.max_attempts:
+                dead.append(dict(entry, attempts=attempts, error=str(e)))
+            else:
+                retry[key] = dict(entry, attempts=attempts)
+        if dead:
+            self._dead_letter(dead)
+        return retry, len(dead)
+
+    def _dead_letter(self, entries):
+        for entry in entries:
+            logger.error("Dropping like change for post %s by user %s after %d attempts: %s",
+                         entry["post_id"], entry["liked_by_user_id"], entry["attempts"], entry["error"])
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            # Group commit of the changes journaled since the last pass (and during the flush)
+            self.sync()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="like-buffer-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        # Anything that still could not be written stays in the journal for next start
+        self.flush()
+        with self._lock:
+            self._sync_journal()
+            self._journal.close()
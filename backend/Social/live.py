@@ -0,0 +1,234 @@
+"""
+In-process fan-out of per-post like/comment changes to Server-Sent Events streams.
+
+The social service already knows about every like and comment as it happens,
+so instead of clients polling get_likes/get_comments they subscribe to the
+posts they are showing and receive deltas. Each subscriber has a small bounded
+queue; a subscriber that cannot keep up is disconnected rather than allowed to
+hold memory or slow down publishers, and the browser's EventSource reconnects
+on its own.
+
+The asyncio service subscribes with asyncio.Queue and streams with astream();
+publish() and close() must then be called on the event loop.
+
+A like or comment is handled by one worker, but its subscribers may hold
+streams on any worker or replica. Services publish through an EventRelay,
+which sends the change to the domain events exchange (common/events.py) as a
+live_post_event; every process binds an exclusive queue of its own and hands
+what it receives to its local hub. Without AMQP_URL changes only reach streams
+on the same process, so run a single worker (WEB_WORKERS=1).
+
+EventSource cannot send an Authorization header, and a JWT in the query
+string ends up in access logs. Clients first POST for a stream ticket
+(issue_ticket), which is good for opening a stream and nothing else, and only
+for a short while; when a stream drops after the ticket has expired, the
+client fetches a new one before reconnecting.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import jwt
+import pika
+from common import events
+
+logger = logging.getLogger(__name__)
+
+LIVE_EVENT_TYPE = "live_post_event"
+# Audience of stream tickets: access tokens have none, so neither passes for the other
+TICKET_AUDIENCE = "social-stream"
+RECONNECT_INTERVAL = 5
+
+
+class Subscription:
+    def __init__(self, hub, post_ids, max_queue, queue_class=queue.Queue):
+        self.hub = hub
+        self.post_ids = post_ids
+        self.queue = queue_class(maxsize=max_queue)
+        self.closed = False
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class PostEventHub:
+    def __init__(self, max_queue=100, heartbeat_interval=15):
+        self.max_queue = max_queue
+        self.heartbeat_interval = heartbeat_interval
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, post_ids, queue_class=queue.Queue):
+        post_ids = {str(post_id) for post_id in post_ids}
+        subscription = Subscription(self, post_ids, self.max_queue, queue_class)
+        with self._lock:
+            for post_id in post_ids:
+                self._subscribers.setdefault(post_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscription.closed = True
+            for post_id in subscription.post_ids:
+                subscribers = self._subscribers.get(post_id)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[post_id]
+
+    def close(self):
+        """End every open stream, e.g. when the process is shutting down."""
+        with self._lock:
+            subscriptions = {s for subscribers in self._subscribers.values() for s in subscribers}
+        for subscription in subscriptions:
+            self.unsubscribe(subscription)
+            try:
+                subscription.queue.put_nowait(None)
+            except (queue.Full, asyncio.QueueFull):
+                pass
+
+    def connection_count(self):
+        with self._lock:
+            return len({s for subscribers in self._subscribers.values() for s in subscribers})
+
+    def publish(self, post_id, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(str(post_id), ()))
+        if not subscribers:
+            return
+
+        # Encode once, fan out the same bytes to every subscriber
+        message = f"id: {next(self._ids)}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(message)
+            except (queue.Full, asyncio.QueueFull):
+                logger.info("Dropping slow live subscriber on post %s", post_id)
+                self.unsubscribe(subscription)
+                # Wake the stream so it notices it was closed
+                try:
+                    subscription.queue.get_nowait()
+                    subscription.queue.put_nowait(None)
+                except (queue.Empty, queue.Full, asyncio.QueueEmpty, asyncio.QueueFull):
+                    pass
+
+    def _subscribed(self, subscription):
+        return f"retry: 3000\nevent: subscribed\ndata: {json.dumps(sorted(subscription.post_ids))}\n\n"
+
+    def stream(self, subscription):
+        """Generator of SSE frames for a Flask streaming response."""
+        try:
+            yield self._subscribed(subscription)
+            while not subscription.closed:
+                try:
+                    message = subscription.queue.get(timeout=self.heartbeat_interval)
+                except queue.Empty:
+                    # Keeps proxies (Kong) from timing out idle connections
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(subscription)
+
+    async def astream(self, subscription):
+        """Async generator of SSE frames, for a subscription with an asyncio.Queue."""
+        try:
+            yield self._subscribed(subscription)
+            while not subscription.closed:
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), self.heartbeat_interval)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(subscription)
+
+
+class EventRelay:
+    """Publishes hub events through the domain events exchange to the hubs of every process."""
+
+    def __init__(self, hub, amqp_url=events.AMQP_URL):
+        self.hub = hub
+        self.amqp_url = amqp_url
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def publish(self, post_id, event, data):
+        if not self.amqp_url:
+            self.hub.publish(post_id, event, data)
+            return
+        # The local hub gets it back from the exchange, like every other process
+        events.publish(LIVE_EVENT_TYPE, {"post_id": post_id, "event": event, "data": data})
+
+    def start(self, loop=None):
+        """
+        Start consuming in this process; idempotent, so call it before each
+        subscribe. Pass the event loop when the hub is used with asyncio queues.
+        """
+        # Per process: gunicorn workers fork after import
+        if not self.amqp_url or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._loop = loop
+                threading.Thread(target=self._run, name="live-events", daemon=True).start()
+                self._pid = os.getpid()
+
+    def _deliver(self, channel, method, properties, body):
+        try:
+            data = json.loads(body)["data"]
+            args = (data["post_id"], data["event"], data["data"])
+        except (ValueError, TypeError, KeyError):
+            logger.warning("Skipping malformed live event: %r", body[:200])
+            return
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self.hub.publish, *args)
+        else:
+            self.hub.publish(*args)
+
+    def _run(self):
+        while True:
+            try:
+                connection = pika.BlockingConnection(pika.URLParameters(self.amqp_url))
+                channel = connection.channel()
+                events.declare_exchange(channel)
+                # Exclusive: deleted with the connection, so a dead worker leaves nothing behind
+                queue_name = channel.queue_declare(queue="", exclusive=True).method.queue
+                channel.queue_bind(exchange=events.DOMAIN_EVENTS_EXCHANGE, queue=queue_name,
+                                   routing_key=LIVE_EVENT_TYPE)
+                channel.basic_consume(queue=queue_name, on_message_callback=self._deliver, auto_ack=True)
+                channel.start_consuming()
+            except Exception as e:
+                # Streams miss what is published meanwhile; clients reload counts when they reconnect
+                logger.warning("Live events consumer lost: %r; reconnecting in %ss", e, RECONNECT_INTERVAL)
+                time.sleep(RECONNECT_INTERVAL)
+
+
+def issue_ticket(payload, secret, algorithm, ttl):
+    """A stream ticket for the user of a verified access token payload."""
+    return jwt.encode({
+        "user_id": payload["user_id"],
+        "aud": TICKET_AUDIENCE,
+        "exp": int(time.time() + ttl),
+    }, secret, algorithm=algorithm)
+
+
+def verify_ticket(ticket, secret, algorithm):
+    """The ticket's payload, or None when it is invalid, expired or not a stream ticket."""
+    try:
+        return jwt.decode(ticket, secret, algorithms=[algorithm], audience=TICKET_AUDIENCE)
+    except jwt.InvalidTokenError:
+        return None
@@ -0,0 +1,126 @@
+"""
+Short-window deduplication of notification events before they are published.
+
+Liking, unliking and liking a post again publishes a new_like each time it
+flips to liked, so a user toggling a like notifies the post owner over and
+over. A notification whose key (event type, actor, recipient, post) was
+published less than NOTIFY_DEDUP_WINDOW seconds ago is suppressed; the window
+runs from the first publish, so a steady toggler notifies at most once per
+window. Only the notifications queue is filtered: domain events are still
+published for every change, since read models count likes, not notifications.
+
+The store is in memory, per process. With several gunicorn workers a repeat
+that lands on another worker is published once more by that worker.
+
+Counters (Prometheus, served at GET /metrics by the social service):
+    social_notifications_published_total{event_type}
+    social_notifications_suppressed_total{event_type}
+With several workers set PROMETHEUS_MULTIPROC_DIR to an empty directory so
+the counts of all workers are added up.
+
+Configuration (environment):
+    NOTIFY_DEDUP_WINDOW     seconds a repeat is suppressed; 0 disables (default 300)
+    NOTIFY_DEDUP_EVENTS     comma-separated event types to deduplicate (default new_like)
+    NOTIFY_DEDUP_MAX_KEYS   keys remembered; the oldest go first (default 100000)
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, REGISTRY, generate_latest, multiprocess
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_DEDUP_WINDOW = float(os.environ.get("NOTIFY_DEDUP_WINDOW", "300"))
+NOTIFY_DEDUP_EVENTS = [event_type.strip() for event_type in
+                       os.environ.get("NOTIFY_DEDUP_EVENTS", "new_like").split(",") if event_type.strip()]
+NOTIFY_DEDUP_MAX_KEYS = int(os.environ.get("NOTIFY_DEDUP_MAX_KEYS", "100000"))
+
+# (actor, recipient, post) fields of each notification the social service sends
+KEY_FIELDS = {
+    "new_like": ("liked_by_user_id", "post_owner_id", "post_id"),
+    "new_comment": ("commenter_id", "recipient_id", "post_id"),
+    "comment_reply": ("replier_id", "recipient_id", "post_id"),
+}
+
+PUBLISHED = Counter(
+    "social_notifications_published_total",
+    "Notifications published to the notifications queue",
+    ["event_type"]
+)
+SUPPRESSED = Counter(
+    "social_notifications_suppressed_total",
+    "Notifications not published because the same one was sent within NOTIFY_DEDUP_WINDOW",
+    ["event_type"]
+)
+
+
+class NotificationDedup:
+    def __init__(self, window=NOTIFY_DEDUP_WINDOW, event_types=NOTIFY_DEDUP_EVENTS,
+                 max_keys=NOTIFY_DEDUP_MAX_KEYS):
+        self.window = window
+        self.key_fields = {event_type: KEY_FIELDS[event_type] for event_type in event_types
+                           if event_type in KEY_FIELDS}
+        self.max_keys = max_keys
+        # key -> time first published; insertion order is expiry order
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+        unknown = set(event_types) - set(KEY_FIELDS)
+        if unknown:
+            logger.warning("NOTIFY_DEDUP_EVENTS: no key for %s; not deduplicated", ", ".join(sorted(unknown)))
+
+    def _key(self, event_type, data):
+        fields = self.key_fields.get(event_type)
+        if fields is None or self.window <= 0:
+            return None
+        return (event_type,) + tuple(str(data.get(field)) for field in fields)
+
+    def admit(self, notifications):
+        """
+        The notifications ((event_type, data) pairs) to publish: repeats within
+        the window, including repeats within the list, are dropped and counted.
+        """
+        admitted = []
+        now = time.monotonic()
+        with self._lock:
+            while self._seen:
+                key, seen = next(iter(self._seen.items()))
+                if seen + self.window > now:
+                    break
+                del self._seen[key]
+            for event_type, data in notifications:
+                key = self._key(event_type, data)
+                if key is not None:
+                    if key in self._seen:
+                        SUPPRESSED.labels(event_type=event_type).inc()
+                        logger.debug("Suppressed repeated %s notification %s", event_type, key[1:])
+                        continue
+                    self._seen[key] = now
+                    if len(self._seen) > self.max_keys:
+                        self._seen.popitem(last=False)
+                admitted.append((event_type, data))
+        return admitted
+
+    def release(self, notifications):
+        """Forget notifications that could not be published, so a retry is not suppressed."""
+        with self._lock:
+            for event_type, data in notifications:
+                key = self._key(event_type, data)
+                if key is not None:
+                    self._seen.pop(key, None)
+
+    def published(self, notifications):
+        for event_type, _ in notifications:
+            PUBLISHED.labels(event_type=event_type).inc()
+
+
+def metrics():
+    """(body, content type) of the Prometheus metrics of this process, or of all workers."""
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
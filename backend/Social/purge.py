@@ -0,0 +1,273 @@
+"""
+Background, chunked deletion of likes and comments.
+
+Purging a prolific user or a busy post used to be a single unbounded
+delete().eq(...) per table inside the request. Here the request only queues a
+job; a worker thread deletes the rows in bounded chunks and records progress
+after every chunk in a JSON file, so a restarted service picks unfinished jobs
+up where they left off.
+
+Replies whose parent comment is about to be deleted are re-pointed at the
+nearest surviving ancestor (or become top-level comments) before the chunk is
+deleted, so no reply is left pointing at a missing comment.
+
+on_deleted(post_ids), if given, is called after every chunk with the posts
+whose likes or comments it deleted.
+
+Jobs live in this process only: a second process on the same job directory
+would resume the same jobs and answer 404 for the other's. The worker
+therefore holds an exclusive lock on the directory (.lock), and a second one
+fails to start once lock_timeout has passed. The social service runs as a single
+worker (WEB_WORKERS=1); the lock turns a misconfiguration into a failed start
+instead of duplicated deletes.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+# kind -> (likes filter column, comments filter column)
+PURGE_KINDS = {
+    "user": ("liked_by_user_id", "user_id"),
+    "post": ("post_id", "post_id"),
+}
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class PurgeWorker:
+    def __init__(self, supabase, job_dir, chunk_size=500, max_retries=5, retry_interval=2, on_deleted=None,
+                 lock_timeout=30):
+        self.supabase = supabase
+        self.on_deleted = on_deleted
+        self.job_dir = job_dir
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+
+        os.makedirs(self.job_dir, exist_ok=True)
+        self._lock_job_dir(lock_timeout)
+        self._load_jobs()
+
+    def _lock_job_dir(self, timeout):
+        # Held for the life of the process; waits out an old worker that is still shutting down
+        self._lock_file = open(os.path.join(self.job_dir, ".lock"), "w")
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    self._lock_file.close()
+                    raise RuntimeError(f"Purge job directory {self.job_dir} is in use by another process; "
+                                       "the social service must run as a single worker (WEB_WORKERS=1)")
+                time.sleep(0.5)
+
+    def _job_path(self, job_id):
+        return os.path.join(self.job_dir, f"{job_id}.json")
+
+    def _load_jobs(self):
+        for name in sorted(os.listdir(self.job_dir)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.job_dir, name), encoding="utf-8") as f:
+                    job = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping unreadable purge job %s: %s", name, e)
+                continue
+            self._jobs[job["id"]] = job
+            if job["status"] in ACTIVE_STATUSES:
+                logger.info("Resuming purge job %s (%s %s)", job['id'], job['kind'], job['target'])
+                job["status"] = "queued"
+                self._queue.put(job["id"])
+
+    def _save(self, job):
+        job["updated_at"] = datetime.now().isoformat()
+        tmp_path = self._job_path(job["id"]) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._job_path(job["id"]))
+
+    def submit(self, kind, target, requested_by):
+        """Queue a purge, or return the already active job for the same target."""
+        target = str(target)
+        with self._lock:
+            for job in self._jobs.values():
+                if job["kind"] == kind and job["target"] == target and job["status"] in ACTIVE_STATUSES:
+                    return dict(job)
+
+            job = {
+                "id": uuid.uuid4().hex,
+                "kind": kind,
+                "target": target,
+                "requested_by": str(requested_by),
+                "status": "queued",
+                "phase": "likes",
+                "chunks": 0,
+                "deleted": {"likes": 0, "comments": 0},
+                "reparented_replies": 0,
+                "error": None,
+                "created_at": datetime.now().isoformat(),
+            }
+            self._jobs[job["id"]] = job
+            self._save(job)
+
+        self._queue.put(job["id"])
+        return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def resume(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job["status"] != "failed":
+                return None
+            job["status"] = "queued"
+            job["error"] = None
+            self._save(job)
+        self._queue.put(job_id)
+        return dict(job)
+
+    def _deleted(self, post_ids):
+        if self.on_deleted is None:
+            return
+        try:
+            self.on_deleted(sorted({str(post_id) for post_id in post_ids}))
+        except Exception:
+            logger.exception("Error in purge on_deleted hook")
+
+    def _delete_likes_chunk(self, job):
+        likes_column, _ = PURGE_KINDS[job["kind"]]
+        # Likes are keyed by (post_id, liked_by_user_id), so chunk on the other half of the key
+        other_column = "post_id" if likes_column == "liked_by_user_id" else "liked_by_user_id"
+
+        rows = self.supabase.table("likes") \
+            .select(other_column) \
+            .eq(likes_column, job["target"]) \
+            .limit(self.chunk_size) \
+            .execute().data or []
+        if not rows:
+            return 0
+
+        self.supabase.table("likes") \
+            .delete() \
+            .eq(likes_column, job["target"]) \
+            .in_(other_column, [row[other_column] for row in rows]) \
+            .execute()
+        self._deleted([job["target"]] if likes_column == "post_id" else [row["post_id"] for row in rows])
+        return len(rows)
+
+    def _delete_comments_chunk(self, job):
+        _, comments_column = PURGE_KINDS[job["kind"]]
+
+        rows = self.supabase.table("comments") \
+            .select("id, parent_comment_id, post_id") \
+            .eq(comments_column, job["target"]) \
+            .limit(self.chunk_size) \
+            .execute().data or []
+        if not rows:
+            return 0, 0
+
+        parents = {row["id"]: row.get("parent_comment_id") for row in rows}
+
+        # Walk up past ancestors that are in this same chunk
+        def surviving_ancestor(comment_id):
+            parent_id = parents[comment_id]
+            while parent_id in parents:
+                parent_id = parents[parent_id]
+            return parent_id
+
+        by_new_parent = {}
+        for comment_id in parents:
+            by_new_parent.setdefault(surviving_ancestor(comment_id), []).append(comment_id)
+
+        reparented = 0
+        for new_parent_id, comment_ids in by_new_parent.items():
+            result = self.supabase.table("comments") \
+                .update({"parent_comment_id": new_parent_id}) \
+                .in_("parent_comment_id", comment_ids) \
+                .execute()
+            reparented += len(result.data or [])
+
+        self.supabase.table("comments") \
+            .delete() \
+            .in_("id", list(parents)) \
+            .execute()
+        self._deleted(row["post_id"] for row in rows)
+        return len(rows), reparented
+
+    def _run_job(self, job_id):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = "running"
+            self._save(job)
+
+        logger.info("Purging social data for %s %s (job %s)", job['kind'], job['target'], job_id)
+        failures = 0
+        while True:
+            try:
+                if job["phase"] == "likes":
+                    deleted = self._delete_likes_chunk(job)
+                    reparented = 0
+                    if not deleted:
+                        job["phase"] = "comments"
+                else:
+                    deleted, reparented = self._delete_comments_chunk(job)
+                    if not deleted:
+                        break
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.warning("Purge job %s chunk failed (%d/%d): %s", job_id, failures, self.max_retries, e)
+                if failures >= self.max_retries:
+                    with self._lock:
+                        job["status"] = "failed"
+                        job["error"] = str(e)
+                        self._save(job)
+                    return
+                time.sleep(self.retry_interval * failures)
+                continue
+
+            with self._lock:
+                if deleted:
+                    job["chunks"] += 1
+                    job["deleted"][job["phase"]] += deleted
+                    job["reparented_replies"] += reparented
+                self._save(job)
+
+        with self._lock:
+            job["status"] = "done"
+            job["finished_at"] = datetime.now().isoformat()
+            self._save(job)
+        logger.info("Purge job %s done: %s", job_id, job['deleted'])
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run_job(job_id)
+            except Exception as e:
+                logger.exception("Purge job %s crashed", job_id)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="social-purge", daemon=True)
+        self._thread.start()
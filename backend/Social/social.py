@@ -1,61 +1,135 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
-from supabase import create_client, Client
 import os
-import jwt
+import logging
 import pika
 import json
-from urllib.parse import urlparse
-from werkzeug.utils import secure_filename
 from datetime import datetime
+from live import EventRelay
+from comment_tree import build_comment_tree
+from notification_dedup import NotificationDedup, metrics
+import social_core
+from social_core import BULK_TABLES
+from common import bulk, cache, db, events, idempotency, lifecycle, responses, singleflight, tracing, log
 
 
 app = Flask(__name__)
+responses.init_app(app)
+cache.init_app(app)
+tracing.init_app(app, "social-service")
+log.init_app(app, "social-service")
+db.init_app(app)
+logger = logging.getLogger(__name__)
 CORS(app)
 
 # Initialise Supabase
 supabase_url = os.environ.get("SUPABASE_URL")
 supabase_key = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(supabase_url, supabase_key)
+supabase = tracing.trace_supabase(db.create_client(supabase_url, supabase_key))
 
-# JWT verification
-def verify_token(token):
-    try:
-        payload = jwt.decode(
-            token,
-            os.getenv('JWT_SECRET', 'esd_jwt_secret_key'),
-            algorithms=[os.getenv('JWT_ALGORITHM', 'HS256')]
-        )
-        return payload
-    except jwt.InvalidTokenError:
-        return None
+def authenticate():
+    return social_core.authenticate(request.headers.get('Authorization'))
+
+def unauthorized():
+    return jsonify({'error': 'Invalid or missing token'}), 401
 
 # RabbitMQ connection
+notification_dedup = NotificationDedup()
+
+def publish_notifications(notifications):
+    # notifications is a list of (event_type, data); all are sent over one connection
+    admitted = social_core.admit_notifications(notification_dedup, notifications)
+    if not admitted:
+        return
+    with tracing.span("amqp.publish", queue="notifications", messages=len(admitted),
+                      suppressed=len(notifications) - len(admitted)):
+        try:
+            amqp_url = os.environ.get("AMQP_URL")
+            params = pika.URLParameters(amqp_url)
+            connection = pika.BlockingConnection(params)
+            channel = connection.channel()
+            channel.queue_declare(queue='notifications', durable=True)
+
+            headers = social_core.notification_headers()
+            for event_type, data in admitted:
+                channel.basic_publish(
+                    exchange='',
+                    routing_key='notifications',
+                    body=json.dumps(social_core.notification_message(event_type, data)),
+                    properties=pika.BasicProperties(
+                        delivery_mode=2,
+                        headers=headers
+                    )
+                )
+            connection.close()
+        except Exception:
+            notification_dedup.release(admitted)
+            raise
+    notification_dedup.published(admitted)
+
 def publish_notification(event_type, data):
-    amqp_url = os.environ.get("AMQP_URL")
-    params = pika.URLParameters(amqp_url)
-    connection = pika.BlockingConnection(params)
-    channel = connection.channel()
-    channel.queue_declare(queue='notifications', durable=True)
-
-    message = {
-        "event_type": event_type,
-        "data": data
-    }
-    channel.basic_publish(
-        exchange='',
-        routing_key='notifications',
-        body=json.dumps(message),
-        properties=pika.BasicProperties(delivery_mode=2)
-    )
-    connection.close()
+    publish_notifications([(event_type, data)])
+
+def flush_likes(entries):
+    inserts, deletes = social_core.like_changes(entries)
+
+    for post_id, post_entries in deletes.items():
+        supabase.table("likes") \
+            .delete() \
+            .eq("post_id", post_id) \
+            .in_("liked_by_user_id", social_core.liked_by(post_entries)) \
+            .execute()
+        social_core.likes_removed(post_id, post_entries)
+
+    rows = []
+    for post_id, post_entries in inserts.items():
+        existing = supabase.table("likes") \
+            .select("liked_by_user_id") \
+            .eq("post_id", post_id) \
+            .in_("liked_by_user_id", social_core.liked_by(post_entries)) \
+            .execute()
+        rows.extend(social_core.not_yet_liked(post_entries, existing.data))
+
+    if not rows:
+        return
+
+    supabase.table("likes").insert([social_core.like_row(e) for e in rows]).execute()
+
+    try:
+        publish_notifications([social_core.like_notification(e) for e in rows])
+    except Exception as e:
+        # The likes are stored; a lost notification must not make the flush retry them
+        logger.error("Error publishing buffered like notifications: %s", e)
+
+like_buffer = None
+if social_core.LIKE_WRITE_BEHIND:
+    like_buffer = social_core.create_like_buffer(flush_likes)
+    like_buffer.start()
+    lifecycle.on_shutdown(like_buffer.stop)
+
+# Live like/comment deltas for subscribed clients (SSE)
+live_events = social_core.create_live_hub()
+# Close open streams on shutdown; EventSource reconnects to another worker
+lifecycle.on_drain(live_events.close)
+# Changes reach the streams of every worker through the domain events exchange
+live_relay = EventRelay(live_events)
+
+# Concurrent reads of one post's likes or comments share a single query (results are read-only)
+post_reads = singleflight.SingleFlight()
+
+purge_worker = social_core.create_purge_worker(supabase)
+purge_worker.start()
+
+# Responses to like/comment POSTs, replayed when a client retries with the same Idempotency-Key
+# Shared by all workers through the database (IDEMPOTENCY_BACKEND)
+idempotency_store = idempotency.create_store(supabase)
 
 @app.route('/api/social/like', methods=['POST'])
+@idempotency.idempotent(idempotency_store)
 def like_post():
-    token = request.headers.get('Authorization', '').split(' ')[-1]
-    payload = verify_token(token)
+    payload = authenticate()
     if not payload:
-        return jsonify({'error': 'Invalid or missing token'}), 401
+        return unauthorized()
 
     post_id = request.json.get('post_id')
     if not post_id:
@@ -68,15 +142,15 @@ def like_post():
 
     post_owner_id = post_resp.data["user_id"]
 
+    if like_buffer is not None:
+        return buffered_like(post_id, post_owner_id, payload)
+
     # Check if this user already liked the post
     existing_like = supabase.table("likes") \
         .select("*") \
         .eq("post_id", post_id) \
         .eq("liked_by_user_id", payload["user_id"]) \
         .execute()
-    
-    created_at = existing_like.data[0]['created_at'] if existing_like.data else datetime.now().isoformat()
-
 
     if existing_like.data:
         # Unlike: delete the like
@@ -85,37 +159,50 @@ def like_post():
             .eq("post_id", post_id) \
             .eq("liked_by_user_id", payload["user_id"]) \
             .execute()
-
-        return jsonify({'message': 'Post unliked'}), 200
-    
-    else: 
-        # Insert like into Supabase
-        supabase.table("likes").insert({
-            "post_id": post_id,
-            "liked_by_user_id": payload['user_id'],
-            "liked_by_username": payload['username'],
-            "post_owner_id": post_owner_id,
-            
-        }).execute()
-
-        # Send event to RabbitMQ
-        publish_notification("new_like", {
-            "post_id": post_id,
-            "liked_by_user_id": payload["user_id"],
-            "liked_by_username": payload["username"],
-            "post_owner_id": post_owner_id,
-            "created_at": created_at
-        })
-
-        return jsonify({'message': 'Post liked'}), 201
+        events.publish("like_removed", {"post_id": post_id, "liked_by_user_id": payload["user_id"]})
+        body, status = social_core.like_toggled(post_reads, live_relay, post_id, payload, liked=False)
+        return jsonify(body), status
+
+    # Insert like into Supabase
+    like = social_core.like_entry(post_id, payload, post_owner_id)
+    supabase.table("likes").insert(social_core.like_row(like)).execute()
+    body, status = social_core.like_toggled(post_reads, live_relay, post_id, payload, liked=True)
+
+    # Send event to RabbitMQ
+    publish_notification(*social_core.like_notification(like))
+    return jsonify(body), status
+
+def buffered_like(post_id, post_owner_id, payload):
+    liked = like_buffer.state(post_id, payload["user_id"])
+    if liked is None:
+        existing_like = supabase.table("likes") \
+            .select("liked_by_user_id") \
+            .eq("post_id", post_id) \
+            .eq("liked_by_user_id", payload["user_id"]) \
+            .execute()
+        liked = bool(existing_like.data)
+
+    # The toggle is journaled before we answer, so it survives a crash before the flush
+    like_buffer.record(
+        post_id,
+        payload["user_id"],
+        payload["username"],
+        post_owner_id,
+        liked=not liked,
+        base=liked,
+        created_at=datetime.now().isoformat()
+    )
+    # get_likes overlays the buffered toggle, so cached responses are already stale
+    body, status = social_core.like_toggled(post_reads, live_relay, post_id, payload, liked=not liked)
+    return jsonify(body), status
 
 @app.route('/api/social/comment', methods=['POST'])
+@idempotency.idempotent(idempotency_store)
 def comment_post():
     # Auth check
-    token = request.headers.get('Authorization', '').split(' ')[-1]
-    payload = verify_token(token) #extracts the user_id and username from the token
+    payload = authenticate() #extracts the user_id and username from the token
     if not payload:
-        return jsonify({'error': 'Invalid or missing token'}), 401
+        return unauthorized()
 
     # get the data from the frontend
     data=request.get_json()
@@ -125,12 +212,12 @@ def comment_post():
     reply_to_user_id = data.get('reply_to_user_id')  # Only get user_id
 
     if not post_id or not comment_text:
-        return jsonify({'error': 'Missing post_id or comment'}), 400 
-    
+        return jsonify({'error': 'Missing post_id or comment'}), 400
+
     # Get post owner info
     post_resp = supabase.table("post").select("user_id").eq("id", post_id).single().execute()
     if not post_resp.data:
-        return jsonify({"error": "Post not found"}), 404 
+        return jsonify({"error": "Post not found"}), 404
     post_owner_id = post_resp.data["user_id"]
 
     # gets the user_id of the parent comment if frontnend does not send it
@@ -140,229 +227,223 @@ def comment_post():
             reply_to_user_id = parent_resp.data["user_id"]
 
     # Insert comment (with reply info)
-    result = supabase.table("comments").insert({
-        "post_id": post_id,
-        "user_id": payload['user_id'],
-        "username": payload['username'],
-        "comment_text": comment_text,
-        "parent_comment_id": parent_comment_id,
-        "reply_to_user_id": reply_to_user_id
-    }).execute()
-
-    created_at = result.data[0]['created_at'] if result.data else datetime.now().isoformat()
-
-    if not result.data or len(result.data) == 0:
+    row = social_core.comment_row(post_id, payload, comment_text, parent_comment_id, reply_to_user_id)
+    result = supabase.table("comments").insert(row).execute()
+
+    if not result.data:
         return jsonify({'error': 'Failed to insert comment'}), 500
 
-    comment_id = result.data[0]['id']
-
-    if parent_comment_id:
-        # 1.  a reply to a comment
-        if reply_to_user_id and reply_to_user_id != payload['user_id']:
-            # Notify the person being replied to
-            publish_notification("comment_reply", {
-                "recipient_id": reply_to_user_id,
-                "post_id": post_id,
-                "comment_id": comment_id,
-                "comment_text": comment_text,
-                "parent_comment_id": parent_comment_id,
-                "replier_username": payload['username'],
-                "replier_id": payload["user_id"],
-                "created_at": created_at
-            })
-    else:
-        # 2. new comment on the post
-        if post_owner_id != payload['user_id']:
-            # Notify the post owner
-            publish_notification("new_comment", {
-                "recipient_id": post_owner_id,
-                "post_id": post_id,
-                "comment_id": comment_id,
-                "comment_text": comment_text,
-                "commenter_username": payload['username'],
-                "commenter_id": payload['user_id'],
-                "created_at": created_at
-            })
-
-    return jsonify({
-        'message': 'Comment added successfully',
-        'comment': result.data[0]
-    }), 201
+    comment = result.data[0]
+    body, status = social_core.comment_added(post_reads, live_relay, post_id, comment, payload)
+
+    notification = social_core.comment_notification(row, comment, payload, post_owner_id)
+    if notification:
+        publish_notification(*notification)
+
+    return jsonify(body), status
+
+# Short-lived ticket for opening a stream; EventSource cannot send the access token in a header
+@app.route('/api/social/stream/ticket', methods=['POST'])
+def stream_ticket():
+    payload = authenticate()
+    if not payload:
+        return unauthorized()
+
+    response = jsonify(social_core.stream_ticket(payload))
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# Server-Sent Events stream of like/comment deltas for the given posts
+@app.route('/api/social/stream', methods=['GET'])
+def stream_post_events():
+    payload = social_core.verify_stream_ticket(request.args.get('ticket'))
+    if not payload:
+        return jsonify({'error': 'Invalid or expired stream ticket'}), 401
+
+    post_ids, error = social_core.stream_post_ids(request.args.get('post_ids'))
+    if error:
+        return jsonify(error[0]), error[1]
+
+    live_relay.start()
+    subscription = live_events.subscribe(post_ids)
+    return Response(
+        live_events.stream(subscription),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
 
 # get likes for the post
 @app.route('/api/social/likes/<post_id>', methods=['GET'])
 def get_likes(post_id):
-    token = request.headers.get('Authorization', '').split(' ')[-1]
-    payload = verify_token(token)
+    payload = authenticate()
     if not payload:
-        return jsonify({'error': 'Invalid or missing token'}), 401
+        return unauthorized()
 
     try:
-        # Get all likes for the post
-        likes = supabase.table("likes") \
-            .select("*") \
-            .eq("post_id", post_id) \
-            .execute()
-
-        # Get if current user has liked the post - remove .single()
-        user_like = supabase.table("likes") \
+        # Get all likes for the post; concurrent requests for the same post share one query
+        likes_data = post_reads.do(("likes", str(post_id)), lambda: supabase.table("likes") \
             .select("*") \
             .eq("post_id", post_id) \
-            .eq("liked_by_user_id", payload['user_id']) \
-            .execute()
+            .execute().data)
 
-        return jsonify({
-            'likes': likes.data,
-            'total_likes': len(likes.data),
-            'has_liked': len(user_like.data) > 0  # Changed to check if any likes exist
-        }), 200
+        pending = like_buffer.pending_for_post(post_id) if like_buffer is not None else []
+        return jsonify(social_core.likes_response(likes_data, pending, payload['user_id'])), 200, \
+            cache.cacheable(cache.post_key(post_id), cache.likes_key(post_id), per_user=True)
 
     except Exception as e:
-        print(f"Error in get_likes: {str(e)}")
+        logger.exception("Error in get_likes")
         return jsonify({'error': str(e)}), 500
 
 # get all the comments under the post
 @app.route('/api/social/comments/<post_id>', methods=['GET'])
 def get_comments(post_id):
-    token = request.headers.get('Authorization', '').split(' ')[-1]
-    payload = verify_token(token)
+    payload = authenticate()
     if not payload:
-        return jsonify({'error': 'Invalid or missing token'}), 401
+        return unauthorized()
 
     try:
-        # Get all comments for the post
-        comments = supabase.table("comments") \
-            .select("*") \
-            .eq("post_id", post_id) \
-            .order("created_at", desc=False) \
-            .execute()
-
-        # If no comments exist, return empty array
-        if not comments.data:
-            return jsonify({
-                'comments': []
-            }), 200
-
-        # Organize comments into a simplified structure
-        structured_comments = []
-        replies_map = {}
-
-        for comment in comments.data:
-            if comment.get('parent_comment_id') is None:
-                # This is an original comment
-                comment['replies'] = []
-                structured_comments.append(comment)
-                replies_map[comment['id']] = comment['replies']
-            else:
-                # This is a reply - add it to the parent's replies
-                try:
-                    # Find the original parent comment
-                    original_parent_id = find_original_parent(comments.data, comment['parent_comment_id'])
-                    if original_parent_id in replies_map:
-                        # Don't modify the comment text here - the frontend will handle the mention
-                        replies_map[original_parent_id].append(comment)
-                except Exception as e:
-                    print(f"Error processing reply {comment['id']}: {str(e)}")
-                    continue
-
-        # Sort replies by timestamp for each parent comment
-        for comment in structured_comments:
-            if 'replies' in comment:
-                comment['replies'].sort(key=lambda x: x.get('created_at', ''))
-
+        # Concurrent requests for the same post share one query and one tree
+        structured_comments = post_reads.do(("comments", str(post_id)), lambda: load_comment_tree(post_id))
         return jsonify({
             'comments': structured_comments
-        }), 200
+        }), 200, cache.cacheable(cache.post_key(post_id), cache.comments_key(post_id))
 
     except Exception as e:
-        print(f"Error in get_comments: {str(e)}")
-        import traceback
-        print(traceback.format_exc())  # Print full stack trace
+        logger.exception("Error in get_comments")
         return jsonify({'error': str(e)}), 500
 
-def find_original_parent(comments, reply_id):
-    """
-    Recursively find the original parent comment ID
-    """
-    try:
-        comment = next((c for c in comments if c['id'] == reply_id), None)
-        if not comment or comment.get('parent_comment_id') is None:
-            return reply_id
-        return find_original_parent(comments, comment['parent_comment_id'])
-    except Exception as e:
-        print(f"Error in find_original_parent: {str(e)}")
-        return reply_id
+def load_comment_tree(post_id):
+    """Top-level comments of a post, each with its (flattened) replies."""
+    comments = supabase.table("comments") \
+        .select("*") \
+        .eq("post_id", post_id) \
+        .order("created_at", desc=False) \
+        .execute()
+    return build_comment_tree(comments.data)
 
 @app.route('/api/social/posts', methods=['DELETE'])
 def delete_post_social_data():
-    token = request.headers.get('Authorization', '').split(' ')[-1]
-    payload = verify_token(token)
+    payload = authenticate()
     if not payload:
-        return jsonify({'error': 'Invalid or missing token'}), 401
+        return unauthorized()
 
     # Get post_id from request body
     data = request.get_json()
     if not data or 'post_id' not in data:
         return jsonify({'error': 'Missing post_id in request body'}), 400
-    
+
     post_id = data['post_id']
+    if like_buffer is not None:
+        like_buffer.discard(post_id=post_id)
+    social_core.post_data_purging(post_reads, post_id)
 
     try:
-        # Delete all likes for the post
-        supabase.table("likes").delete().eq("post_id", post_id).execute()
-        
-        # Delete all comments for the post
-        supabase.table("comments").delete().eq("post_id", post_id).execute()
-        
+        job = purge_worker.submit("post", post_id, payload['user_id'])
+
         return jsonify({
-            'message': 'Post social data deleted successfully'
-        }), 200
-        
+            'message': 'Post social data deletion started',
+            'job': job
+        }), 202
+
     except Exception as e:
-        print(f"Error deleting post social data: {str(e)}")
+        logger.exception("Error deleting post social data")
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/social/user/<user_id>', methods=['DELETE'])
 def delete_user_social_data(user_id):
-    print(f"\n=== Starting deletion of social data for user {user_id} ===")
-    
     # Verify JWT token
-    token = request.headers.get('Authorization', '').split(' ')[-1]
-    payload = verify_token(token)
+    payload = authenticate()
     if not payload:
-        print("Invalid or missing token")
-        return jsonify({'error': 'Invalid or missing token'}), 401
+        return unauthorized()
 
     # Check if the authenticated user matches the requested user_id
     if str(payload.get('user_id')) != str(user_id):
-        print("User is not authorized to delete this data")
+        logger.warning("User %s may not delete the social data of user %s", payload.get('user_id'), user_id)
         return jsonify({'error': 'Unauthorized to delete this data'}), 403
 
-    try:
-        # Delete all likes by the user
-        print(f"Deleting likes for user {user_id}")
-        likes_result = supabase.table("likes").delete().eq("liked_by_user_id", user_id).execute()
-        print(f"Likes deletion result: {likes_result}")
+    if like_buffer is not None:
+        like_buffer.discard(user_id=user_id)
 
-        # Delete all comments by the user
-        print(f"Deleting comments for user {user_id}")
-        comments_result = supabase.table("comments").delete().eq("user_id", user_id).execute()
-        print(f"Comments deletion result: {comments_result}")
+    try:
+        # Likes and comments are deleted in chunks by the purge worker
+        job = purge_worker.submit("user", user_id, payload['user_id'])
+        logger.info("Queued purge job %s for user %s", job['id'], user_id)
 
         return jsonify({
-            'message': 'User social data deleted successfully',
-            'details': {
-                'likes_deleted': len(likes_result.data) if likes_result.data else 0,
-                'comments_deleted': len(comments_result.data) if comments_result.data else 0
-            }
-        }), 200
+            'message': 'User social data deletion started',
+            'job': job
+        }), 202
 
     except Exception as e:
-        print(f"Error deleting user social data: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error deleting user social data")
         return jsonify({'error': str(e)}), 500
 
+# Progress of a background purge
+@app.route('/api/social/purge/<job_id>', methods=['GET'])
+def get_purge_job(job_id):
+    payload = authenticate()
+    if not payload:
+        return unauthorized()
+
+    job = purge_worker.get(job_id)
+    error = social_core.purge_job_error(job, payload, "view")
+    if error:
+        return jsonify(error[0]), error[1]
+
+    return jsonify({'job': job}), 200
+
+# Re-queue a purge that gave up after repeated chunk failures
+@app.route('/api/social/purge/<job_id>/resume', methods=['POST'])
+def resume_purge_job(job_id):
+    payload = authenticate()
+    if not payload:
+        return unauthorized()
+
+    error = social_core.purge_job_error(purge_worker.get(job_id), payload, "resume")
+    if error:
+        return jsonify(error[0]), error[1]
+
+    job = purge_worker.resume(job_id)
+    if not job:
+        return jsonify({'error': 'Only failed jobs can be resumed'}), 409
+
+    return jsonify({'job': job}), 202
+
+# Bulk export of likes or comments as NDJSON, for backfills and analytics (common/bulk.py)
+@app.route('/api/social/admin/export/<table>', methods=['GET'])
+def export_social_data(table):
+    payload = authenticate()
+    if not payload:
+        return unauthorized()
+    error = social_core.bulk_request_error(payload, table)
+    if error:
+        return jsonify(error[0]), error[1]
+
+    return bulk.export_response(supabase, table, BULK_TABLES[table])
+
+# Bulk import of NDJSON likes or comments in batches; streams a report line per batch
+@app.route('/api/social/admin/import/<table>', methods=['POST'])
+def import_social_data(table):
+    payload = authenticate()
+    if not payload:
+        return unauthorized()
+    error = social_core.bulk_request_error(payload, table)
+    if error:
+        return jsonify(error[0]), error[1]
+
+    logger.info("User %s is importing %s", payload.get('user_id'), table)
+    return bulk.import_response(supabase, table, BULK_TABLES[table],
+                                after_batch=lambda rows: social_core.social_data_imported(post_reads, table, rows))
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Internal: not routed by the gateway
+    body, content_type = metrics()
+    return Response(body, content_type=content_type)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5003)
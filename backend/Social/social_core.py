@@ -0,0 +1,297 @@
+"""
+The parts of the social service that do not depend on the web framework,
+shared by social.py (Flask) and async_social.py (aiohttp): token and stream
+ticket checks, the background workers' configuration, the rows that are
+written, notification payloads, the shape of every response, and what a
+write invalidates. The apps keep only request parsing and I/O (database
+queries and the notification connection).
+"""
+
+import os
+import time
+from datetime import datetime
+import jwt
+from like_buffer import LikeBuffer
+from live import PostEventHub, issue_ticket, verify_ticket
+from purge import PurgeWorker
+from common import bulk, cache, events, tracing
+
+JWT_SECRET = os.getenv('JWT_SECRET', 'esd_jwt_secret_key')
+JWT_ALGORITHM = os.getenv('JWT_ALGORITHM', 'HS256')
+
+# Optional write-behind mode for likes
+LIKE_WRITE_BEHIND = os.environ.get("LIKE_WRITE_BEHIND", "false").lower() == "true"
+
+LIVE_MAX_POSTS_PER_STREAM = int(os.environ.get("LIVE_MAX_POSTS_PER_STREAM", "200"))
+LIVE_TICKET_TTL = int(os.environ.get("LIVE_TICKET_TTL", "60"))
+
+# Tables the admin bulk endpoints export and import, with the key exports page through
+BULK_TABLES = {
+    "likes": ("post_id", "liked_by_user_id"),
+    "comments": ("id",),
+}
+
+
+# JWT verification
+def verify_token(token):
+    try:
+        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.InvalidTokenError:
+        return None
+
+
+def authenticate(auth_header):
+    return verify_token((auth_header or '').split(' ')[-1])
+
+
+def stream_ticket(payload):
+    return {'ticket': issue_ticket(payload, JWT_SECRET, JWT_ALGORITHM, LIVE_TICKET_TTL),
+            'expires_in': LIVE_TICKET_TTL}
+
+
+def verify_stream_ticket(ticket):
+    return verify_ticket(ticket or '', JWT_SECRET, JWT_ALGORITHM)
+
+
+def stream_post_ids(value):
+    """(post_ids, None), or (None, (error body, status)) for the post_ids query parameter."""
+    post_ids = [p.strip() for p in (value or '').split(',') if p.strip()]
+    if not post_ids:
+        return None, ({'error': 'Missing post_ids'}, 400)
+    if len(post_ids) > LIVE_MAX_POSTS_PER_STREAM:
+        return None, ({'error': f'At most {LIVE_MAX_POSTS_PER_STREAM} post_ids per stream'}, 400)
+    return post_ids, None
+
+
+def create_like_buffer(flush_fn):
+    return LikeBuffer(
+        flush_fn,
+        os.environ.get("LIKE_JOURNAL_PATH", "/app/data/likes.journal"),
+        flush_interval=float(os.environ.get("LIKE_FLUSH_INTERVAL", "1.0")),
+        max_pending=int(os.environ.get("LIKE_FLUSH_MAX_PENDING", "500")),
+        max_attempts=int(os.environ.get("LIKE_FLUSH_MAX_ATTEMPTS", "5"))
+    )
+
+
+def create_live_hub():
+    return PostEventHub(
+        max_queue=int(os.environ.get("LIVE_MAX_QUEUE", "100")),
+        heartbeat_interval=float(os.environ.get("LIVE_HEARTBEAT_INTERVAL", "15"))
+    )
+
+
+def create_purge_worker(supabase):
+    """Background worker that deletes likes/comments in bounded chunks."""
+    return PurgeWorker(
+        supabase,
+        os.environ.get("PURGE_JOB_DIR", "/app/data/purge_jobs"),
+        chunk_size=int(os.environ.get("PURGE_CHUNK_SIZE", "500")),
+        lock_timeout=float(os.environ.get("PURGE_LOCK_TIMEOUT", "30")),
+        on_deleted=lambda post_ids: events.publish("social_data_purged", {"post_ids": post_ids})
+    )
+
+
+def admit_notifications(dedup, notifications):
+    """
+    Mirror notifications ((event_type, data) pairs) to the domain events
+    exchange and return those to send to the notifications queue.
+    """
+    for event_type, data in notifications:
+        # Read models (the feed projector) consume them from the domain events exchange
+        events.publish(event_type, data)
+    # Repeats (a like toggled back on) do not notify again within the window
+    return dedup.admit(notifications)
+
+
+def notification_message(event_type, data):
+    return {
+        "event_type": event_type,
+        "data": data
+    }
+
+
+def notification_headers():
+    # The listener measures delivery latency from x-published-at and continues the trace
+    return tracing.inject({"x-published-at": time.time()}, amqp=True)
+
+
+def like_entry(post_id, payload, post_owner_id, created_at=None):
+    """A like by the token's user, in the shape the like buffer keeps."""
+    return {
+        "post_id": post_id,
+        "liked_by_user_id": payload["user_id"],
+        "liked_by_username": payload["username"],
+        "post_owner_id": post_owner_id,
+        "created_at": created_at or datetime.now().isoformat()
+    }
+
+
+def like_row(entry):
+    return {
+        "post_id": entry["post_id"],
+        "liked_by_user_id": entry["liked_by_user_id"],
+        "liked_by_username": entry["liked_by_username"],
+        "post_owner_id": entry["post_owner_id"],
+    }
+
+
+def like_notification(entry):
+    return "new_like", {
+        "post_id": entry["post_id"],
+        "liked_by_user_id": entry["liked_by_user_id"],
+        "liked_by_username": entry["liked_by_username"],
+        "post_owner_id": entry["post_owner_id"],
+        "created_at": entry["created_at"]
+    }
+
+
+def like_changes(entries):
+    """Buffered changes as (inserts, deletes), each {post_id: [entries]}."""
+    inserts = {}
+    deletes = {}
+    for entry in entries:
+        target = inserts if entry["liked"] else deletes
+        target.setdefault(entry["post_id"], []).append(entry)
+    return inserts, deletes
+
+
+def liked_by(entries):
+    return [e["liked_by_user_id"] for e in entries]
+
+
+def not_yet_liked(entries, existing_rows):
+    # Skip likes that already landed, e.g. a flush interrupted by a crash and replayed
+    already_liked = {str(row["liked_by_user_id"]) for row in existing_rows or []}
+    return [e for e in entries if str(e["liked_by_user_id"]) not in already_liked]
+
+
+def likes_removed(post_id, entries):
+    for e in entries:
+        events.publish("like_removed", {"post_id": post_id, "liked_by_user_id": e["liked_by_user_id"]})
+
+
+def like_toggled(post_reads, relay, post_id, payload, liked):
+    """Invalidate a post's likes after the token's user liked or unliked it; (body, status) to answer."""
+    post_reads.forget(("likes", str(post_id)))
+    cache.purge(cache.likes_key(post_id))
+    relay.publish(post_id, "like", {
+        "post_id": post_id,
+        "delta": 1 if liked else -1,
+        "user_id": payload["user_id"],
+        "username": payload["username"]
+    })
+    if liked:
+        return {'message': 'Post liked'}, 201
+    return {'message': 'Post unliked'}, 200
+
+
+def likes_response(likes_data, pending, user_id):
+    """get_likes body, with like changes that have not been flushed yet overlaid."""
+    # Whether the current user has liked the post
+    has_liked = any(str(l["liked_by_user_id"]) == str(user_id) for l in likes_data)
+
+    for entry in pending:
+        liker = str(entry["liked_by_user_id"])
+        likes_data = [l for l in likes_data if str(l["liked_by_user_id"]) != liker]
+        if entry["liked"]:
+            likes_data.append(dict(like_row(entry), created_at=entry["created_at"]))
+        if liker == str(user_id):
+            has_liked = entry["liked"]
+
+    return {
+        'likes': likes_data,
+        'total_likes': len(likes_data),
+        'has_liked': has_liked
+    }
+
+
+def comment_row(post_id, payload, comment_text, parent_comment_id, reply_to_user_id):
+    return {
+        "post_id": post_id,
+        "user_id": payload['user_id'],
+        "username": payload['username'],
+        "comment_text": comment_text,
+        "parent_comment_id": parent_comment_id,
+        "reply_to_user_id": reply_to_user_id
+    }
+
+
+def comment_notification(row, comment, payload, post_owner_id):
+    """
+    (event_type, data) of the notification for a new comment, or None when
+    nobody is notified; row is what was inserted, comment what was stored.
+    """
+    if row["parent_comment_id"]:
+        # 1.  a reply to a comment: notify the person being replied to
+        if row["reply_to_user_id"] and row["reply_to_user_id"] != payload['user_id']:
+            return "comment_reply", {
+                "recipient_id": row["reply_to_user_id"],
+                "post_id": row["post_id"],
+                "comment_id": comment["id"],
+                "comment_text": row["comment_text"],
+                "parent_comment_id": row["parent_comment_id"],
+                "replier_username": payload['username'],
+                "replier_id": payload["user_id"],
+                "created_at": comment["created_at"]
+            }
+    # 2. new comment on the post: notify the post owner
+    elif post_owner_id != payload['user_id']:
+        return "new_comment", {
+            "recipient_id": post_owner_id,
+            "post_id": row["post_id"],
+            "comment_id": comment["id"],
+            "comment_text": row["comment_text"],
+            "commenter_username": payload['username'],
+            "commenter_id": payload['user_id'],
+            "created_at": comment["created_at"]
+        }
+    return None
+
+
+def comment_added(post_reads, relay, post_id, comment, payload):
+    """Invalidate and announce a stored comment; (body, status) to answer."""
+    post_reads.forget(("comments", str(post_id)))
+    cache.purge(cache.comments_key(post_id))
+    events.publish("comment_added", {"post_id": post_id, "comment_id": comment['id'], "user_id": payload['user_id']})
+    relay.publish(post_id, "comment", {
+        "post_id": post_id,
+        "comment": comment
+    })
+    return {
+        'message': 'Comment added successfully',
+        'comment': comment
+    }, 201
+
+
+def post_data_purging(post_reads, post_id):
+    post_reads.forget(("likes", str(post_id)))
+    post_reads.forget(("comments", str(post_id)))
+    cache.purge(cache.post_key(post_id))
+
+
+def purge_job_error(job, payload, action):
+    """(body, status) when the job does not exist or is not the caller's, else None."""
+    if not job:
+        return {'error': 'Purge job not found'}, 404
+    if job['requested_by'] != str(payload['user_id']):
+        return {'error': f'Unauthorized to {action} this job'}, 403
+    return None
+
+
+def bulk_request_error(payload, table):
+    """(body, status) when the caller may not export or import the table, else None."""
+    if not bulk.is_admin(payload):
+        return {'error': 'Admin access required'}, 403
+    if table not in BULK_TABLES:
+        return {'error': 'Unknown table'}, 404
+    return None
+
+
+def social_data_imported(post_reads, table, rows):
+    post_ids = sorted({str(row['post_id']) for row in rows if row.get('post_id') is not None})
+    key = cache.likes_key if table == "likes" else cache.comments_key
+    for post_id in post_ids:
+        post_reads.forget((table, post_id))
+    cache.purge(*(key(post_id) for post_id in post_ids))
+    if post_ids:
+        events.publish("data_imported", {"table": table, "post_ids": post_ids})
@@ -0,0 +1,243 @@
+import json
+import os
+from like_buffer import LikeBuffer
+
+
+class DatabaseError(Exception):
+    """Stands in for the PostgREST APIError, which carries the SQLSTATE as code."""
+
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+
+class Writer:
+    """flush_fn recording what lands; fail(entry) decides which writes raise."""
+
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.calls = []
+        self.written = []
+
+    def __call__(self, entries):
+        self.calls.append([(e["post_id"], e["liked_by_user_id"]) for e in entries])
+        if self.fail is not None:
+            for entry in entries:
+                error = self.fail(entry)
+                if error is not None:
+                    raise error
+        self.written.extend((e["post_id"], e["liked_by_user_id"], e["liked"]) for e in entries)
+
+
+def record(buffer, post_id, user_id, liked, base=None):
+    buffer.record(post_id, user_id, f"user{user_id}", 99, liked, (not liked) if base is None else base,
+                  "2024-01-01T00:00:00")
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_replays_journal_after_crash(tmp_path):
+    journal = str(tmp_path / "likes.journal")
+    buffer = LikeBuffer(Writer(), journal)
+    record(buffer, 1, 10, True)
+    record(buffer, 2, 10, True)
+    record(buffer, 2, 11, True)
+    record(buffer, 2, 11, False)
+    # Crash: nothing flushed, and the last write torn
+    with open(journal, "a", encoding="utf-8") as f:
+        f.write('{"post_id": 3, "liked_by')
+
+    writer = Writer()
+    recovered = LikeBuffer(writer, journal)
+    assert recovered.state(1, 10) is True
+    assert recovered.state(2, 10) is True
+    # The toggle back and forth nets out
+    assert recovered.state(2, 11) is None
+
+    assert recovered.flush() == 2
+    assert sorted(writer.written) == [(1, 10, True), (2, 10, True)]
+    assert read_lines(journal) == []
+
+
+def test_replays_interrupted_flush_before_newer_changes(tmp_path):
+    journal = str(tmp_path / "likes.journal")
+
+    def crash(entries):
+        raise SystemExit
+
+    buffer = LikeBuffer(crash, journal)
+    record(buffer, 1, 10, True)
+    try:
+        buffer.flush()
+    except SystemExit:
+        pass
+    # Unliked again after the flush started, in the fresh journal
+    record(buffer, 1, 10, False, base=True)
+    assert os.path.exists(journal + ".flushing")
+
+    writer = Writer()
+    recovered = LikeBuffer(writer, journal)
+    assert not os.path.exists(journal + ".flushing")
+    assert recovered.state(1, 10) is None
+    assert recovered.flush() == 0
+
+
+def test_failed_flush_is_merged_back_and_retried(tmp_path):
+    journal = str(tmp_path / "likes.journal")
+    down = [True]
+    writer = Writer(fail=lambda entry: ConnectionError("database unreachable") if down[0] else None)
+    buffer = LikeBuffer(writer, journal)
+    record(buffer, 1, 10, True)
+    record(buffer, 2, 11, True)
+
+    assert buffer.flush() == 0
+    assert buffer.state(1, 10) is True
+    assert buffer.state(2, 11) is True
+    assert not os.path.exists(journal + ".flushing")
+    assert len(read_lines(journal)) == 2
+
+    down[0] = False
+    assert buffer.flush() == 2
+    assert sorted(writer.written) == [(1, 10, True), (2, 11, True)]
+    assert buffer.state(1, 10) is None
+
+
+def test_connection_errors_never_dead_letter(tmp_path):
+    journal = str(tmp_path / "likes.journal")
+    buffer = LikeBuffer(Writer(fail=lambda entry: ConnectionError("timeout")), journal, max_attempts=2)
+    record(buffer, 1, 10, True)
+    for _ in range(5):
+        buffer.flush()
+    assert buffer.state(1, 10) is True
+    assert not os.path.exists(journal + ".dead")
+
+
+def test_change_made_during_failed_flush_wins(tmp_path):
+    journal = str(tmp_path / "likes.journal")
+    buffer = None
+
+    def unlike_then_fail(entries):
+        # The user unlikes while the like is being written
+        record(buffer, 1, 10, False, base=True)
+        raise ConnectionError("database unreachable")
+
+    buffer = LikeBuffer(unlike_then_fail, journal)
+    record(buffer, 1, 10, True)
+    buffer.flush()
+    # Never written, and unliked again: nothing to do
+    assert buffer.state(1, 10) is None
+    assert read_lines(journal) == []
+
+
+def test_rejected_row_does_not_hold_back_the_batch(tmp_path):
+    journal = str(tmp_path / "likes.journal")
+
+    def deleted_post(entry):
+        if entry["post_id"] == 2:
+            return DatabaseError("insert or update on table \"likes\" violates foreign key constraint", "23503")
+
+    writer = Writer(fail=deleted_post)
+    buffer = LikeBuffer(writer, journal)
+    record(buffer, 1, 10, True)
+    record(buffer, 2, 10, True)
+    record(buffer, 3, 11, True)
+
+    assert buffer.flush() == 2
+    assert sorted(writer.written) == [(1, 10, True), (3, 11, True)]
+    # Dropped at once and kept for inspection, not retried
+    assert buffer.state(2, 10) is None
+    dead = read_lines(journal + ".dead")
+    assert [(e["post_id"], e["liked_by_user_id"]) for e in dead] == [(2, 10)]
+    assert "foreign key" in dead[0]["error"]
+
+    calls = len(writer.calls)
+    assert buffer.flush() == 0
+    assert len(writer.calls) == calls
+
+
+def test_post_is_written_per_change_when_one_fails(tmp_path):
+    journal = str(tmp_path / "likes.journal")
+    writer = Writer(fail=lambda entry: DatabaseError("bad", "22P02") if entry["liked_by_user_id"] == 12 else None)
+    buffer = LikeBuffer(writer, journal)
+    record(buffer, 1, 10, True)
+    record(buffer, 1, 11, True)
+    record(buffer, 1, 12, True)
+    record(buffer, 2, 10, True)
+
+    buffer.flush()
+    assert sorted(writer.written) == [(1, 10, True), (1, 11, True), (2, 10, True)]
+    assert [(e["post_id"], e["liked_by_user_id"]) for e in read_lines(journal + ".dead")] == [(1, 12)]
+
+
+def test_repeatedly_rejected_change_is_dead_lettered(tmp_path):
+    journal = str(tmp_path / "likes.journal")
+    writer = Writer(fail=lambda entry: DatabaseError("statement timeout", "57014") if entry["post_id"] == 2 else None)
+    buffer = LikeBuffer(writer, journal, max_attempts=3)
+    record(buffer, 1, 10, True)
+    record(buffer, 2, 10, True)
+
+    buffer.flush()
+    buffer.flush()
+    assert buffer.state(2, 10) is True
+    assert not os.path.exists(journal + ".dead")
+
+    buffer.flush()
+    assert buffer.state(2, 10) is None
+    dead = read_lines(journal + ".dead")
+    assert [(e["post_id"], e["attempts"]) for e in dead] == [(2, 3)]
+    assert read_lines(journal) == []
+
+
+def test_discard_during_failed_flush_is_not_merged_back(tmp_path):
+    journal = str(tmp_path / "likes.journal")
+    buffer = None
+
+    def purge_then_fail(entries):
+        # The post's social data is purged while its likes are being written
+        buffer.discard(post_id=1)
+        raise ConnectionError("database unreachable")
+
+    buffer = LikeBuffer(purge_then_fail, journal)
+    record(buffer, 1, 10, True)
+    record(buffer, 2, 10, True)
+    buffer.flush()
+
+    assert buffer.state(1, 10) is None
+    assert buffer.state(2, 10) is True
+    assert [(e["post_id"], e["liked_by_user_id"]) for e in read_lines(journal)] == [(2, 10)]
+
+
+def test_discard_is_not_replayed_after_crash(tmp_path):
+    journal = str(tmp_path / "likes.journal")
+    buffer = LikeBuffer(Writer(), journal)
+    record(buffer, 1, 10, True)
+    record(buffer, 1, 11, True)
+    record(buffer, 2, 12, True)
+    buffer.discard(user_id=10)
+    buffer.discard(post_id=2)
+
+    recovered = LikeBuffer(Writer(), journal)
+    assert recovered.state(1, 10) is None
+    assert recovered.state(1, 11) is True
+    assert recovered.state(2, 12) is None
+
+
+def test_journal_is_fsynced_once_per_interval(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(os, "fsync", synced.append)
+    journal = str(tmp_path / "likes.journal")
+    buffer = LikeBuffer(Writer(), journal)
+    synced.clear()
+
+    for user_id in range(10):
+        record(buffer, 1, user_id, True)
+    assert synced == []
+    # Journaled for a process crash even before the sync
+    assert len(read_lines(journal)) == 10
+
+    buffer.sync()
+    buffer.sync()
+    assert len(synced) == 1
@@ -0,0 +1,10 @@
+import pytest
+from purge import PurgeWorker
+
+
+def test_second_worker_on_the_same_job_dir_fails_to_start(tmp_path):
+    job_dir = str(tmp_path / "jobs")
+    running = PurgeWorker(None, job_dir)
+
+    with pytest.raises(RuntimeError, match="single worker"):
+        PurgeWorker(None, job_dir, lock_timeout=0)
@@ -3,21 +3,22 @@ import os
 import json
 import logging
 import requests
-from supabase import create_client, Client
 from datetime import datetime
 import jwt
 from functools import wraps
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+from common import cache, db, responses, tracing, log
 
 app = Flask(__name__)
+responses.init_app(app)
+tracing.init_app(app, "user-service")
+log.init_app(app, "user-service")
+db.init_app(app)
+logger = logging.getLogger(__name__)
 
 # Initialize Supabase client
 supabase_url = os.environ.get("SUPABASE_URL")
 supabase_key = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(supabase_url, supabase_key)
+supabase = tracing.trace_supabase(db.create_client(supabase_url, supabase_key))
 
 # Define the table name for users
 USER_TABLE = "user"
@@ -32,13 +33,12 @@ def verify_token(token):
             os.getenv('JWT_SECRET', 'esd_jwt_secret_key'),
             algorithms=[os.getenv('JWT_ALGORITHM', 'HS256')]
         )
-        print("JWT Payload:", payload)  # Debug log
         return payload
     except jwt.ExpiredSignatureError:
-        print("Token expired")  # Debug log
+        logger.info("Token expired")
         return None
     except jwt.InvalidTokenError:
-        print("Invalid token")  # Debug log
+        logger.info("Invalid token")
         return None
 
 def token_required(f):
@@ -90,7 +90,7 @@ def create_user():
         return jsonify({"message": "User created successfully", "user": result.data[0]}), 201
 
     except Exception as e:
-        logger.error(f"Error creating user: {str(e)}")
+        logger.error("Error creating user: %s", e)
         return jsonify({"error": f"Error creating user: {str(e)}"}), 500
 
 @app.route("/api/user/<user_id>", methods=["GET"])
@@ -108,7 +108,7 @@ def get_user(user_id):
 
         return jsonify({"user": result.data[0]}), 200
     except Exception as e:
-        logger.error(f"Error fetching user: {str(e)}")
+        logger.error("Error fetching user: %s", e)
         return jsonify({"error": f"Error fetching user: {str(e)}"}), 500
 
 @app.route("/api/user/<user_id>/taste-preferences", methods=["GET"])
@@ -128,7 +128,7 @@ def get_taste_preferences(user_id):
         taste_preferences = result.data[0].get("taste_preferences", {})
         return jsonify({"taste_preferences": taste_preferences}), 200
     except Exception as e:
-        logger.error(f"Error fetching taste preferences: {str(e)}")
+        logger.error("Error fetching taste preferences: %s", e)
         return jsonify({"error": f"Error fetching taste preferences: {str(e)}"}), 500
 
 @app.route("/api/user/<user_id>/taste-preferences", methods=["PUT"])
@@ -157,6 +157,8 @@ def update_taste_preferences(user_id):
         
         if len(result.data) == 0:
             return jsonify({"error": "Failed to update preferences"}), 501
+        # The personalized feed is cached per user and preferences
+        cache.purge(cache.preferences_key(user_id))
             
         return jsonify({
             "message": "Preferences updated successfully",
@@ -164,7 +166,7 @@ def update_taste_preferences(user_id):
         }), 200
         
     except Exception as e:
-        logger.error(f"Error updating taste preferences: {str(e)}")
+        logger.error("Error updating taste preferences: %s", e)
         return jsonify({"error": f"Error updating taste preferences: {str(e)}"}), 500
 
 
@@ -194,8 +196,8 @@ def delete_user(user_id):
         return jsonify({"message": "User deleted successfully"}), 200
         
     except Exception as e:
-        logger.error(f"Error deleting user: {str(e)}")
+        logger.error("Error deleting user: %s", e)
         return jsonify({"error": f"Error deleting user: {str(e)}"}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5002, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5002)
\ No newline at end of file
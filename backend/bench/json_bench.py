@@ -0,0 +1,118 @@
+"""
+Encode time and response size of feed-sized JSON payloads: Flask's default
+JSON provider vs the orjson provider in common/responses.py, then the bytes
+and time for gzip and brotli at the levels the services can be configured with.
+
+Payloads match the shapes returned by GET /api/posts (feed) and
+GET /api/social/comments/<post_id> (comment tree).
+
+    python bench/json_bench.py --posts 100,1000,5000 --comments 500
+
+Run from backend/ with flask, orjson and brotli installed.
+"""
+
+import argparse
+import gzip
+import random
+import time
+from datetime import datetime, timedelta
+import brotli
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from common.responses import OrjsonProvider
+
+TAGS = ["Adventure", "Relaxation", "Museums", "Vegetarian", "Halal", "Nightlife", "Nature", "Shopping"]
+WORDS = ("hawker stall sunset trail rooftop market temple harbour noodles museum garden island "
+         "ferry sambal coffee kaya gallery heritage street night cycling beach lantern").split()
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def feed_payload(count, seed=43):
+    rng = random.Random(seed)
+    started = datetime(2025, 1, 1)
+    return {"posts": [{
+        "id": post_id,
+        "title": sentence(rng, 5),
+        "content": " ".join(sentence(rng, rng.randint(8, 20)) for _ in range(rng.randint(1, 4))),
+        "image_url": f"https://res.cloudinary.com/demo/image/upload/v1712345678/posts/{post_id:08x}.jpg",
+        "created_at": (started + timedelta(minutes=post_id)).isoformat(),
+        "user_id": rng.randint(1, 500),
+        "username": f"traveller{rng.randint(1, 500)}",
+        "preference": rng.sample(TAGS, rng.randint(0, 3)),
+        "location": rng.choice(["Singapore", "Tokyo, Japan", "Bali, Indonesia", "Seoul, South Korea"]),
+    } for post_id in range(count, 0, -1)]}
+
+
+def comments_payload(count, seed=44):
+    rng = random.Random(seed)
+    started = datetime(2025, 1, 1)
+    top = []
+    for comment_id in range(1, count + 1):
+        author = rng.randint(1, 500)
+        comment = {
+            "id": comment_id, "post_id": 1, "user_id": author, "username": f"traveller{author}",
+            "comment_text": sentence(rng, rng.randint(4, 25)), "parent_comment_id": None,
+            "reply_to_user_id": None, "created_at": (started + timedelta(seconds=comment_id)).isoformat(),
+        }
+        if top and rng.random() < 0.6:
+            parent = rng.choice(top)
+            comment["parent_comment_id"] = parent["id"]
+            comment["reply_to_user_id"] = parent["user_id"]
+            parent["replies"].append(comment)
+        else:
+            comment["replies"] = []
+            top.append(comment)
+    return {"comments": top}
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", default="100,1000,5000", help="feed sizes to encode")
+    parser.add_argument("--comments", type=int, default=500, help="comments in the thread payload")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    providers = {"flask": DefaultJSONProvider(app), "orjson": OrjsonProvider(app)}
+    payloads = [(f"feed {n}", feed_payload(int(n))) for n in args.posts.split(",")]
+    payloads.append((f"comments {args.comments}", comments_payload(args.comments)))
+    codecs = [
+        ("gzip-1", lambda data: gzip.compress(data, compresslevel=1)),
+        ("gzip-6", lambda data: gzip.compress(data, compresslevel=6)),
+        ("br-4", lambda data: brotli.compress(data, quality=4)),
+        ("br-11", lambda data: brotli.compress(data, quality=11)),
+    ]
+
+    print(f"{'payload':<14} {'encoder':<8} {'encode ms':>10} {'bytes':>10}")
+    bodies = {}
+    with app.app_context():
+        for name, payload in payloads:
+            for provider_name, provider in providers.items():
+                ms, response = best_of(lambda: provider.response(payload), args.repeat)
+                body = response.get_data()
+                bodies[name] = body
+                print(f"{name:<14} {provider_name:<8} {ms:>10.2f} {len(body):>10,}")
+
+    print(f"\n{'payload':<14} {'codec':<8} {'ms':>10} {'bytes':>10} {'ratio':>7}")
+    for name, _ in payloads:
+        body = bodies[name]
+        for codec_name, codec in codecs:
+            ms, compressed = best_of(lambda: codec(body), max(1, args.repeat // 4))
+            print(f"{name:<14} {codec_name:<8} {ms:>10.2f} {len(compressed):>10,} {len(body) / len(compressed):>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Throughput of a Flask service under the development server vs gunicorn.
+
+Runs the create-post service's GET /api/user/taste-preferences, which verifies
+the JWT and makes one downstream HTTP call, against a local stand-in for the
+user service with a fixed latency (standing in for Supabase/HTTP wait), and
+reports requests/second and latency percentiles per serving mode.
+
+    python bench/serve_bench.py --modes dev,gthread,gevent --concurrency 64 --latency-ms 20
+
+Run from backend/ with gunicorn and gevent installed.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import jwt
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JWT_SECRET = "bench-secret-for-local-load-testing-only"
+
+PREFERENCES = json.dumps({
+    "taste_preferences": {
+        "diet": ["Vegetarian"],
+        "travel_style": ["Adventure", "Relaxation"],
+        "tourist_sites": ["Museums"]
+    }
+}).encode("utf-8")
+
+
+def percentile(samples, pct):
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def start_downstream(port, latency_ms):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency_ms / 1000)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(PREFERENCES)))
+            self.end_headers()
+            self.wfile.write(PREFERENCES)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_service(mode, port, downstream_port, workers, threads):
+    env = dict(
+        os.environ,
+        PYTHONPATH=BACKEND_DIR,
+        JWT_SECRET=JWT_SECRET,
+        PREFERENCES_SERVICE_URL=f"http://127.0.0.1:{downstream_port}",
+        PORT=str(port),
+        WEB_WORKERS=str(workers),
+        WEB_THREADS=str(threads),
+        WEB_ACCESS_LOG="",
+    )
+    if mode == "dev":
+        cmd = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port)]
+    else:
+        env["WEB_WORKER_CLASS"] = mode
+        cmd = [sys.executable, "-m", "gunicorn", "-c", os.path.join(BACKEND_DIR, "common", "gunicorn_conf.py"), "app:app"]
+
+    process = subprocess.Popen(
+        cmd, cwd=os.path.join(BACKEND_DIR, "create"), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return process
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def run_load(url, token, concurrency, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client():
+        session = requests.Session()
+        headers = {"Authorization": f"Bearer {token}"}
+        local, failed = [], 0
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                ok = session.get(url, headers=headers, timeout=30).status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            if ok:
+                local.append(time.perf_counter() - started)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    return latencies, errors[0], time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="dev,gthread,gevent")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--port", type=int, default=5905)
+    parser.add_argument("--downstream-port", type=int, default=5906)
+    args = parser.parse_args()
+
+    downstream = start_downstream(args.downstream_port, args.latency_ms)
+    token = jwt.encode({"user_id": "bench-user", "username": "bench"}, JWT_SECRET, algorithm="HS256")
+    url = f"http://127.0.0.1:{args.port}/api/user/taste-preferences"
+
+    print(f"{'mode':<8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    try:
+        for mode in args.modes.split(","):
+            process = start_service(mode, args.port, args.downstream_port, args.workers, args.threads)
+            try:
+                run_load(url, token, args.concurrency, 2)  # warm-up
+                latencies, errors, elapsed = run_load(url, token, args.concurrency, args.duration)
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+            print(
+                f"{mode:<8} {len(latencies) / elapsed:>8.1f} "
+                f"{percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 95) * 1000:>8.1f} "
+                f"{percentile(latencies, 99) * 1000:>8.1f} {errors:>7}"
+            )
+    finally:
+        downstream.shutdown()
+
+
+if __name__ == "__main__":
+    main()
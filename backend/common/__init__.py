@@ -0,0 +1,7 @@
+"""
+Code shared by the Python services.
+
+Each service's Docker image copies this package next to its own sources (the
+build context is ./backend), so it is imported as `common.<module>`. When
+running a service outside Docker, put ./backend on PYTHONPATH.
+"""
@@ -0,0 +1,164 @@
+"""
+aiohttp counterparts of the Flask integrations, for the asyncio services
+(post/async_post.py, Social/async_social.py):
+
+    app = web.Application(client_max_size=...)
+    aio.init_app(app, "post-service")
+
+init_app() installs one middleware that does, per request, what the Flask
+services get from tracing/log/db/responses.init_app: the request span and
+X-Request-ID, log sampling and the request record, query counting against
+DB_BUDGETS, compression of the response, and Cache-Control: no-store unless
+the handler made the response cacheable (cache.py). Endpoints are named with
+Flask's <param> syntax ("GET /api/social/likes/<post_id>"), so
+LOG_SAMPLE_RATES and DB_BUDGETS apply to both variants unchanged.
+
+It also answers CORS preflights and runs lifecycle.drain()/shutdown() from the
+app's on_shutdown/on_cleanup signals, which is when aiohttp (and its gunicorn
+worker) stops. Drain hooks run on the event loop, so they may touch asyncio
+objects (e.g. close live streams) but must not block; shutdown hooks run on a
+worker thread.
+
+Configuration (environment):
+    AIO_OFFLOAD_SIZE   bytes above which a response is compressed on a worker thread
+                       instead of the event loop (default 65536)
+"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+from aiohttp import web
+from common import cache, db, lifecycle, log, responses, tracing
+
+logger = logging.getLogger(__name__)
+
+AIO_OFFLOAD_SIZE = int(os.environ.get("AIO_OFFLOAD_SIZE", str(64 * 1024)))
+
+CORS_METHODS = "GET, POST, PUT, DELETE, OPTIONS"
+CORS_HEADERS = "Content-Type, Authorization, Idempotency-Key"
+
+_ROUTE_PARAM = re.compile(r"\{(\w+)(:[^}]*)?\}")
+
+
+def json_response(data, status=200, headers=None):
+    return web.Response(body=responses.dumps(data), status=status, headers=headers,
+                        content_type="application/json")
+
+
+async def read_json(request):
+    """The request's JSON object, or None for a missing, malformed or non-object body (a 400, not a 500)."""
+    if not request.can_read_body:
+        return None
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def endpoint_name(request):
+    route = request.match_info.route
+    resource = route.resource if route is not None else None
+    path = _ROUTE_PARAM.sub(r"<\1>", resource.canonical) if resource is not None else request.path
+    return f"{request.method} {path}"
+
+
+async def compress(request, response):
+    """Compress a buffered response in place; the aiohttp version of responses.compress_response()."""
+    body = response.body
+    if not isinstance(response, web.Response) or not isinstance(body, (bytes, bytearray)) \
+            or response.status < 200 or response.status in (204, 206, 304) \
+            or "Content-Encoding" in response.headers \
+            or response.content_type not in responses.COMPRESS_MIMETYPES:
+        return response
+
+    response.headers.add("Vary", "Accept-Encoding")
+    if len(body) < responses.COMPRESS_MIN_SIZE:
+        return response
+    encoding = responses.negotiate_encoding(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+
+    if len(body) > AIO_OFFLOAD_SIZE:
+        body = await asyncio.to_thread(responses.encode, body, encoding)
+    else:
+        body = responses.encode(body, encoding)
+    response.body = body
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def _cors(request, response, origins):
+    origin = request.headers.get("Origin")
+    if origin and ("*" in origins or origin in origins):
+        response.headers["Access-Control-Allow-Origin"] = "*" if "*" in origins else origin
+        response.headers.add("Vary", "Origin")
+    return response
+
+
+def init_app(app, service, cors_origins=("*",)):
+    tracing.configure(service)
+    log.setup(service)
+    origins = frozenset(cors_origins)
+
+    @web.middleware
+    async def _request_middleware(request, handler):
+        if request.method == "OPTIONS" and "Access-Control-Request-Method" in request.headers:
+            return _cors(request, web.Response(status=204, headers={
+                "Access-Control-Allow-Methods": CORS_METHODS,
+                "Access-Control-Allow-Headers": CORS_HEADERS,
+            }), origins)
+
+        endpoint = endpoint_name(request)
+        trace_id, parent_id = tracing.extract(request.headers)
+        started = time.perf_counter()
+        s, trace_token = tracing.start_span(
+            endpoint, trace_id=trace_id or tracing.new_trace_id(), parent_id=parent_id, path=request.path
+        )
+        sampled_token = log.start_request(endpoint)
+        stats_token = db.start_request()
+        error = None
+        try:
+            try:
+                response = await handler(request)
+            except web.HTTPException as e:
+                # 404/405/413 raised by aiohttp itself
+                response = e
+            except Exception:
+                logger.exception("Unhandled error in %s", endpoint)
+                response = json_response({'error': 'Internal server error'}, 500)
+            s.set(status_code=response.status)
+            if response.status >= 500:
+                s.status = "error"
+            stats_headers = db.check_budget(endpoint)
+            log.log_request(request.method, request.path, response.status, started)
+            if response.prepared:
+                # Streamed (SSE): headers went out with the first chunk
+                return response
+            for name, value in stats_headers:
+                response.headers.add(name, value)
+            response.headers[tracing.REQUEST_ID_HEADER] = s.trace_id
+            cache.apply_default(response.headers)
+            response = await compress(request, response)
+            return _cors(request, response, origins)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            db.end_request(stats_token)
+            log.end_request(sampled_token)
+            tracing.end_span(s, trace_token, error)
+
+    async def _drain(app):
+        lifecycle.drain()
+
+    async def _shutdown(app):
+        # Hooks may block (flushing buffers); keep the loop free for what is still running
+        await asyncio.to_thread(lifecycle.shutdown)
+
+    app.middlewares.append(_request_middleware)
+    app.on_shutdown.append(_drain)
+    app.on_cleanup.append(_shutdown)
+    return app
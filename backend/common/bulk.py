@@ -0,0 +1,477 @@
+"""
+Bulk export and import of whole tables as NDJSON (one JSON object per line),
+for backfills, migrations and analytics pulls. The post service serves the
+post table, the social service likes and comments, on admin-only endpoints.
+
+Export streams the table in key order. Pages are read with keyset pagination
+(key > last key seen, on the key's index), so the millionth row costs the
+same to reach as the first, where an offset would scan everything before it;
+one page is held in memory at a time. The response is compressed on the fly
+(br or gzip, per Accept-Encoding) and flushed page by page.
+
+Import reads the request body as it arrives (optionally Content-Encoding:
+gzip) and inserts BULK_IMPORT_BATCH_SIZE rows per request to the database.
+The response is itself NDJSON, one line per batch as it completes:
+
+    {"batch": 1, "first_line": 1, "last_line": 500, "rows": 500, "status": "imported"}
+    {"batch": 2, "first_line": 501, "last_line": 1000, "rows": 500, "status": "failed", "error": "..."}
+    {"line": 1042, "status": "invalid", "error": "Expected a JSON object"}
+    {"summary": {"lines": 1200, "batches": 3, "imported": 700, "failed": 500, "failed_batches": 1, "invalid": 1}}
+
+A failed batch does not stop the import; re-send its lines once fixed.
+?mode=upsert overwrites rows with the same key instead of failing on them,
+so a whole import can be re-run. An export imports as is; rows come out
+parents first (comments by id), so replies follow the comments they answer.
+
+Rows imported with their id do not advance the table's id sequence, so the
+next post or comment created would collide with them. When a batch carried
+ids, the import ends by moving the sequence past the largest id through the
+reset_id_sequence function (Supabase SQL editor), and reports the outcome
+in the summary ("id_sequence": next id, or "id_sequence_error"):
+
+    create or replace function reset_id_sequence(table_name text) returns bigint
+    language plpgsql security definer as $$
+    declare next_id bigint;
+    begin
+        execute format('select setval(pg_get_serial_sequence(%L, ''id''), coalesce(max(id), 0) + 1, false) from %I',
+                       table_name, table_name) into next_id;
+        return next_id;
+    end $$;
+
+Configuration (environment):
+    ADMIN_USER_IDS            comma-separated user ids allowed to export and import (default none)
+    BULK_EXPORT_PAGE_SIZE     rows per database page when exporting (default 1000, Supabase's max-rows)
+    BULK_IMPORT_BATCH_SIZE    rows per insert when importing (default 500)
+    BULK_IMPORT_MAX_LINE      bytes a single line may take (default 1048576)
+    BULK_IMPORT_MAX_BYTES     request body limit for imports; 0 is none (default 0)
+"""
+
+import logging
+import os
+import zlib
+from collections import namedtuple
+from common import cache, responses
+
+logger = logging.getLogger(__name__)
+
+ADMIN_USER_IDS = frozenset(user_id.strip() for user_id in
+                           os.environ.get("ADMIN_USER_IDS", "").split(",") if user_id.strip())
+BULK_EXPORT_PAGE_SIZE = int(os.environ.get("BULK_EXPORT_PAGE_SIZE", "1000"))
+BULK_IMPORT_BATCH_SIZE = int(os.environ.get("BULK_IMPORT_BATCH_SIZE", "500"))
+BULK_IMPORT_MAX_LINE = int(os.environ.get("BULK_IMPORT_MAX_LINE", str(1024 * 1024)))
+BULK_IMPORT_MAX_BYTES = int(os.environ.get("BULK_IMPORT_MAX_BYTES", "0"))
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+RESET_SEQUENCE_FUNCTION = "reset_id_sequence"
+IMPORT_MODES = ("insert", "upsert")
+READ_SIZE = 64 * 1024
+MAX_ERROR_LENGTH = 500
+
+Batch = namedtuple("Batch", ["number", "first_line", "last_line", "rows"])
+
+
+def is_admin(payload):
+    return bool(payload) and str(payload.get("user_id")) in ADMIN_USER_IDS
+
+
+def page_queries(supabase, table, key, last, page_size=BULK_EXPORT_PAGE_SIZE):
+    """
+    The queries for the page of table after key values last (None: the first
+    page). Run them in order; the first that returns rows is the page, and if
+    none does the export is complete. A composite key (a, b) needs two: the
+    rest of the rows with a == last a, then those with a greater a.
+    """
+    def ordered(query):
+        for column in key:
+            query = query.order(column)
+        return query.limit(page_size)
+
+    if last is None:
+        return [ordered(supabase.table(table).select("*"))]
+    queries = []
+    for i in range(len(key) - 1, -1, -1):
+        query = supabase.table(table).select("*")
+        for column, value in zip(key[:i], last[:i]):
+            query = query.eq(column, value)
+        queries.append(ordered(query.gt(key[i], last[i])))
+    return queries
+
+
+def last_key(rows, key):
+    return tuple(rows[-1][column] for column in key)
+
+
+def export_pages(supabase, table, key, page_size=BULK_EXPORT_PAGE_SIZE):
+    """Every row of table in key order, one page (list of rows) at a time."""
+    last = None
+    while True:
+        rows = []
+        for query in page_queries(supabase, table, key, last, page_size):
+            rows = query.execute().data or []
+            if rows:
+                break
+        if not rows:
+            return
+        yield rows
+        last = last_key(rows, key)
+
+
+def encode_lines(rows):
+    return b"".join(responses.dumps(row) for row in rows)
+
+
+class StreamEncoder:
+    """Incremental br/gzip for a streamed body; each chunk is flushed so the client sees it at once."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = responses.brotli.Compressor(quality=responses.COMPRESS_BR_QUALITY)
+        elif encoding == "gzip":
+            self._compressor = zlib.compressobj(responses.COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        else:
+            self._compressor = None
+
+    def encode(self, data):
+        if self._compressor is None:
+            return data
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self._compressor is None:
+            return b""
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def export_headers(table, encoding):
+    headers = {
+        "Content-Disposition": f'attachment; filename="{table}.ndjson"',
+        "Cache-Control": cache.NO_STORE,
+        "Vary": "Accept-Encoding",
+        # Proxies must pass pages on as they come
+        "X-Accel-Buffering": "no",
+    }
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return headers
+
+
+class NdjsonImport:
+    """
+    Cuts an NDJSON body, fed in chunks as it arrives, into batches of rows,
+    and keeps the counts for the import's report. feed() and finish() yield
+    Batch tuples to insert and report lines (dicts) for invalid lines.
+    """
+
+    def __init__(self, table, key, upsert=False, gzipped=False,
+                 batch_size=BULK_IMPORT_BATCH_SIZE, max_line=BULK_IMPORT_MAX_LINE):
+        self.table = table
+        self.key = key
+        self.upsert = upsert
+        self.batch_size = batch_size
+        self.max_line = max_line
+        self.line = 0
+        self.batches = 0
+        self.imported = 0
+        self.failed = 0
+        self.failed_batches = 0
+        self.invalid = 0
+        # Whether a stored batch set ids itself, and the id sequence must follow
+        self.explicit_ids = False
+        self.sequence = None
+        # gzip or zlib, detected from the header
+        self._inflater = zlib.decompressobj(32 + zlib.MAX_WBITS) if gzipped else None
+        self._buffer = bytearray()
+        self._skipping = False
+        self._pending = []
+
+    def feed(self, chunk):
+        if self._inflater is None:
+            yield from self._split(chunk)
+            return
+        # Inflate a piece at a time so a small, highly compressed body cannot fill memory
+        data = self._inflater.decompress(chunk, READ_SIZE)
+        while True:
+            yield from self._split(data)
+            if not self._inflater.unconsumed_tail:
+                return
+            data = self._inflater.decompress(self._inflater.unconsumed_tail, READ_SIZE)
+
+    def finish(self):
+        if self._inflater is not None:
+            yield from self._split(self._inflater.flush())
+        if self._skipping:
+            self._skipping = False
+            yield self._invalid_line()
+        elif self._buffer:
+            yield from self._line(bytes(self._buffer))
+            self._buffer.clear()
+        if self._pending:
+            yield self._batch()
+
+    def _split(self, data):
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                break
+            if self._skipping:
+                self._skipping = False
+                yield self._invalid_line()
+            else:
+                self._buffer += data[start:end]
+                yield from self._line(bytes(self._buffer))
+            self._buffer.clear()
+            start = end + 1
+        if not self._skipping:
+            self._buffer += data[start:]
+            if len(self._buffer) > self.max_line:
+                # Drop the rest of this line as it arrives
+                self._skipping = True
+                self._buffer.clear()
+
+    def _line(self, line):
+        self.line += 1
+        if len(line) > self.max_line:
+            yield self._invalid(f"Line longer than {self.max_line} bytes")
+            return
+        if not line.strip():
+            return
+        try:
+            row = responses.loads(line)
+        except ValueError as e:
+            yield self._invalid(f"Invalid JSON: {e}")
+            return
+        if not isinstance(row, dict):
+            yield self._invalid("Expected a JSON object")
+            return
+        self._pending.append((self.line, row))
+        if len(self._pending) >= self.batch_size:
+            yield self._batch()
+
+    def _invalid_line(self):
+        self.line += 1
+        return self._invalid(f"Line longer than {self.max_line} bytes")
+
+    def _invalid(self, error):
+        self.invalid += 1
+        return {"line": self.line, "status": "invalid", "error": error}
+
+    def _batch(self):
+        self.batches += 1
+        batch = Batch(self.batches, self._pending[0][0], self._pending[-1][0], [row for _, row in self._pending])
+        self._pending = []
+        return batch
+
+    def query(self, supabase, batch):
+        """The insert (or upsert) of one batch; the caller executes it."""
+        if self.upsert:
+            return supabase.table(self.table).upsert(batch.rows, on_conflict=",".join(self.key))
+        return supabase.table(self.table).insert(batch.rows)
+
+    def report(self, batch, error=None):
+        line = {"batch": batch.number, "first_line": batch.first_line, "last_line": batch.last_line,
+                "rows": len(batch.rows), "status": "imported"}
+        if error is None:
+            self.imported += len(batch.rows)
+            self.explicit_ids = self.explicit_ids or any(row.get("id") is not None for row in batch.rows)
+            return line
+        logger.warning("Import into %s: batch %d (lines %d-%d) failed: %s",
+                       self.table, batch.number, batch.first_line, batch.last_line, error)
+        self.failed += len(batch.rows)
+        self.failed_batches += 1
+        line.update(status="failed", error=str(error)[:MAX_ERROR_LENGTH])
+        return line
+
+    def reset_sequence_query(self, supabase):
+        """The call moving the id sequence past imported ids, or None if no ids were imported."""
+        if not self.explicit_ids:
+            return None
+        return supabase.rpc(RESET_SEQUENCE_FUNCTION, {"table_name": self.table})
+
+    def sequence_reset(self, result=None, error=None):
+        if error is not None:
+            logger.error("Could not reset the id sequence of %s after an import: %s; "
+                         "new rows may collide with imported ids", self.table, error)
+            self.sequence = {"id_sequence_error": str(error)[:MAX_ERROR_LENGTH]}
+        else:
+            self.sequence = {"id_sequence": getattr(result, "data", None)}
+
+    def summary(self):
+        logger.info("Imported %d rows into %s (%d failed, %d invalid lines)",
+                    self.imported, self.table, self.failed, self.invalid)
+        return {"summary": {"lines": self.line, "batches": self.batches, "imported": self.imported,
+                            "failed": self.failed, "failed_batches": self.failed_batches,
+                            "invalid": self.invalid, **(self.sequence or {})}}
+
+
+def _import_options(args, headers):
+    """(NdjsonImport keyword arguments, None) or (None, error message)."""
+    mode = args.get("mode", "insert")
+    if mode not in IMPORT_MODES:
+        return None, f"mode must be one of {', '.join(IMPORT_MODES)}"
+    encoding = headers.get("Content-Encoding", "identity").lower()
+    if encoding not in ("identity", "gzip"):
+        return None, "Content-Encoding must be gzip or identity"
+    return {"upsert": mode == "upsert", "gzipped": encoding == "gzip"}, None
+
+
+def _imported_rows(result, batch):
+    # Inserted rows as the database returned them, with generated ids
+    return getattr(result, "data", None) or batch.rows
+
+
+def export_response(supabase, table, key):
+    """Flask response streaming table as NDJSON."""
+    from flask import Response, request, stream_with_context
+
+    encoding = responses.negotiate_encoding(request.headers.get("Accept-Encoding"))
+
+    def generate():
+        encoder = StreamEncoder(encoding)
+        exported = 0
+        for rows in export_pages(supabase, table, key):
+            exported += len(rows)
+            yield encoder.encode(encode_lines(rows))
+        yield encoder.finish()
+        logger.info("Exported %d rows from %s", exported, table)
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE,
+                    headers=export_headers(table, encoding))
+
+
+def import_response(supabase, table, key, after_batch=None):
+    """
+    Flask response importing the NDJSON request body into table, streaming the
+    report. after_batch(rows) runs after each batch is stored (cache purges, events).
+    """
+    from flask import Response, jsonify, request, stream_with_context
+    from werkzeug.exceptions import HTTPException
+    from werkzeug.wsgi import get_input_stream
+
+    options, error = _import_options(request.args, request.headers)
+    if error:
+        return jsonify({'error': error}), 400
+    importer = NdjsonImport(table, key, **options)
+    # Not request.stream: the app's MAX_CONTENT_LENGTH is meant for uploads
+    stream = get_input_stream(request.environ, max_content_length=BULK_IMPORT_MAX_BYTES or None)
+
+    def store(item):
+        if not isinstance(item, Batch):
+            return item
+        try:
+            result = importer.query(supabase, item).execute()
+        except Exception as e:
+            return importer.report(item, e)
+        if after_batch is not None:
+            after_batch(_imported_rows(result, item))
+        return importer.report(item)
+
+    def generate():
+        try:
+            for chunk in iter(lambda: stream.read(READ_SIZE), b""):
+                for item in importer.feed(chunk):
+                    yield responses.dumps(store(item))
+            for item in importer.finish():
+                yield responses.dumps(store(item))
+        except (HTTPException, zlib.error) as e:
+            # Body cut short or not valid gzip; what was stored stays stored
+            logger.warning("Import into %s stopped at line %d: %s", table, importer.line, e)
+            yield responses.dumps({"line": importer.line, "status": "aborted", "error": str(e)})
+        query = importer.reset_sequence_query(supabase)
+        if query is not None:
+            try:
+                importer.sequence_reset(query.execute())
+            except Exception as e:
+                importer.sequence_reset(error=e)
+        yield responses.dumps(importer.summary())
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE,
+                    headers={"Cache-Control": cache.NO_STORE, "X-Accel-Buffering": "no"})
+
+
+async def export_response_async(request, supabase, table, key):
+    """aiohttp version of export_response(); supabase is the async client."""
+    from aiohttp import web
+
+    encoding = responses.negotiate_encoding(request.headers.get("Accept-Encoding"))
+    headers = export_headers(table, encoding)
+    headers["Content-Type"] = NDJSON_MIMETYPE
+    response = web.StreamResponse(headers=headers)
+    await response.prepare(request)
+
+    encoder = StreamEncoder(encoding)
+    exported = 0
+    last = None
+    while True:
+        rows = []
+        for query in page_queries(supabase, table, key, last):
+            rows = (await query.execute()).data or []
+            if rows:
+                break
+        if not rows:
+            break
+        exported += len(rows)
+        await response.write(encoder.encode(encode_lines(rows)))
+        last = last_key(rows, key)
+    await response.write(encoder.finish())
+    await response.write_eof()
+    logger.info("Exported %d rows from %s", exported, table)
+    return response
+
+
+async def import_response_async(request, supabase, table, key, after_batch=None):
+    """aiohttp version of import_response(); after_batch(rows) may be a coroutine function."""
+    import asyncio
+    from aiohttp import web
+    from common import aio
+
+    options, error = _import_options(request.query, request.headers)
+    if error:
+        return aio.json_response({'error': error}, 400)
+    # aiohttp inflates a gzip request body itself
+    options["gzipped"] = False
+    importer = NdjsonImport(table, key, **options)
+    response = web.StreamResponse(headers={"Content-Type": NDJSON_MIMETYPE, "Cache-Control": cache.NO_STORE,
+                                           "X-Accel-Buffering": "no"})
+    await response.prepare(request)
+
+    async def store(item):
+        if not isinstance(item, Batch):
+            return item
+        try:
+            result = await importer.query(supabase, item).execute()
+        except Exception as e:
+            return importer.report(item, e)
+        if after_batch is not None:
+            done = after_batch(_imported_rows(result, item))
+            if asyncio.iscoroutine(done):
+                await done
+        return importer.report(item)
+
+    received = 0
+    try:
+        async for chunk in request.content.iter_chunked(READ_SIZE):
+            received += len(chunk)
+            if BULK_IMPORT_MAX_BYTES and received > BULK_IMPORT_MAX_BYTES:
+                raise web.HTTPRequestEntityTooLarge(max_size=BULK_IMPORT_MAX_BYTES, actual_size=received)
+            for item in importer.feed(chunk):
+                await response.write(responses.dumps(await store(item)))
+        for item in importer.finish():
+            await response.write(responses.dumps(await store(item)))
+    except (web.HTTPException, zlib.error) as e:
+        logger.warning("Import into %s stopped at line %d: %s", table, importer.line, e)
+        await response.write(responses.dumps({"line": importer.line, "status": "aborted", "error": str(e)}))
+    query = importer.reset_sequence_query(supabase)
+    if query is not None:
+        try:
+            importer.sequence_reset(await query.execute())
+        except Exception as e:
+            importer.sequence_reset(error=e)
+    await response.write(responses.dumps(importer.summary()))
+    await response.write_eof()
+    return response
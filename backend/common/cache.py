@@ -0,0 +1,214 @@
+"""
+HTTP caching headers for read endpoints, and purging by surrogate key on writes.
+
+Read endpoints mark their responses cacheable by a shared cache that
+purges by key (Varnish with xkey, a CDN such as Fastly) and tag them with surrogate keys naming the data
+they contain:
+
+    headers = cache.cacheable(cache.post_key(post_id), cache.comments_key(post_id))
+    -> Cache-Control: public, max-age=0, s-maxage=30, stale-while-revalidate=30
+       Surrogate-Key: post-12 post-12-comments
+       Vary: Authorization
+
+Browsers always revalidate (max-age=0); only the shared cache holds the
+response, for up to CACHE_S_MAXAGE seconds. Write paths call purge() with the
+keys they invalidate, and every registered hook is called with them. The keys
+are sent to the cache at CACHE_PURGE_URL in batches from a background thread,
+as one request with the keys in a Surrogate-Key header (Fastly's batch purge
+and Varnish xkey both accept this format). The write never waits on the cache.
+
+Shared caching is only offered when CACHE_PURGE_URL is set: a cache that
+cannot purge by key (Kong's open-source proxy-cache) would serve a write's
+old data, to the writer too, until the entry expires. Without it every
+response is private, no-cache. Responses that depend on the caller
+(per_user: has_liked, personal rankings) are always private, since the
+caller re-reads them right after their own writes.
+
+Every endpoint requires a token, so shared responses vary on Authorization:
+no user is served a response without a valid token.
+CACHE_SHARE_ACROSS_USERS=true drops the Vary for gateways that authenticate
+before their cache.
+
+Configuration (environment):
+    CACHE_S_MAXAGE                 seconds a shared cache may serve a response, 0 = no caching (default 30)
+    CACHE_STALE_WHILE_REVALIDATE   seconds a stale response may be served while refetching (default 30)
+    CACHE_SHARE_ACROSS_USERS       true to let one user's cached response serve another (default false)
+    SURROGATE_KEY_HEADER           header carrying the keys (default Surrogate-Key)
+    CACHE_PURGE_URL                endpoint receiving purge requests; unset disables shared caching (default: none)
+    CACHE_PURGE_METHOD             HTTP method of purge requests (default POST)
+    CACHE_PURGE_TOKEN              sent as Fastly-Key / Authorization: Bearer, if set
+    CACHE_PURGE_BATCH_WINDOW       seconds to collect keys into one purge request (default 0.05)
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+from common import lifecycle
+
+logger = logging.getLogger(__name__)
+
+CACHE_S_MAXAGE = int(os.environ.get("CACHE_S_MAXAGE", "30"))
+CACHE_STALE_WHILE_REVALIDATE = int(os.environ.get("CACHE_STALE_WHILE_REVALIDATE", "30"))
+CACHE_SHARE_ACROSS_USERS = os.environ.get("CACHE_SHARE_ACROSS_USERS", "false").lower() == "true"
+SURROGATE_KEY_HEADER = os.environ.get("SURROGATE_KEY_HEADER", "Surrogate-Key")
+CACHE_PURGE_URL = os.environ.get("CACHE_PURGE_URL", "")
+CACHE_PURGE_METHOD = os.environ.get("CACHE_PURGE_METHOD", "POST").upper()
+CACHE_PURGE_TOKEN = os.environ.get("CACHE_PURGE_TOKEN", "")
+CACHE_PURGE_BATCH_WINDOW = float(os.environ.get("CACHE_PURGE_BATCH_WINDOW", "0.05"))
+CACHE_PURGE_TIMEOUT = 5
+# Fastly limits a batch purge to 256 keys
+CACHE_PURGE_MAX_KEYS = 256
+
+FEED_KEY = "feed"
+FEED_CARDS_KEY = "feed-cards"
+NO_STORE = "no-store"
+PRIVATE = "private, no-cache"
+
+
+def post_key(post_id):
+    return f"post-{post_id}"
+
+
+def likes_key(post_id):
+    return f"post-{post_id}-likes"
+
+
+def comments_key(post_id):
+    return f"post-{post_id}-comments"
+
+
+def user_key(user_id):
+    return f"user-{user_id}"
+
+
+def preferences_key(user_id):
+    return f"user-{user_id}-preferences"
+
+
+def cacheable(*keys, per_user=False):
+    """Headers for a cacheable response tagged with keys; per_user if it depends on the caller."""
+    if CACHE_S_MAXAGE <= 0 or not CACHE_PURGE_URL or per_user:
+        return {"Cache-Control": PRIVATE}
+    headers = {
+        "Cache-Control": f"public, max-age=0, s-maxage={CACHE_S_MAXAGE}"
+                         + (f", stale-while-revalidate={CACHE_STALE_WHILE_REVALIDATE}"
+                            if CACHE_STALE_WHILE_REVALIDATE else ""),
+        SURROGATE_KEY_HEADER: " ".join(str(key) for key in keys),
+    }
+    if not CACHE_SHARE_ACROSS_USERS:
+        headers["Vary"] = "Authorization"
+    return headers
+
+
+def apply_default(headers):
+    """Responses not marked cacheable (errors, writes) must not be stored by the gateway."""
+    if "Cache-Control" not in headers:
+        headers["Cache-Control"] = NO_STORE
+    return headers
+
+
+def init_app(app):
+    """Mark every response of a Flask app that did not opt in with cacheable() as no-store."""
+    @app.after_request
+    def _default_cache_control(response):
+        apply_default(response.headers)
+        return response
+
+    return app
+
+
+_hooks = []
+
+
+def on_purge(fn):
+    """Register fn(keys) to be called on every purge, e.g. to drop an in-process cache."""
+    _hooks.append(fn)
+    return fn
+
+
+def purge(*keys):
+    """Invalidate everything tagged with keys; returns at once."""
+    keys = [str(key) for key in keys if key is not None]
+    if not keys:
+        return
+    logger.debug("Purging %s", " ".join(keys))
+    for fn in _hooks:
+        try:
+            fn(keys)
+        except Exception:
+            logger.exception("Error in purge hook %s", getattr(fn, '__name__', fn))
+    if CACHE_PURGE_URL:
+        _purger.submit(keys)
+
+
+class _Purger:
+    """Sends surrogate keys to CACHE_PURGE_URL from a background thread, batched and de-duplicated."""
+
+    def __init__(self, url):
+        self.url = url
+        self.queue = queue.Queue()
+        self.sent = 0
+        self.failed = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Per process: gunicorn workers fork after import
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name="cache-purge", daemon=True).start()
+                self._pid = os.getpid()
+                lifecycle.on_shutdown(self.stop)
+
+    def submit(self, keys):
+        self._ensure_started()
+        self.queue.put(keys)
+
+    def stop(self):
+        self.queue.put(None)
+
+    def _run(self):
+        while True:
+            keys = self.queue.get()
+            if keys is None:
+                return
+            batch = dict.fromkeys(keys)
+            deadline = time.monotonic() + CACHE_PURGE_BATCH_WINDOW
+            stopping = False
+            while len(batch) < CACHE_PURGE_MAX_KEYS:
+                try:
+                    more = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if more is None:
+                    stopping = True
+                    break
+                batch.update(dict.fromkeys(more))
+            keys = list(batch)
+            for start in range(0, len(keys), CACHE_PURGE_MAX_KEYS):
+                self._send(keys[start:start + CACHE_PURGE_MAX_KEYS])
+            if stopping:
+                return
+
+    def _send(self, keys):
+        headers = {SURROGATE_KEY_HEADER: " ".join(keys)}
+        if CACHE_PURGE_TOKEN:
+            headers["Fastly-Key"] = CACHE_PURGE_TOKEN
+            headers["Authorization"] = f"Bearer {CACHE_PURGE_TOKEN}"
+        request = urllib.request.Request(self.url, method=CACHE_PURGE_METHOD, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=CACHE_PURGE_TIMEOUT):
+                pass
+            self.sent += len(keys)
+        except Exception as e:
+            # The entries still expire after CACHE_S_MAXAGE
+            self.failed += len(keys)
+            logger.warning("Could not purge %d cache keys: %s", len(keys), e)
+
+
+_purger = _Purger(CACHE_PURGE_URL)
@@ -0,0 +1,153 @@
+"""
+Supabase client factory and per-request query accounting shared by the services.
+
+SUPABASE_URL=memory://[<seed.json>] selects the in-memory stand-in in
+memory_db.py (load tests, local runs without the hosted project); any other
+URL gets the real supabase client. create_async_client() is the asyncio
+counterpart for the aiohttp services: the PostgREST async client (the same
+builder, with awaitable execute()) or the in-memory one.
+
+init_app(app) counts the Supabase queries each request makes and the time spent
+in them (recorded by the traced client, see tracing.trace_supabase) and logs a
+warning when an endpoint goes over its budget, or runs the same query shape
+DB_REPEAT_THRESHOLD times -- the usual sign of a query per item in a loop:
+
+    DB_QUERY_BUDGET      queries per request before warning (default 5)
+    DB_TIME_BUDGET_MS    DB time per request before warning, 0 = off (default 0)
+    DB_BUDGETS           per-endpoint overrides, "<METHOD> <route>=<queries>[:<ms>]",
+                         e.g. "POST /api/social/like=2,DELETE /api/posts=1:100"
+    DB_REPEAT_THRESHOLD  same-shape queries per request before warning (default 5)
+    DB_STATS_HEADERS     true to add X-DB-Queries and Server-Timing to responses
+                         (development and staging; off by default)
+"""
+
+import contextvars
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def parse_budgets(spec):
+    budgets = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        endpoint, _, budget = item.rpartition("=")
+        queries, _, ms = budget.partition(":")
+        budgets[endpoint.strip()] = (int(queries), float(ms) if ms else None)
+    return budgets
+
+
+DB_QUERY_BUDGET = int(os.environ.get("DB_QUERY_BUDGET", "5"))
+DB_TIME_BUDGET_MS = float(os.environ.get("DB_TIME_BUDGET_MS", "0")) or None
+DB_BUDGETS = parse_budgets(os.environ.get("DB_BUDGETS", ""))
+DB_REPEAT_THRESHOLD = int(os.environ.get("DB_REPEAT_THRESHOLD", "5"))
+DB_STATS_HEADERS = os.environ.get("DB_STATS_HEADERS", "false").lower() == "true"
+
+_stats = contextvars.ContextVar("db_stats", default=None)
+
+
+def create_client(url, key):
+    if url and url.startswith("memory://"):
+        from common import memory_db
+        return memory_db.from_url(url)
+
+    from supabase import create_client as create_supabase_client
+    return create_supabase_client(url, key)
+
+
+def create_async_client(url, key):
+    if url and url.startswith("memory://"):
+        from common import memory_db
+        return memory_db.async_from_url(url)
+
+    # supabase-py's table() is PostgREST under /rest/v1 with the key in both headers
+    from postgrest import AsyncPostgrestClient
+    return AsyncPostgrestClient(f"{url}/rest/v1", headers={"apikey": key, "Authorization": f"Bearer {key}"})
+
+
+class QueryStats:
+    __slots__ = ("queries", "total_ms", "shapes")
+
+    def __init__(self):
+        self.queries = 0
+        self.total_ms = 0.0
+        self.shapes = {}
+
+    def add(self, shape, duration_ms):
+        self.queries += 1
+        self.total_ms += duration_ms
+        self.shapes[shape] = self.shapes.get(shape, 0) + 1
+
+
+def record_query(shape, duration_ms):
+    """Count one query against the current request; no-op outside a request (background workers)."""
+    stats = _stats.get()
+    if stats is not None:
+        stats.add(shape, duration_ms)
+
+
+def request_stats():
+    return _stats.get()
+
+
+def start_request():
+    """Start counting queries for a request; pass the token to end_request()."""
+    return _stats.set(QueryStats())
+
+
+def end_request(token):
+    _stats.reset(token)
+
+
+def check_budget(endpoint):
+    """Warn if the current request went over its budget; returns headers to add (DB_STATS_HEADERS)."""
+    from common import tracing
+
+    stats = _stats.get()
+    if stats is None:
+        return []
+    query_budget, time_budget = DB_BUDGETS.get(endpoint, (DB_QUERY_BUDGET, DB_TIME_BUDGET_MS))
+    usage = {"endpoint": endpoint, "db_queries": stats.queries, "db_ms": round(stats.total_ms, 1)}
+
+    if stats.queries > query_budget or (time_budget and stats.total_ms > time_budget):
+        logger.warning(
+            "%s made %d queries in %.1f ms (budget %d queries%s)", endpoint, stats.queries, stats.total_ms,
+            query_budget, f", {time_budget:g} ms" if time_budget else "", extra=usage
+        )
+    for shape, count in stats.shapes.items():
+        if count >= DB_REPEAT_THRESHOLD:
+            logger.warning("%s ran %s %d times in one request", endpoint, shape, count,
+                           extra=dict(usage, shape=shape))
+
+    span = tracing.current_span()
+    if span is not None:
+        span.set(db_queries=stats.queries, db_ms=round(stats.total_ms, 1))
+    if not DB_STATS_HEADERS:
+        return []
+    return [
+        ("X-DB-Queries", str(stats.queries)),
+        ("Server-Timing", f'db;dur={stats.total_ms:.1f};desc="queries: {stats.queries}"'),
+    ]
+
+
+def init_app(app):
+    from flask import request, g
+
+    @app.before_request
+    def _start_query_stats():
+        g._db_stats = start_request()
+
+    @app.after_request
+    def _check_query_stats(response):
+        endpoint = f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+        for name, value in check_budget(endpoint):
+            response.headers.add(name, value)
+        return response
+
+    @app.teardown_request
+    def _reset_query_stats(error=None):
+        token = g.pop("_db_stats", None)
+        if token is not None:
+            end_request(token)
+
+    return app
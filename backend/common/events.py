@@ -0,0 +1,167 @@
+"""
+Domain events (post created/deleted, like added/removed, comment added),
+published to a topic exchange for consumers that keep read models, such as
+the feed projector (feed/projector.py):
+
+    events.publish("post_created", {"post_id": 12, "user_id": 3})
+
+The routing key is the event type; the body is the JSON object
+{"event_type", "data", "event_id", "occurred_at"}. Unlike the notifications
+queue, which the listener drains, every consumer binds a queue of its own.
+
+publish() returns at once: a background thread per process sends the events
+over one connection, reconnecting when the broker goes away. Events waiting
+beyond DOMAIN_EVENTS_MAX_QUEUE are dropped (and counted); consumers must be
+able to recover from a missed event, e.g. by rebuilding. Events are published
+after the write they describe, so a consumer may read the current state back
+from the database.
+
+Configuration (environment):
+    AMQP_URL                  broker; without it events are discarded
+    DOMAIN_EVENTS_EXCHANGE    topic exchange name (default domain_events)
+    DOMAIN_EVENTS_MAX_QUEUE   events held while the broker is unreachable (default 10000)
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+import pika
+from common import lifecycle, tracing
+
+logger = logging.getLogger(__name__)
+
+AMQP_URL = os.environ.get("AMQP_URL")
+DOMAIN_EVENTS_EXCHANGE = os.environ.get("DOMAIN_EVENTS_EXCHANGE", "domain_events")
+DOMAIN_EVENTS_MAX_QUEUE = int(os.environ.get("DOMAIN_EVENTS_MAX_QUEUE", "10000"))
+RECONNECT_INTERVAL = 5
+STOP_TIMEOUT = 5
+# How often an idle publisher answers broker heartbeats
+IDLE_POLL_INTERVAL = 10
+
+
+def declare_exchange(channel):
+    channel.exchange_declare(exchange=DOMAIN_EVENTS_EXCHANGE, exchange_type="topic", durable=True)
+
+
+def message(event_type, data):
+    return {
+        "event_type": event_type,
+        "data": data,
+        "event_id": uuid.uuid4().hex,
+        "occurred_at": datetime.now().isoformat(),
+    }
+
+
+class _Publisher:
+    def __init__(self, amqp_url):
+        self.amqp_url = amqp_url
+        self.queue = queue.Queue(maxsize=DOMAIN_EVENTS_MAX_QUEUE)
+        self.sent = 0
+        self.dropped = 0
+        self._connection = None
+        self._channel = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Per process: gunicorn workers fork after import
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._thread = threading.Thread(target=self._run, name="domain-events", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+                lifecycle.on_shutdown(self.stop)
+
+    def submit(self, body, headers):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait((body, headers))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Dropped domain event; %d waiting for the broker", self.queue.qsize())
+
+    def stop(self):
+        # Send what is queued, but do not hold up shutdown on an unreachable broker
+        try:
+            self.queue.put(None, timeout=STOP_TIMEOUT)
+        except queue.Full:
+            return
+        if self._thread is not None:
+            self._thread.join(STOP_TIMEOUT)
+
+    def _connect(self):
+        self._connection = pika.BlockingConnection(pika.URLParameters(self.amqp_url))
+        self._channel = self._connection.channel()
+        declare_exchange(self._channel)
+
+    def _close(self):
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except Exception:
+            pass
+        self._connection = self._channel = None
+
+    def _send(self, item):
+        body, headers = item
+        attempt = 0
+        while True:
+            try:
+                if self._channel is None:
+                    self._connect()
+                self._channel.basic_publish(
+                    exchange=DOMAIN_EVENTS_EXCHANGE,
+                    routing_key=body["event_type"],
+                    body=json.dumps(body),
+                    properties=pika.BasicProperties(delivery_mode=2, content_type="application/json",
+                                                    headers=headers)
+                )
+                self.sent += 1
+                return
+            except Exception as e:
+                self._close()
+                attempt += 1
+                if attempt > 1:
+                    logger.warning("Could not publish %s event: %r; retrying in %ss",
+                                   body["event_type"], e, RECONNECT_INTERVAL)
+                    time.sleep(RECONNECT_INTERVAL)
+
+    def _keepalive(self):
+        if self._connection is None:
+            return
+        try:
+            self._connection.process_data_events(time_limit=0)
+        except Exception as e:
+            logger.info("Domain events connection lost while idle: %s", e)
+            self._close()
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=IDLE_POLL_INTERVAL)
+            except queue.Empty:
+                self._keepalive()
+                continue
+            if item is None:
+                self._close()
+                return
+            self._send(item)
+
+
+_publisher = _Publisher(AMQP_URL)
+
+
+def publish(event_type, data):
+    """Queue one domain event for the exchange; never blocks or raises."""
+    if not AMQP_URL:
+        logger.debug("No AMQP_URL; discarding %s event", event_type)
+        return
+    _publisher.submit(message(event_type, data), tracing.inject({}, amqp=True))
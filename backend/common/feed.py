@@ -0,0 +1,160 @@
+"""
+Denormalized feed read model: one row per post with everything a feed card
+shows, so the feed is served by a single indexed query instead of a post
+query plus likes and comments queries per card.
+
+The feed projector (feed/projector.py) keeps the table current from domain
+events (common/events.py), and the post service serves it at
+GET /api/posts/feed. Rows are never patched from event payloads: project()
+re-reads the affected posts with their likes, comments and author from the
+source tables and overwrites their rows. Replayed, duplicated or reordered
+events therefore converge on the same rows, and rebuild() is project() over
+every post.
+
+Table (Supabase SQL editor):
+
+    create table feed_items (
+        post_id       bigint primary key,
+        user_id       bigint,
+        username      text,
+        title         text,
+        content       text,
+        image_url     text,
+        location      text,
+        preferences   text,
+        created_at    timestamptz,
+        like_count    integer not null default 0,
+        comment_count integer not null default 0,
+        liked_by      jsonb not null default '[]',
+        projected_at  timestamptz
+    );
+    create index feed_items_created_at on feed_items (created_at desc);
+"""
+
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+FEED_TABLE = "feed_items"
+POSTS_TABLE = "post"
+USER_TABLE = "user"
+# PostgREST returns at most this many rows per request (Supabase's default max-rows)
+SOURCE_PAGE_SIZE = 1000
+
+
+def card(row, user_id):
+    """A feed_items row as the feed returns it to user_id."""
+    return {
+        'id': row['post_id'],
+        'title': row['title'],
+        'content': row['content'],
+        'image_url': row['image_url'],
+        'created_at': row['created_at'],
+        'user_id': row['user_id'],
+        'username': row['username'],
+        'preference': [tag.strip() for tag in (row.get('preferences') or '').split(',') if tag],
+        'location': row['location'],
+        'total_likes': row['like_count'],
+        'total_comments': row['comment_count'],
+        'has_liked': str(user_id) in {str(liker) for liker in row.get('liked_by') or []},
+    }
+
+
+def _all_rows(query):
+    """Every row of query(), fetched in pages; query must return a fresh, ordered builder."""
+    rows = []
+    while True:
+        page = query().range(len(rows), len(rows) + SOURCE_PAGE_SIZE - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < SOURCE_PAGE_SIZE:
+            return rows
+
+
+def project(supabase, post_ids):
+    """
+    Rebuild the feed rows of post_ids from the source tables: upsert the posts
+    that exist, delete the rows of those that do not. Returns (upserted, deleted).
+    """
+    post_ids = sorted({str(post_id) for post_id in post_ids})
+    if not post_ids:
+        return 0, 0
+
+    posts = supabase.table(POSTS_TABLE).select("*").in_("id", post_ids).execute().data or []
+    found = [post['id'] for post in posts]
+
+    likers = {}
+    comment_counts = {}
+    authors = {}
+    if posts:
+        for like in _all_rows(lambda: supabase.table("likes")
+                              .select("post_id, liked_by_user_id")
+                              .in_("post_id", found)
+                              .order("post_id").order("liked_by_user_id")):
+            likers.setdefault(str(like['post_id']), []).append(like['liked_by_user_id'])
+        for comment in _all_rows(lambda: supabase.table("comments")
+                                 .select("id, post_id")
+                                 .in_("post_id", found)
+                                 .order("id")):
+            key = str(comment['post_id'])
+            comment_counts[key] = comment_counts.get(key, 0) + 1
+        users = supabase.table(USER_TABLE) \
+            .select("userId, username") \
+            .in_("userId", list({post['user_id'] for post in posts})) \
+            .execute().data or []
+        authors = {str(user['userId']): user['username'] for user in users}
+
+    now = datetime.now().isoformat()
+    rows = [{
+        'post_id': post['id'],
+        'user_id': post['user_id'],
+        # The post keeps the username it was created with; the user table is current
+        'username': authors.get(str(post['user_id']), post.get('username')),
+        'title': post.get('title'),
+        'content': post.get('content'),
+        'image_url': post.get('image_url'),
+        'location': post.get('location'),
+        'preferences': post.get('preferences'),
+        'created_at': post.get('created_at'),
+        'like_count': len(likers.get(str(post['id']), [])),
+        'comment_count': comment_counts.get(str(post['id']), 0),
+        'liked_by': likers.get(str(post['id']), []),
+        'projected_at': now,
+    } for post in posts]
+    if rows:
+        supabase.table(FEED_TABLE).upsert(rows, on_conflict="post_id").execute()
+
+    missing = sorted(set(post_ids) - {str(post_id) for post_id in found})
+    if missing:
+        supabase.table(FEED_TABLE).delete().in_("post_id", missing).execute()
+    return len(rows), len(missing)
+
+
+def rebuild(supabase, batch_size=200):
+    """Project every post, then drop rows whose post no longer exists. Returns (upserted, deleted)."""
+    upserted = deleted = 0
+    seen = set()
+    start = 0
+    while True:
+        page = supabase.table(POSTS_TABLE).select("id").order("id") \
+            .range(start, start + batch_size - 1).execute().data or []
+        if not page:
+            break
+        ids = [post['id'] for post in page]
+        seen.update(str(post_id) for post_id in ids)
+        counts = project(supabase, ids)
+        upserted += counts[0]
+        deleted += counts[1]
+        start += len(page)
+        logger.info("Rebuilt feed rows for %d posts", start)
+
+    # Rows of deleted posts; project() checks each again, so a post created
+    # since the scan above keeps its row
+    stale = [row['post_id'] for row in _all_rows(lambda: supabase.table(FEED_TABLE)
+                                                 .select("post_id").order("post_id"))
+             if str(row['post_id']) not in seen]
+    for i in range(0, len(stale), batch_size):
+        counts = project(supabase, stale[i:i + batch_size])
+        upserted += counts[0]
+        deleted += counts[1]
+    return upserted, deleted
@@ -0,0 +1,73 @@
+"""
+Shared gunicorn settings for the Flask services:
+
+    gunicorn -c common/gunicorn_conf.py post:app
+
+Configuration (environment):
+    PORT                    port to bind on 0.0.0.0 (default 8000)
+    WEB_WORKER_CLASS        gthread (default) or gevent; aiohttp.GunicornWebWorker for the
+                            asyncio variants (async_post:app, async_social:app)
+    WEB_WORKERS             worker processes (default: number of CPUs)
+    WEB_THREADS             threads per gthread worker (default 8)
+    WEB_WORKER_CONNECTIONS  concurrent requests per gevent worker (default 1000)
+    WEB_TIMEOUT             seconds a worker may be silent before it is restarted (default 60)
+    WEB_GRACEFUL_TIMEOUT    seconds to finish in-flight requests after SIGTERM (default 30)
+    WEB_KEEPALIVE           seconds to hold idle keep-alive connections (default 5)
+    WEB_MAX_REQUESTS        recycle a worker after this many requests, 0 = never (default 0)
+    WEB_ACCESS_LOG          gunicorn access log destination, e.g. - for stdout (default off)
+
+With gevent, gunicorn monkey-patches the worker before the app is imported, so
+the blocking Supabase (httpx), pika and requests calls yield to other requests
+instead of holding a thread.
+
+The aiohttp worker runs its own event loop and signal handling; the services
+hook lifecycle into the app's shutdown signals instead (common/aio.py).
+"""
+
+import multiprocessing
+import os
+import signal
+import threading
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = os.environ.get("WEB_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("WEB_WORKERS", str(multiprocessing.cpu_count())))
+threads = int(os.environ.get("WEB_THREADS", "8"))
+worker_connections = int(os.environ.get("WEB_WORKER_CONNECTIONS", "1000"))
+timeout = int(os.environ.get("WEB_TIMEOUT", "60"))
+graceful_timeout = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.environ.get("WEB_KEEPALIVE", "5"))
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+# The services log each request themselves (common/log.py)
+accesslog = os.environ.get("WEB_ACCESS_LOG") or None
+errorlog = "-"
+
+
+def post_worker_init(worker):
+    from common import lifecycle
+
+    if worker_class.startswith("aiohttp"):
+        return
+
+    handle_exit = worker.handle_exit
+
+    def on_sigterm(sig, frame):
+        # Let long-lived responses (SSE) finish so the worker can stop within graceful_timeout.
+        # Run outside the signal handler: under gevent it executes in the event loop, which cannot block
+        if worker_class == "gevent":
+            import gevent
+            gevent.spawn(lifecycle.drain)
+        else:
+            threading.Thread(target=lifecycle.drain, name="drain", daemon=True).start()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    # signal.signal() re-enables EINTR; keep SIGTERM from interrupting in-flight requests
+    signal.siginterrupt(signal.SIGTERM, False)
+
+
+def worker_exit(server, worker):
+    from common import lifecycle
+    lifecycle.shutdown()
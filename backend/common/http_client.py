@@ -0,0 +1,111 @@
+"""
+Pooled HTTP client for service-to-service calls.
+
+One requests.Session per process, with a keep-alive connection pool per
+downstream host, connect/read timeouts on every call, and bounded retries with
+backoff for idempotent methods (GET, HEAD, OPTIONS, PUT, DELETE). POST is only
+retried when it carries an Idempotency-Key header (see common/idempotency.py)
+and its body can be re-sent, since otherwise the downstream may already have
+acted on it.
+
+Each call is recorded as a tracing span and carries the current request's
+X-Request-ID, so the downstream service joins the same trace.
+
+Configuration (environment):
+    HTTP_CONNECT_TIMEOUT   seconds to establish a connection (default 3)
+    HTTP_READ_TIMEOUT      seconds to wait for response data (default 30)
+    HTTP_POOL_HOSTS        number of per-host pools kept (default 10)
+    HTTP_POOL_MAXSIZE      keep-alive connections per host (default 20)
+    HTTP_MAX_RETRIES       retries for idempotent requests (default 2)
+    HTTP_RETRY_BACKOFF     backoff factor between retries (default 0.2)
+"""
+
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from common import tracing
+
+DEFAULT_TIMEOUT = (
+    float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3")),
+    float(os.environ.get("HTTP_READ_TIMEOUT", "30"))
+)
+POOL_HOSTS = int(os.environ.get("HTTP_POOL_HOSTS", "10"))
+POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "20"))
+MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "2"))
+RETRY_BACKOFF = float(os.environ.get("HTTP_RETRY_BACKOFF", "0.2"))
+
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+RETRY_STATUSES = (502, 503, 504)
+
+
+def create_session(pool_hosts=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE, max_retries=MAX_RETRIES,
+                   retry_backoff=RETRY_BACKOFF, retry_methods=IDEMPOTENT_METHODS):
+    """A new pooled session; most callers should use the shared one via request()."""
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=retry_backoff,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=retry_methods,
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_maxsize, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_sessions = {}
+_session_lock = threading.Lock()
+
+
+def get_session(retry_post=False):
+    session = _sessions.get(retry_post)
+    if session is None:
+        with _session_lock:
+            session = _sessions.get(retry_post)
+            if session is None:
+                methods = IDEMPOTENT_METHODS | {"POST"} if retry_post else IDEMPOTENT_METHODS
+                session = _sessions[retry_post] = create_session(retry_methods=methods)
+    return session
+
+
+def _can_retry_post(method, kwargs):
+    headers = kwargs.get("headers") or {}
+    if method.upper() != "POST" or not any(h.lower() == IDEMPOTENCY_HEADER.lower() for h in headers):
+        return False
+    # A generator or file body is consumed by the first attempt
+    data = kwargs.get("data")
+    return not (hasattr(data, "__next__") or hasattr(data, "read"))
+
+
+def request(method, url, **kwargs):
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    session = get_session(_can_retry_post(method, kwargs))
+    with tracing.span(f"http {method.upper()} {tracing.display_url(url)}") as s:
+        kwargs["headers"] = tracing.inject(dict(kwargs.get("headers") or {}))
+        response = session.request(method, url, **kwargs)
+        s.set(status_code=response.status_code)
+        return response
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request("PUT", url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request("DELETE", url, **kwargs)
@@ -0,0 +1,389 @@
+"""
+Idempotency-Key support for non-idempotent write endpoints.
+
+A client (or the pooled HTTP client) that retries a POST sends the same
+Idempotency-Key header each time. The first request runs the view and its
+response is stored; later requests with the same key get that response replayed
+(with Idempotent-Replayed: true) instead of writing again.
+
+Keys are scoped to the endpoint and the caller's Authorization header and kept
+for IDEMPOTENCY_TTL seconds. Server errors (5xx) are not stored, so those can be
+retried.
+
+    POST with a key already in progress  -> waits up to IDEMPOTENCY_WAIT, then 409
+    same key, different request body     -> 422
+
+A retry can reach another gunicorn worker, another replica, or a restarted
+process, so services that write keep their keys in the database
+(DatabaseIdempotencyStore, table idempotency_keys below): a key is claimed by
+inserting its row, which only one request can do. IdempotencyStore keeps keys
+in process memory (at most IDEMPOTENCY_MAX_KEYS, oldest evicted first); it only
+deduplicates retries that reach the same process, and suits a front service
+such as create-post, which forwards the key to the post service that writes.
+create_store() picks one from IDEMPOTENCY_BACKEND.
+
+    create table idempotency_keys (
+        scope        text primary key,
+        claim        text not null,
+        fingerprint  text not null,
+        started_at   double precision not null,
+        stored_at    double precision,
+        status       integer,
+        body         text,
+        content_type text
+    );
+    create index idempotency_keys_started_at on idempotency_keys (started_at);
+
+idempotent() decorates Flask views, idempotent_async() aiohttp handlers.
+
+Configuration (environment):
+    IDEMPOTENCY_BACKEND        database (default) or memory
+    IDEMPOTENCY_TTL            seconds a stored response is replayed (default 86400)
+    IDEMPOTENCY_MAX_KEYS       keys per process, memory backend (default 10000)
+    IDEMPOTENCY_WAIT           seconds a retry waits for the first request (default 10)
+    IDEMPOTENCY_LOCK_TIMEOUT   seconds after which an unfinished key is abandoned (default 60)
+"""
+
+import asyncio
+import base64
+import functools
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask import request, jsonify, make_response
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_BACKEND = os.environ.get("IDEMPOTENCY_BACKEND", "database").lower()
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", "10000"))
+IDEMPOTENCY_WAIT = float(os.environ.get("IDEMPOTENCY_WAIT", "10"))
+# An in-progress key older than this is treated as abandoned (e.g. the worker died)
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.environ.get("IDEMPOTENCY_LOCK_TIMEOUT", "60"))
+MAX_KEY_LENGTH = 255
+# How often an aiohttp handler re-checks a key that is in progress
+IDEMPOTENCY_POLL_INTERVAL = 0.05
+# How often a request re-reads a key another process is working on
+IDEMPOTENCY_DB_POLL_INTERVAL = 0.2
+IDEMPOTENCY_TABLE = "idempotency_keys"
+# Expired rows are deleted by one in this many claims
+IDEMPOTENCY_CLEANUP_EVERY = 500
+
+
+class IdempotencyStore:
+    """Bounded, expiring in-memory map of scope -> in-progress marker or stored response."""
+
+    def __init__(self, max_entries=IDEMPOTENCY_MAX_KEYS, ttl=IDEMPOTENCY_TTL,
+                 lock_timeout=IDEMPOTENCY_LOCK_TIMEOUT):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self._entries = OrderedDict()
+        self._cond = threading.Condition()
+
+    def _expired(self, entry, now):
+        if entry["response"] is None:
+            return now - entry["started_at"] > self.lock_timeout
+        return now - entry["stored_at"] > self.ttl
+
+    def _evict(self, now):
+        while self._entries:
+            scope, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and not self._expired(entry, now):
+                break
+            del self._entries[scope]
+
+    def begin(self, scope, fingerprint, wait=IDEMPOTENCY_WAIT):
+        """
+        Claim scope for this request. Returns ("new", None), ("replay", response),
+        ("conflict", None) when the key was used for a different request, or
+        ("in_progress", None) if the first request is still running after wait seconds.
+        """
+        deadline = time.monotonic() + wait
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                entry = self._entries.get(scope)
+                if entry is not None and self._expired(entry, now):
+                    del self._entries[scope]
+                    entry = None
+
+                if entry is None:
+                    self._entries[scope] = {
+                        "fingerprint": fingerprint, "started_at": now, "stored_at": None, "response": None
+                    }
+                    self._evict(now)
+                    return "new", None
+                if entry["fingerprint"] != fingerprint:
+                    return "conflict", None
+                if entry["response"] is not None:
+                    return "replay", entry["response"]
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    return "in_progress", None
+                self._cond.wait(remaining)
+
+    def complete(self, scope, response):
+        with self._cond:
+            entry = self._entries.get(scope)
+            if entry is not None:
+                entry["response"] = response
+                entry["stored_at"] = time.monotonic()
+                self._entries.move_to_end(scope)
+            self._cond.notify_all()
+
+    def release(self, scope):
+        """Forget an in-progress key so the request can be retried."""
+        with self._cond:
+            entry = self._entries.get(scope)
+            if entry is not None and entry["response"] is None:
+                del self._entries[scope]
+            self._cond.notify_all()
+
+
+class DatabaseIdempotencyStore:
+    """
+    The same protocol as IdempotencyStore over the idempotency_keys table, so
+    every worker and replica sees the same keys. supabase is a sync client.
+    """
+
+    def __init__(self, supabase, ttl=IDEMPOTENCY_TTL, lock_timeout=IDEMPOTENCY_LOCK_TIMEOUT,
+                 poll_interval=IDEMPOTENCY_DB_POLL_INTERVAL):
+        self.supabase = supabase
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        # scope -> claim of the requests this process is running
+        self._claims = {}
+        self._claimed = 0
+
+    def _expired(self, row, now):
+        if row.get("status") is None:
+            return now - row["started_at"] > self.lock_timeout
+        return now - row["stored_at"] > self.ttl
+
+    def _claim(self, scope, fingerprint):
+        claim = uuid.uuid4().hex
+        # Inserts only if no request holds the key; the primary key decides between racing requests
+        result = self.supabase.table(IDEMPOTENCY_TABLE).upsert({
+            "scope": scope, "claim": claim, "fingerprint": fingerprint, "started_at": time.time()
+        }, on_conflict="scope", ignore_duplicates=True).execute()
+        if not result.data:
+            return False
+        self._claims[scope] = claim
+        self._claimed += 1
+        if self._claimed % IDEMPOTENCY_CLEANUP_EVERY == 0:
+            self._delete_expired()
+        return True
+
+    def _delete_expired(self):
+        now = time.time()
+        try:
+            self.supabase.table(IDEMPOTENCY_TABLE).delete().lt("stored_at", now - self.ttl).execute()
+            self.supabase.table(IDEMPOTENCY_TABLE).delete().is_("status", "null") \
+                .lt("started_at", now - self.lock_timeout).execute()
+        except Exception:
+            logger.exception("Could not delete expired idempotency keys")
+
+    def begin(self, scope, fingerprint, wait=IDEMPOTENCY_WAIT):
+        deadline = time.monotonic() + wait
+        while True:
+            if self._claim(scope, fingerprint):
+                return "new", None
+            rows = self.supabase.table(IDEMPOTENCY_TABLE).select("*").eq("scope", scope).execute().data
+            if not rows:
+                # Released or deleted since the claim failed
+                continue
+            row = rows[0]
+            if self._expired(row, time.time()):
+                # Only the row that was read: another request may already have replaced it
+                self.supabase.table(IDEMPOTENCY_TABLE).delete() \
+                    .eq("scope", scope).eq("claim", row["claim"]).execute()
+                continue
+            if row["fingerprint"] != fingerprint:
+                return "conflict", None
+            if row.get("status") is not None:
+                return "replay", {
+                    "status": row["status"],
+                    "body": base64.b64decode(row.get("body") or ""),
+                    "content_type": row.get("content_type"),
+                }
+            if time.monotonic() >= deadline:
+                return "in_progress", None
+            time.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+
+    def complete(self, scope, response):
+        claim = self._claims.pop(scope, None)
+        if claim is None:
+            return
+        try:
+            self.supabase.table(IDEMPOTENCY_TABLE).update({
+                "status": response["status"],
+                "body": base64.b64encode(response["body"]).decode("ascii"),
+                "content_type": response["content_type"],
+                "stored_at": time.time(),
+            }).eq("scope", scope).eq("claim", claim).execute()
+        except Exception:
+            # The write went through; a retry will wait out the lock and run again
+            logger.exception("Could not store the response for an idempotency key")
+
+    def release(self, scope):
+        claim = self._claims.pop(scope, None)
+        if claim is None:
+            return
+        try:
+            self.supabase.table(IDEMPOTENCY_TABLE).delete().eq("scope", scope).eq("claim", claim).execute()
+        except Exception:
+            logger.exception("Could not release an idempotency key")
+
+
+def create_store(supabase=None):
+    """The store IDEMPOTENCY_BACKEND selects; the database one needs a sync supabase client."""
+    if IDEMPOTENCY_BACKEND == "memory" or supabase is None:
+        return IdempotencyStore()
+    return DatabaseIdempotencyStore(supabase)
+
+
+FORM_MIMETYPES = ("multipart/form-data", "application/x-www-form-urlencoded")
+
+
+def request_scope(method, path, authorization, key):
+    return hashlib.sha256("\n".join([method, path, authorization or '', key]).encode("utf-8")).hexdigest()
+
+
+def form_fingerprint(fields, files):
+    """fields: (name, value) pairs; files: (name, filename) pairs."""
+    digest = hashlib.sha256()
+    for name, value in sorted(fields):
+        digest.update(f"{name}={value}\n".encode("utf-8"))
+    for name, filename in sorted(files, key=lambda item: item[0]):
+        digest.update(f"{name}@{filename}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def request_fingerprint():
+    if request.mimetype in FORM_MIMETYPES:
+        # Compare fields and file names without reading the (spooled) uploads
+        return form_fingerprint(
+            request.form.items(multi=True),
+            [(name, file.filename) for name, file in request.files.items(multi=True)]
+        )
+    return hashlib.sha256(request.get_data(cache=True)).hexdigest()
+
+
+def idempotent(store):
+    """Decorate a Flask view so retries carrying the same Idempotency-Key are replayed."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({'error': f'{IDEMPOTENCY_HEADER} is too long'}), 400
+
+            scope = request_scope(request.method, request.path, request.headers.get('Authorization'), key)
+
+            state, stored = store.begin(scope, request_fingerprint())
+            if state == "replay":
+                response = make_response(stored["body"], stored["status"])
+                response.headers["Content-Type"] = stored["content_type"]
+                response.headers[REPLAYED_HEADER] = "true"
+                return response
+            if state == "conflict":
+                return jsonify({'error': f'{IDEMPOTENCY_HEADER} was already used for a different request'}), 422
+            if state == "in_progress":
+                return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409
+
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                store.release(scope)
+                raise
+
+            if response.status_code >= 500 or response.is_streamed:
+                store.release(scope)
+            else:
+                store.complete(scope, {
+                    "status": response.status_code,
+                    "body": response.get_data(),
+                    "content_type": response.content_type
+                })
+            return response
+        return wrapper
+    return decorator
+
+
+async def _async_fingerprint(request):
+    if request.content_type in FORM_MIMETYPES:
+        # post() is cached, so the handler reads the same parsed form
+        form = await request.post()
+        fields, files = [], []
+        for name, value in form.items():
+            if isinstance(value, str):
+                fields.append((name, value))
+            else:
+                files.append((name, value.filename))
+        return form_fingerprint(fields, files)
+    return hashlib.sha256(await request.read()).hexdigest()
+
+
+def idempotent_async(store, wait=IDEMPOTENCY_WAIT):
+    """The same for an aiohttp handler; waiting on a key in progress does not block the event loop."""
+    from aiohttp import web
+    from common.aio import json_response
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return await handler(request)
+            if len(key) > MAX_KEY_LENGTH:
+                return json_response({'error': f'{IDEMPOTENCY_HEADER} is too long'}, 400)
+
+            scope = request_scope(request.method, request.path, request.headers.get('Authorization'), key)
+            fingerprint = await _async_fingerprint(request)
+            deadline = asyncio.get_running_loop().time() + wait
+            while True:
+                # The database store blocks on queries
+                state, stored = await asyncio.to_thread(store.begin, scope, fingerprint, 0)
+                if state != "in_progress" or asyncio.get_running_loop().time() >= deadline:
+                    break
+                await asyncio.sleep(getattr(store, "poll_interval", IDEMPOTENCY_POLL_INTERVAL))
+
+            if state == "replay":
+                return web.Response(body=stored["body"], status=stored["status"], headers={
+                    "Content-Type": stored["content_type"], REPLAYED_HEADER: "true"
+                })
+            if state == "conflict":
+                return json_response({'error': f'{IDEMPOTENCY_HEADER} was already used for a different request'}, 422)
+            if state == "in_progress":
+                return json_response({'error': 'A request with this Idempotency-Key is still in progress'}, 409)
+
+            try:
+                response = await handler(request)
+            except BaseException:
+                # Includes cancellation when the client goes away
+                await asyncio.to_thread(store.release, scope)
+                raise
+
+            if response.status >= 500 or response.body is None:
+                await asyncio.to_thread(store.release, scope)
+            else:
+                await asyncio.to_thread(store.complete, scope, {
+                    "status": response.status,
+                    "body": response.body,
+                    "content_type": response.headers.get("Content-Type", response.content_type)
+                })
+            return response
+        return wrapper
+    return decorator
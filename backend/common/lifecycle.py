@@ -0,0 +1,58 @@
+"""
+Shutdown hooks for a service process, run the same way under gunicorn and the
+Flask development server.
+
+on_drain(fn)     -- called as soon as the process is asked to stop (SIGTERM), while
+                    in-flight requests are still being finished; use it to end
+                    long-lived responses such as SSE streams
+on_shutdown(fn)  -- called once when the process exits; use it to flush buffers
+
+gunicorn_conf.py wires drain() to the worker's SIGTERM and shutdown() to
+worker_exit; shutdown() is also registered with atexit for the dev server.
+Each phase runs once, and hooks run in reverse order of registration.
+"""
+
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_drain_hooks = []
+_shutdown_hooks = []
+_done = set()
+_lock = threading.Lock()
+
+
+def on_drain(fn):
+    _drain_hooks.append(fn)
+    return fn
+
+
+def on_shutdown(fn):
+    _shutdown_hooks.append(fn)
+    return fn
+
+
+def _run(phase, hooks):
+    with _lock:
+        if phase in _done:
+            return
+        _done.add(phase)
+    for fn in reversed(hooks):
+        try:
+            fn()
+        except Exception:
+            logger.exception("Error in %s hook %s", phase, getattr(fn, '__name__', fn))
+
+
+def drain():
+    _run("drain", _drain_hooks)
+
+
+def shutdown():
+    drain()
+    _run("shutdown", _shutdown_hooks)
+
+
+atexit.register(shutdown)
@@ -0,0 +1,223 @@
+"""
+Shared logging setup for the services.
+
+setup(service) routes the root logger through a bounded queue: the calling
+thread only captures the record (message, request ID, exception text) and
+enqueues it; formatting, redaction and the write to stdout happen on a
+background thread. When the queue is full records are dropped and counted
+rather than blocking a request. Messages below LOG_LEVEL cost a level check,
+so use %-style arguments (logger.debug("post %s", post_id)), not f-strings.
+
+init_app(app) adds, for Flask services (common/aio.py does the same for aiohttp):
+  - per-endpoint sampling: LOG_SAMPLE_RATES="GET /api/social/likes/<post_id>=0.01,..."
+    keeps that fraction of requests' DEBUG/INFO records (all or none per request);
+    WARNING and above are always kept
+  - one structured "request" record per request with status, duration and, with
+    db.init_app, the Supabase query count and time
+
+Values under keys such as Authorization, password or token, bearer tokens and
+JWTs are replaced with [REDACTED] in messages and extra fields.
+
+Configuration (environment):
+    LOG_LEVEL          DEBUG, INFO (default), WARNING, ERROR
+    LOG_FORMAT         json (default) or text
+    LOG_SAMPLE_RATES   comma-separated "<METHOD> <route>=<rate>" pairs
+    LOG_QUEUE_SIZE     records buffered before dropping (default 10000)
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+from common import db, lifecycle, tracing
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+REDACTED = "[REDACTED]"
+SENSITIVE_KEYS = frozenset([
+    "authorization", "password", "password_hash", "token", "access_token", "refresh_token",
+    "api_key", "apikey", "api_secret", "secret", "cookie", "set-cookie", "jwt_secret", "supabase_key",
+])
+_BEARER = re.compile(r"(?i)(bearer\s+)[A-Za-z0-9._~+/=-]+")
+_JWT = re.compile(r"eyJ[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]*")
+_KEY_VALUE = re.compile(
+    r"(?i)(['\"]?(?:" + "|".join(re.escape(k) for k in SENSITIVE_KEYS) + r")['\"]?\s*[:=]\s*)(['\"]?)[^'\",\s}]+"
+)
+
+# Attributes every LogRecord has; anything else came in through extra=
+_STANDARD_ATTRS = frozenset(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "request_id"}
+
+_sampled = contextvars.ContextVar("log_sampled", default=True)
+_state = {"handler": None, "listener": None}
+
+
+def redact(value):
+    if isinstance(value, str):
+        value = _BEARER.sub(r"\1" + REDACTED, value)
+        value = _JWT.sub(REDACTED, value)
+        return _KEY_VALUE.sub(r"\1\2" + REDACTED, value)
+    if isinstance(value, dict):
+        return {k: REDACTED if str(k).lower() in SENSITIVE_KEYS else redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+
+def parse_sample_rates(spec):
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        endpoint, _, rate = item.rpartition("=")
+        rates[endpoint.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+LOG_SAMPLE_RATES = parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", ""))
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    dropped = 0
+
+    def prepare(self, record):
+        # Only what must be captured on the calling thread; formatting happens on the listener
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.request_id = tracing.current_trace_id()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _QueueHandler.dropped += 1
+
+
+class _SamplingFilter(logging.Filter):
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or _sampled.get()
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "msg": redact(record.getMessage()),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = REDACTED if key.lower() in SENSITIVE_KEYS else redact(value)
+        if record.exc_text:
+            entry["exc"] = redact(record.exc_text)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, service):
+        super().__init__("%(asctime)s %(levelname)s " + service + " %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record):
+        record.request_id = getattr(record, "request_id", None) or "-"
+        return redact(super().format(record))
+
+
+def setup(service, level=LOG_LEVEL):
+    """Configure the root logger for this process; safe to call more than once."""
+    root = logging.getLogger()
+    if _state["handler"] is not None:
+        return root
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter(service) if LOG_FORMAT == "json" else TextFormatter(service))
+
+    handler = _QueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    handler.addFilter(_SamplingFilter())
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    listener.start()
+    # Flush what is still queued when the worker exits
+    lifecycle.on_shutdown(listener.stop)
+
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    # Chatty client libraries only report problems
+    for name in ("httpx", "httpcore", "urllib3", "pika", "aio_pika", "aiormq", "hpack"):
+        logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+
+    _state.update(handler=handler, listener=listener)
+    return root
+
+
+_request_log = logging.getLogger("request")
+
+
+def start_request(endpoint):
+    """Decide whether this request's DEBUG/INFO records are kept; pass the token to end_request()."""
+    rate = LOG_SAMPLE_RATES.get(endpoint, 1.0)
+    return _sampled.set(rate >= 1.0 or random.random() < rate)
+
+
+def end_request(token):
+    _sampled.reset(token)
+
+
+def log_request(method, path, status, started):
+    """The per-request record; started is the time.perf_counter() at which the request began."""
+    fields = {
+        "method": method,
+        "path": path,
+        "status": status,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    stats = db.request_stats()
+    if stats is not None:
+        fields.update(db_queries=stats.queries, db_ms=round(stats.total_ms, 1))
+    _request_log.info("%s %s %s", method, path, status, extra=fields)
+
+
+def init_app(app, service):
+    """setup() plus per-endpoint sampling and a request log record for a Flask app."""
+    from flask import request, g
+
+    setup(service)
+    app.logger.handlers.clear()
+    app.logger.propagate = True
+
+    @app.before_request
+    def _sample_request():
+        g._log_started = time.perf_counter()
+        g._log_sampled = start_request(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+
+    @app.after_request
+    def _log_request(response):
+        started = g.get("_log_started")
+        if started is not None:
+            log_request(request.method, request.path, response.status_code, started)
+        return response
+
+    @app.teardown_request
+    def _reset_sampling(error=None):
+        token = g.pop("_log_sampled", None)
+        if token is not None:
+            end_request(token)
+
+    return app
@@ -0,0 +1,381 @@
+"""
+In-memory stand-in for the Supabase client, for load tests and local runs
+without the hosted project. Selected with SUPABASE_URL=memory://[<seed.json>]
+(see db.create_client):
+
+    SUPABASE_URL=memory:///tmp/seed.json?latency_ms=5
+
+The seed file maps table names to lists of rows ({"post": [{...}, ...]}).
+latency_ms adds a fixed delay per query, standing in for the round trip to
+PostgREST. Each process keeps its own copy: with several workers or services,
+writes are not shared, so seed every process from the same file. Clients for
+the same URL in one process (e.g. the async client and the sync one used by a
+background worker) share a store. AsyncMemoryClient stands in for the async
+PostgREST client: execute() is a coroutine.
+
+Supports the subset of the postgrest query builder the services use:
+select/insert/update/upsert (with ignore_duplicates)/delete, eq/neq/gt/gte/lt/lte/in_/is_, order,
+limit, range, single and maybe_single, and rpc("reset_id_sequence") (bulk
+imports, common/bulk.py). Inserted rows get an integer id and a
+created_at timestamp when they have none. Filter values are compared the way
+PostgREST casts them, so eq("id", "12") matches id 12.
+"""
+
+import asyncio
+import copy
+import json
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+
+
+class APIError(Exception):
+    """Raised where PostgREST would answer with an error (e.g. single() on no rows)."""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+class APIResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+    def __repr__(self):
+        return f"APIResponse(data={self.data!r}, count={self.count!r})"
+
+
+def _cast(value, stored):
+    # PostgREST receives filter values as text and casts them to the column type
+    if value is None or stored is None or isinstance(value, type(stored)):
+        return value
+    try:
+        if isinstance(stored, bool):
+            return str(value).lower() in ("true", "t", "1")
+        if isinstance(stored, int):
+            return int(value)
+        if isinstance(stored, float):
+            return float(value)
+    except (TypeError, ValueError):
+        return value
+    return str(value)
+
+
+def _compare(op):
+    def test(stored, value):
+        if stored is None:
+            return False
+        try:
+            return op(stored, _cast(value, stored))
+        except TypeError:
+            return False
+    return test
+
+
+_OPERATORS = {
+    "eq": _compare(lambda a, b: a == b),
+    "neq": _compare(lambda a, b: a != b),
+    "gt": _compare(lambda a, b: a > b),
+    "gte": _compare(lambda a, b: a >= b),
+    "lt": _compare(lambda a, b: a < b),
+    "lte": _compare(lambda a, b: a <= b),
+    "in": lambda stored, values: stored is not None and any(stored == _cast(v, stored) for v in values),
+    "is": lambda stored, value: stored is value or (value in ("null", None) and stored is None),
+}
+
+
+class MemoryStore:
+    """Tables of rows (dicts) behind one lock."""
+
+    def __init__(self, tables=None, latency=0.0):
+        self.tables = {name: [dict(row) for row in rows] for name, rows in (tables or {}).items()}
+        self.latency = latency
+        self._next_id = {
+            name: max((row["id"] for row in rows if isinstance(row.get("id"), int)), default=0) + 1
+            for name, rows in self.tables.items()
+        }
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, latency=0.0):
+        with open(path) as f:
+            return cls(json.load(f), latency)
+
+    def _rows(self, table):
+        return self.tables.setdefault(table, [])
+
+    def _new_row(self, table, values):
+        row = dict(values)
+        if row.get("id") is None:
+            row["id"] = self._next_id.get(table, 1)
+        if isinstance(row["id"], int):
+            self._next_id[table] = max(self._next_id.get(table, 1), row["id"] + 1)
+        row.setdefault("created_at", datetime.now().isoformat())
+        return row
+
+    def execute(self, query):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.run(query)
+
+    async def execute_async(self, query):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.run(query)
+
+    def run(self, query):
+        with self._lock:
+            result = getattr(self, f"_{query.operation}")(query)
+            # Callers get their own copies, as they would from a JSON response
+            return copy.deepcopy(result)
+
+    def _rpc(self, query):
+        if query.function != "reset_id_sequence":
+            raise APIError(f"Could not find the function {query.function}", code="PGRST202")
+        table = query.params["table_name"]
+        self._next_id[table] = max((row["id"] for row in self._rows(table)
+                                    if isinstance(row.get("id"), int)), default=0) + 1
+        return self._next_id[table], None
+
+    def _matching(self, query):
+        rows = self._rows(query.table)
+        return [row for row in rows if all(
+            _OPERATORS[op](row.get(column), value) for op, column, value in query.filters
+        )]
+
+    def _select(self, query):
+        rows = self._matching(query)
+        count = len(rows) if query.count else None
+        for column, desc in reversed(query.ordering):
+            # Postgres default: NULLs last ascending, first descending
+            rows = sorted(rows, key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+        if query.offset:
+            rows = rows[query.offset:]
+        if query.row_limit is not None:
+            rows = rows[:query.row_limit]
+        columns = [c.strip() for c in (query.columns or "*").split(",")]
+        if columns == ["count"] and not any("count" in row for row in rows):
+            return [{"count": len(rows)}], count
+        if "*" not in columns:
+            rows = [{c: row.get(c) for c in columns} for row in rows]
+        return rows, count
+
+    def _insert(self, query):
+        rows = [self._new_row(query.table, values) for values in query.values]
+        self._rows(query.table).extend(rows)
+        return rows, None
+
+    def _upsert(self, query):
+        table = self._rows(query.table)
+        keys = [k.strip() for k in query.on_conflict.split(",")]
+        result = []
+        for values in query.values:
+            existing = next((row for row in table if all(
+                k in values and row.get(k) == _cast(values[k], row.get(k)) for k in keys
+            )), None)
+            if existing is not None:
+                if not query.ignore_duplicates:
+                    existing.update(values)
+                    result.append(existing)
+            else:
+                row = self._new_row(query.table, values)
+                table.append(row)
+                result.append(row)
+        return result, None
+
+    def _update(self, query):
+        rows = self._matching(query)
+        for row in rows:
+            row.update(query.values[0])
+        return rows, None
+
+    def _delete(self, query):
+        rows = self._matching(query)
+        doomed = set(map(id, rows))
+        self.tables[query.table] = [row for row in self._rows(query.table) if id(row) not in doomed]
+        return rows, None
+
+
+class MemoryQuery:
+    """Chainable builder mirroring the postgrest one; execute() runs it against the store."""
+
+    def __init__(self, store, table):
+        self.store = store
+        self.table = table
+        self.operation = None
+        self.columns = None
+        self.count = None
+        self.values = []
+        self.on_conflict = "id"
+        self.ignore_duplicates = False
+        self.filters = []
+        self.ordering = []
+        self.offset = 0
+        self.row_limit = None
+        self.expect = None
+
+    def _set(self, operation, values=None):
+        self.operation = operation
+        if values is not None:
+            self.values = values if isinstance(values, list) else [values]
+        return self
+
+    def select(self, *columns, count=None):
+        self.columns = ",".join(columns) or "*"
+        self.count = count
+        return self._set("select")
+
+    def insert(self, values, **kwargs):
+        return self._set("insert", values)
+
+    def upsert(self, values, on_conflict="id", ignore_duplicates=False, **kwargs):
+        self.on_conflict = on_conflict or "id"
+        self.ignore_duplicates = ignore_duplicates
+        return self._set("upsert", values)
+
+    def update(self, values, **kwargs):
+        return self._set("update", values)
+
+    def delete(self, **kwargs):
+        return self._set("delete")
+
+    def _filter(self, op, column, value):
+        self.filters.append((op, column, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter("eq", column, value)
+
+    def neq(self, column, value):
+        return self._filter("neq", column, value)
+
+    def gt(self, column, value):
+        return self._filter("gt", column, value)
+
+    def gte(self, column, value):
+        return self._filter("gte", column, value)
+
+    def lt(self, column, value):
+        return self._filter("lt", column, value)
+
+    def lte(self, column, value):
+        return self._filter("lte", column, value)
+
+    def in_(self, column, values):
+        return self._filter("in", column, list(values))
+
+    def is_(self, column, value):
+        return self._filter("is", column, value)
+
+    def order(self, column, desc=False, **kwargs):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, size, **kwargs):
+        self.row_limit = size
+        return self
+
+    def range(self, start, end, **kwargs):
+        self.offset = start
+        self.row_limit = end - start + 1
+        return self
+
+    def single(self):
+        self.expect = "single"
+        return self
+
+    def maybe_single(self):
+        self.expect = "maybe_single"
+        return self
+
+    def execute(self):
+        return self._response(*self._check(self.store.execute)(self))
+
+    def _check(self, execute):
+        if self.operation is None:
+            raise APIError("No operation (select/insert/update/delete) on the query")
+        return execute
+
+    def _response(self, rows, count):
+        if self.expect is None:
+            return APIResponse(rows, count)
+        if len(rows) > 1 or (self.expect == "single" and not rows):
+            raise APIError("JSON object requested, multiple (or no) rows returned", code="PGRST116")
+        return APIResponse(rows[0] if rows else None, count)
+
+
+class AsyncMemoryQuery(MemoryQuery):
+    async def execute(self):
+        return self._response(*await self._check(self.store.execute_async)(self))
+
+
+class MemoryRpc:
+    """A stored function call, as supabase.Client.rpc() returns it."""
+
+    operation = "rpc"
+
+    def __init__(self, store, function, params):
+        self.store = store
+        self.function = function
+        self.params = params
+
+    def execute(self):
+        return APIResponse(*self.store.execute(self))
+
+
+class AsyncMemoryRpc(MemoryRpc):
+    async def execute(self):
+        return APIResponse(*await self.store.execute_async(self))
+
+
+class MemoryClient:
+    """The part of supabase.Client the services use: table()/from_()/rpc()."""
+
+    query_class = MemoryQuery
+    rpc_class = MemoryRpc
+
+    def __init__(self, store):
+        self.store = store
+
+    def table(self, name):
+        return self.query_class(self.store, name)
+
+    def from_(self, name):
+        return self.table(name)
+
+    def rpc(self, function, params=None):
+        return self.rpc_class(self.store, function, params or {})
+
+
+class AsyncMemoryClient(MemoryClient):
+    query_class = AsyncMemoryQuery
+    rpc_class = AsyncMemoryRpc
+
+    async def aclose(self):
+        pass
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def store_for(url):
+    """The process-wide MemoryStore for memory://[<seed path>][?latency_ms=N]."""
+    with _stores_lock:
+        if url not in _stores:
+            parts = urlsplit(url)
+            latency = float(parse_qs(parts.query).get("latency_ms", ["0"])[0]) / 1000
+            path = parts.netloc + parts.path
+            _stores[url] = MemoryStore.load(path, latency) if path else MemoryStore(latency=latency)
+        return _stores[url]
+
+
+def from_url(url):
+    return MemoryClient(store_for(url))
+
+
+def async_from_url(url):
+    return AsyncMemoryClient(store_for(url))
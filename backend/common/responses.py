@@ -0,0 +1,149 @@
+"""
+JSON encoding and compression of the services' responses.
+
+init_app(app) installs (common/aio.py applies the same to aiohttp apps):
+  - a JSON provider backed by orjson (several times faster than the standard
+    library on feed-sized payloads, and encodes straight to bytes); jsonify(),
+    request.get_json() and app.json all go through it. JSON_PROVIDER=default
+    keeps Flask's own provider, which is also used when orjson is not installed.
+  - compression of responses larger than COMPRESS_MIN_SIZE bytes, negotiated
+    from Accept-Encoding: brotli when the client accepts it and the brotli
+    package is installed, otherwise gzip. Streamed responses (SSE) and
+    responses that already have a Content-Encoding are left alone.
+
+Configuration (environment):
+    JSON_PROVIDER         orjson (default) or default
+    COMPRESS_MIN_SIZE     bytes below which responses are sent as-is (default 1024)
+    COMPRESS_MIMETYPES    comma-separated (default application/json,text/html,text/plain,text/csv)
+    COMPRESS_GZIP_LEVEL   1-9 (default 6)
+    COMPRESS_BR_QUALITY   0-11 (default 4; higher is much slower for little gain on dynamic responses)
+"""
+
+import gzip
+import json
+import os
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON_PROVIDER = os.environ.get("JSON_PROVIDER", "orjson").lower()
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_MIMETYPES = frozenset(
+    m.strip() for m in os.environ.get(
+        "COMPRESS_MIMETYPES", "application/json,text/html,text/plain,text/csv"
+    ).split(",") if m.strip()
+)
+COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BR_QUALITY = int(os.environ.get("COMPRESS_BR_QUALITY", "4"))
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider using orjson; keys keep their insertion order."""
+
+    sort_keys = False
+
+    def _option(self):
+        # Dates go through Flask's default() so they keep Flask's HTTP-date format
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # json.dumps-only arguments (indent, separators, cls...)
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._option()).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._option() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def dumps(obj):
+    """JSON bytes for a response body, outside Flask (orjson when available)."""
+    if JSON_PROVIDER == "orjson" and orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, default=str) + "\n").encode("utf-8")
+
+
+def loads(data):
+    """Parse JSON bytes or str outside Flask (orjson when available)."""
+    if JSON_PROVIDER == "orjson" and orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESS_BR_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL)
+
+
+def negotiate_encoding(accept_encoding):
+    """br or gzip, whichever the Accept-Encoding header prefers (br on a tie), or None."""
+    quality = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                continue
+        quality[coding.strip().lower()] = q
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best = max(offered, key=lambda coding: quality.get(coding, quality.get("*", 0)))
+    return best if quality.get(best, quality.get("*", 0)) > 0 else None
+
+
+def compress_response(response, accept_encodings):
+    """Compress a buffered response in place if it is worth it and the client accepts it."""
+    if response.direct_passthrough or response.is_streamed \
+            or response.status_code < 200 or response.status_code in (204, 206, 304) \
+            or "Content-Encoding" in response.headers \
+            or response.mimetype not in COMPRESS_MIMETYPES:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    encoding = accept_encodings.best_match(["br", "gzip"] if brotli is not None else ["gzip"])
+    if encoding is None:
+        return response
+
+    response.set_data(encode(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_app(app):
+    from flask import request
+
+    if JSON_PROVIDER == "orjson" and orjson is not None:
+        app.json_provider_class = OrjsonProvider
+        app.json = OrjsonProvider(app)
+
+    @app.after_request
+    def _compress(response):
+        return compress_response(response, request.accept_encodings)
+
+    return app
@@ -0,0 +1,171 @@
+"""
+Coalescing of identical concurrent reads within a process ("single flight").
+
+    feed_reads = SingleFlight(ttl=SINGLEFLIGHT_TTL)
+    rows = feed_reads.do("feed", lambda: supabase.table("post").select("*").execute().data)
+
+The first caller for a key runs the function; callers arriving while it is in
+flight wait for it and get the same result (or exception), so a burst of
+requests for one popular post costs one backend query instead of one each.
+With a ttl, the result is also reused for that many seconds afterwards.
+
+Results are shared between requests: treat them as read-only. Call forget(key)
+after a write so later reads in this process see it.
+
+AsyncSingleFlight is the asyncio version for the aiohttp services:
+
+    rows = await feed_reads.do("feed", load_feed)   # load_feed: async function
+
+The query runs as its own task, so a leader whose client disconnects does not
+cancel it for the requests waiting on the same key.
+
+Configuration (environment):
+    SINGLEFLIGHT_TTL    seconds a result is reused after the query finishes (default 0: only coalesce)
+    SINGLEFLIGHT_WAIT   seconds to wait on another request's query before running our own (default 30)
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from common import tracing
+
+SINGLEFLIGHT_TTL = float(os.environ.get("SINGLEFLIGHT_TTL", "0"))
+SINGLEFLIGHT_WAIT = float(os.environ.get("SINGLEFLIGHT_WAIT", "30"))
+
+
+class _Call:
+    __slots__ = ("done", "value", "error", "forgotten")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.forgotten = False
+
+
+class SingleFlight:
+    def __init__(self, ttl=SINGLEFLIGHT_TTL, max_entries=1024, wait=SINGLEFLIGHT_WAIT):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait = wait
+        self._calls = {}
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                if cached[0] > time.monotonic():
+                    _tag("cached")
+                    return cached[1]
+                del self._results[key]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.done.wait(self.wait):
+                _tag("shared")
+                if call.error is not None:
+                    raise call.error
+                return call.value
+            # The other request is stuck; do not pile up behind it
+            return fn()
+
+        try:
+            call.value = fn()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                if self.ttl and call.error is None and not call.forgotten:
+                    self._results[key] = (time.monotonic() + self.ttl, call.value)
+                    self._results.move_to_end(key)
+                    while len(self._results) > self.max_entries:
+                        self._results.popitem(last=False)
+            call.done.set()
+
+    def forget(self, key):
+        """Drop the cached result; a query already in flight still answers its waiters but is not cached."""
+        with self._lock:
+            self._results.pop(key, None)
+            call = self._calls.pop(key, None)
+            if call is not None:
+                call.forgotten = True
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            for call in self._calls.values():
+                call.forgotten = True
+            self._calls.clear()
+
+
+class AsyncSingleFlight:
+    def __init__(self, ttl=SINGLEFLIGHT_TTL, max_entries=1024, wait=SINGLEFLIGHT_WAIT):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait = wait
+        self._calls = {}
+        self._results = OrderedDict()
+
+    async def do(self, key, fn):
+        cached = self._results.get(key)
+        if cached is not None:
+            if cached[0] > time.monotonic():
+                _tag("cached")
+                return cached[1]
+            del self._results[key]
+
+        task = self._calls.get(key)
+        leader = task is None
+        if leader:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._finished(key, done))
+        elif not self.wait:
+            return await fn()
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), None if leader else self.wait)
+        except asyncio.TimeoutError:
+            if leader:
+                raise
+            # The other request is stuck; do not pile up behind it
+            return await fn()
+        if not leader:
+            _tag("shared")
+        return result
+
+    def _finished(self, key, task):
+        if self._calls.get(key) is not task:
+            # Forgotten while in flight
+            return
+        del self._calls[key]
+        if self.ttl and not task.cancelled() and task.exception() is None:
+            self._results[key] = (time.monotonic() + self.ttl, task.result())
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def forget(self, key):
+        """Drop the cached result; a query already in flight still answers its waiters but is not cached."""
+        self._results.pop(key, None)
+        self._calls.pop(key, None)
+
+    def clear(self):
+        self._results.clear()
+        self._calls.clear()
+
+
+def _tag(outcome):
+    span = tracing.current_span()
+    if span is not None:
+        span.set(singleflight=outcome)
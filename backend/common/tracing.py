@@ -0,0 +1,360 @@
+"""
+Correlation IDs and timed spans across the services.
+
+Every request gets a trace ID: the incoming X-Request-ID (set by Kong's
+correlation-id plugin or an upstream service) or a new one. It is echoed on the
+response, sent on outbound HTTP calls (http_client) and AMQP messages (inject()),
+and attached to every span recorded while handling the request.
+
+A span is one timed piece of work -- the request itself, a Supabase query, a
+Cloudinary upload, a downstream call -- with its own ID and its parent's ID, so
+a collector can rebuild the tree across services (tools/trace_collector.py).
+Finished spans are written as one JSON object per line by a background thread;
+nothing is written unless TRACE_EXPORT is set:
+
+    TRACE_EXPORT=stdout                 JSON lines on stdout
+    TRACE_EXPORT=udp://collector:6000   one datagram per span
+
+    {"trace_id": ..., "span_id": ..., "parent_id": ..., "service": "post-service",
+     "name": "supabase.insert post", "start": 1718000000.123, "duration_ms": 41.7,
+     "status": "ok", "attrs": {...}}
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+from common import db
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+PARENT_SPAN_HEADER = "X-Parent-Span-ID"
+# AMQP header names (lowercase, like the existing x-published-at / x-attempt)
+AMQP_REQUEST_ID_HEADER = "x-request-id"
+AMQP_PARENT_SPAN_HEADER = "x-parent-span-id"
+
+TRACE_EXPORT = os.environ.get("TRACE_EXPORT", "")
+TRACE_QUEUE_SIZE = int(os.environ.get("TRACE_QUEUE_SIZE", "10000"))
+MAX_ID_LENGTH = 128
+
+_service = os.environ.get("SERVICE_NAME", "unknown")
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+def configure(service):
+    global _service
+    _service = service
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+def new_span_id():
+    return os.urandom(8).hex()
+
+
+def _valid_id(value):
+    return isinstance(value, str) and 0 < len(value) <= MAX_ID_LENGTH and value.isprintable() \
+        and " " not in value
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attrs", "status", "start", "_started")
+
+    def __init__(self, name, trace_id, parent_id, attrs):
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.status = "ok"
+        self.start = time.time()
+        self._started = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def fail(self, error):
+        self.status = "error"
+        self.attrs["error"] = f"{type(error).__name__}: {error}"
+
+    def finish(self):
+        duration_ms = (time.perf_counter() - self._started) * 1000
+        if TRACE_EXPORT:
+            _exporter.submit({
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "service": _service,
+                "name": self.name,
+                "start": self.start,
+                "duration_ms": round(duration_ms, 3),
+                "status": self.status,
+                "attrs": self.attrs,
+            })
+        return duration_ms
+
+
+def current_span():
+    return _current.get()
+
+
+def current_trace_id():
+    span = _current.get()
+    return span.trace_id if span is not None else None
+
+
+def start_span(name, trace_id=None, parent_id=None, **attrs):
+    """Open a span and make it current; pair with end_span(). Prefer span() where possible."""
+    parent = _current.get()
+    if trace_id is None:
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id = new_trace_id()
+    s = Span(name, trace_id, parent_id, attrs)
+    return s, _current.set(s)
+
+
+def end_span(s, token, error=None):
+    if error is not None:
+        s.fail(error)
+    _current.reset(token)
+    return s.finish()
+
+
+@contextlib.contextmanager
+def span(name, trace_id=None, parent_id=None, **attrs):
+    """
+    Time the enclosed block as a child of the current span. With no current span
+    (background threads) it starts a new trace, or continues trace_id/parent_id
+    taken from an incoming message.
+    """
+    s, token = start_span(name, trace_id, parent_id, **attrs)
+    error = None
+    try:
+        yield s
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        end_span(s, token, error)
+
+
+def inject(headers, amqp=False):
+    """Add the current trace context to outbound HTTP (or AMQP) headers."""
+    s = _current.get()
+    if s is not None:
+        if amqp:
+            headers[AMQP_REQUEST_ID_HEADER] = s.trace_id
+            headers[AMQP_PARENT_SPAN_HEADER] = s.span_id
+        else:
+            headers[REQUEST_ID_HEADER] = s.trace_id
+            headers[PARENT_SPAN_HEADER] = s.span_id
+    return headers
+
+
+def extract(headers, amqp=False):
+    """(trace_id, parent_span_id) from incoming headers, or (None, None)."""
+    headers = headers or {}
+    trace_key, parent_key = (AMQP_REQUEST_ID_HEADER, AMQP_PARENT_SPAN_HEADER) if amqp \
+        else (REQUEST_ID_HEADER, PARENT_SPAN_HEADER)
+    trace_id = headers.get(trace_key)
+    if not _valid_id(trace_id):
+        return None, None
+    parent_id = headers.get(parent_key)
+    return trace_id, parent_id if _valid_id(parent_id) else None
+
+
+def display_url(url):
+    # Drop query strings, which may carry tokens
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+
+# Flask
+
+def init_app(app, service):
+    """Trace every request of a Flask app and echo its X-Request-ID."""
+    from flask import request, g
+
+    configure(service)
+
+    @app.before_request
+    def _start_request_span():
+        trace_id, parent_id = extract(request.headers)
+        g._trace = start_span(
+            f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+            trace_id=trace_id or new_trace_id(),
+            parent_id=parent_id,
+            path=request.path
+        )
+
+    @app.after_request
+    def _tag_response(response):
+        trace = g.get("_trace")
+        if trace is not None:
+            trace[0].set(status_code=response.status_code)
+            if response.status_code >= 500:
+                trace[0].status = "error"
+            response.headers[REQUEST_ID_HEADER] = trace[0].trace_id
+        return response
+
+    @app.teardown_request
+    def _end_request_span(error=None):
+        trace = g.pop("_trace", None)
+        if trace is not None:
+            end_span(trace[0], trace[1], error)
+
+    return app
+
+
+# Supabase
+
+class _TracedQuery:
+    """Wraps a postgrest query builder so execute() is recorded as a span and counted (db.init_app)."""
+
+    def __init__(self, builder, table, operation=None):
+        self._builder = builder
+        self._table = table
+        self._operation = operation
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        operation = self._operation or name
+        if callable(attr) and name != "execute":
+            def call(*args, **kwargs):
+                result = attr(*args, **kwargs)
+                return type(self)(result, self._table, operation) if hasattr(result, "execute") else result
+            return call
+        if hasattr(attr, "execute"):
+            return type(self)(attr, self._table, operation)
+        return attr
+
+    @contextlib.contextmanager
+    def _query_span(self):
+        name = f"supabase.{self._operation or 'query'} {self._table}"
+        s, token = start_span(name, table=self._table)
+        error = None
+        try:
+            yield s
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # Also counted against the request's query budget
+            db.record_query(name, end_span(s, token, error))
+
+    def execute(self):
+        with self._query_span() as s:
+            return _count_rows(s, self._builder.execute())
+
+
+class _TracedAsyncQuery(_TracedQuery):
+    async def execute(self):
+        with self._query_span() as s:
+            return _count_rows(s, await self._builder.execute())
+
+
+def _count_rows(s, result):
+    data = getattr(result, "data", None)
+    if isinstance(data, list):
+        s.set(rows=len(data))
+    return result
+
+
+class TracedSupabase:
+    """Drop-in wrapper for a supabase Client that times every table query."""
+
+    query_class = _TracedQuery
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name):
+        return self.query_class(self._client.from_(name), name)
+
+    def from_(self, name):
+        return self.table(name)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class TracedAsyncSupabase(TracedSupabase):
+    """The same for an async PostgREST client (db.create_async_client): await query.execute()."""
+
+    query_class = _TracedAsyncQuery
+
+
+def trace_supabase(client):
+    return TracedSupabase(client)
+
+
+def trace_async_supabase(client):
+    return TracedAsyncSupabase(client)
+
+
+# Export
+
+class _Exporter:
+    """Writes finished spans from a bounded queue on a background thread; drops when full."""
+
+    def __init__(self, target, max_queue):
+        self.target = target
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Per process: gunicorn workers fork after import
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def submit(self, record):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        send = self._sender()
+        while True:
+            record = self.queue.get()
+            try:
+                send(json.dumps(record, default=str))
+            except Exception as e:
+                logger.warning("Could not export span: %s", e)
+
+    def _sender(self):
+        if self.target.startswith("udp://"):
+            address = urlsplit(self.target)
+            destination = (address.hostname, address.port or 6000)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            return lambda line: sock.sendto(line.encode("utf-8"), destination)
+
+        def write(line):
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+        return write
+
+
+_exporter = _Exporter(TRACE_EXPORT, TRACE_QUEUE_SIZE)
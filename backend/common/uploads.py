@@ -0,0 +1,58 @@
+"""
+Streaming file uploads between services. (Werkzeug's form parser already
+spools uploaded files above 500KB to a temporary file.)
+
+stream_multipart() re-encodes form fields and files as a multipart body
+generator; passed as `data=` to requests it is sent with chunked transfer
+encoding, reading the files UPLOAD_CHUNK_SIZE bytes at a time instead of
+building the whole body in memory.
+"""
+
+import os
+import uuid
+
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+
+
+def _quote(value):
+    # Same escaping browsers apply to names in Content-Disposition
+    return str(value).replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+def stream_multipart(fields, files, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Build a streaming multipart/form-data body.
+
+    fields maps names to values (None is skipped); files maps names to
+    werkzeug FileStorage objects. Returns (body generator, Content-Type header).
+    """
+    boundary = uuid.uuid4().hex
+
+    def body():
+        for name, value in fields.items():
+            if value is None:
+                continue
+            yield (
+                f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="{_quote(name)}"\r\n\r\n'
+                f'{value}\r\n'
+            ).encode("utf-8")
+
+        for name, file in files.items():
+            content_type = file.mimetype or "application/octet-stream"
+            yield (
+                f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="{_quote(name)}"; filename="{_quote(file.filename or name)}"\r\n'
+                f'Content-Type: {content_type}\r\n\r\n'
+            ).encode("utf-8")
+            file.stream.seek(0)
+            while True:
+                chunk = file.stream.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            yield b"\r\n"
+
+        yield f"--{boundary}--\r\n".encode("utf-8")
+
+    return body(), f"multipart/form-data; boundary={boundary}"
@@ -0,0 +1,146 @@
+"""
+Feed projector: keeps the feed read model (common/feed.py) current from the
+domain events of the post and social services (common/events.py).
+
+Its queue is bound to the events that change a feed card. Events are gathered
+for FEED_PROJECT_WINDOW seconds (or FEED_PROJECT_BATCH events), every post
+they touch is projected once, and the batch is acked together; a burst of
+likes on one post costs one projection. A batch that fails is redelivered
+after FEED_RETRY_INTERVAL seconds. Every batch purges the feed from the
+gateway cache (common/cache.py).
+
+Run:
+    python -u projector.py                      consume events
+    python projector.py rebuild [--batch-size N]
+                                                rebuild every row from the source
+                                                tables (backfills, missed events)
+
+Configuration (environment):
+    AMQP_URL, SUPABASE_URL, SUPABASE_KEY
+    FEED_PROJECTOR_QUEUE   queue bound to the domain events exchange (default feed_projector)
+    FEED_PROJECT_WINDOW    seconds to gather events into one batch (default 0.5)
+    FEED_PROJECT_BATCH     max events per batch, also the prefetch (default 200)
+    FEED_RETRY_INTERVAL    seconds before a failed batch is redelivered (default 5)
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+import pika
+from common import cache, db, events, feed, log, tracing
+
+logger = logging.getLogger(__name__)
+
+FEED_PROJECTOR_QUEUE = os.environ.get("FEED_PROJECTOR_QUEUE", "feed_projector")
+FEED_PROJECT_WINDOW = float(os.environ.get("FEED_PROJECT_WINDOW", "0.5"))
+FEED_PROJECT_BATCH = int(os.environ.get("FEED_PROJECT_BATCH", "200"))
+FEED_RETRY_INTERVAL = float(os.environ.get("FEED_RETRY_INTERVAL", "5"))
+RECONNECT_INTERVAL = 5
+
+# Events that change a feed card. new_like is the social service's notification
+# event, which is published to the exchange as well; data_imported is sent per
+# batch of a bulk import (common/bulk.py).
+EVENT_TYPES = (
+    "post_created",
+    "post_deleted",
+    "new_like",
+    "like_removed",
+    "comment_added",
+    "social_data_purged",
+    "data_imported",
+)
+
+supabase = tracing.trace_supabase(db.create_client(os.environ.get("SUPABASE_URL"), os.environ.get("SUPABASE_KEY")))
+
+
+def affected_posts(body):
+    try:
+        message = json.loads(body)
+        data = message.get("data") or {}
+        if "post_ids" in data:
+            return [str(post_id) for post_id in data["post_ids"]]
+        return [str(data["post_id"])]
+    except (ValueError, TypeError, KeyError, AttributeError):
+        # Nothing to project; acked with its batch
+        logger.warning("Skipping malformed event: %r", body[:200])
+        return []
+
+
+def project_batch(channel, batch):
+    post_ids = {post_id for _, ids in batch for post_id in ids}
+    last_tag = batch[-1][0]
+    try:
+        with tracing.span("feed.project", events=len(batch), posts=len(post_ids)):
+            upserted, deleted = feed.project(supabase, post_ids)
+    except Exception:
+        logger.exception("Could not project %d posts; redelivering %d events in %ss",
+                         len(post_ids), len(batch), FEED_RETRY_INTERVAL)
+        # Keeps answering heartbeats while waiting
+        channel.connection.sleep(FEED_RETRY_INTERVAL)
+        channel.basic_nack(delivery_tag=last_tag, multiple=True, requeue=True)
+        return
+    channel.basic_ack(delivery_tag=last_tag, multiple=True)
+    cache.purge(cache.FEED_CARDS_KEY)
+    logger.debug("Projected %d events: %d rows written, %d deleted", len(batch), upserted, deleted)
+
+
+def declare(channel):
+    events.declare_exchange(channel)
+    channel.queue_declare(queue=FEED_PROJECTOR_QUEUE, durable=True)
+    for event_type in EVENT_TYPES:
+        channel.queue_bind(queue=FEED_PROJECTOR_QUEUE, exchange=events.DOMAIN_EVENTS_EXCHANGE,
+                           routing_key=event_type)
+
+
+def consume(channel):
+    batch = []
+    deadline = None
+    for method, properties, body in channel.consume(FEED_PROJECTOR_QUEUE,
+                                                    inactivity_timeout=FEED_PROJECT_WINDOW):
+        if method is not None:
+            batch.append((method.delivery_tag, affected_posts(body)))
+            if deadline is None:
+                deadline = time.monotonic() + FEED_PROJECT_WINDOW
+        if batch and (len(batch) >= FEED_PROJECT_BATCH or time.monotonic() >= deadline):
+            project_batch(channel, batch)
+            batch = []
+            deadline = None
+
+
+def run():
+    while True:
+        try:
+            connection = pika.BlockingConnection(pika.URLParameters(os.environ["AMQP_URL"]))
+            channel = connection.channel()
+            declare(channel)
+            channel.basic_qos(prefetch_count=FEED_PROJECT_BATCH)
+            logger.info("Projecting events from %s into %s", FEED_PROJECTOR_QUEUE, feed.FEED_TABLE)
+            consume(channel)
+        except pika.exceptions.AMQPError as e:
+            # Unacked events are redelivered after reconnecting
+            logger.warning("Connection to RabbitMQ lost: %r; reconnecting in %ss", e, RECONNECT_INTERVAL)
+            time.sleep(RECONNECT_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", nargs="?", choices=["consume", "rebuild"], default="consume")
+    parser.add_argument("--batch-size", type=int, default=200, help="posts per projection when rebuilding")
+    args = parser.parse_args()
+
+    log.setup("feed-projector")
+    tracing.configure("feed-projector")
+    if args.command == "rebuild":
+        started = time.perf_counter()
+        upserted, deleted = feed.rebuild(supabase, args.batch_size)
+        cache.purge(cache.FEED_CARDS_KEY)
+        logger.info("Rebuilt %s: %d rows written, %d deleted in %.1fs",
+                    feed.FEED_TABLE, upserted, deleted, time.perf_counter() - started)
+        return
+    run()
+
+
+if __name__ == "__main__":
+    main()
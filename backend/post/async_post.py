@@ -0,0 +1,261 @@
+"""
+asyncio variant of post.py: the same routes and responses on aiohttp, with the
+async PostgREST client, so one process serves thousands of concurrent requests
+instead of one per worker thread. Cloudinary's SDK is blocking, so uploads run
+on the default thread pool. Everything but request parsing and database I/O is
+shared with post.py (post_core.py).
+
+Run with:
+    gunicorn -c common/gunicorn_conf.py async_post:app    (WEB_WORKER_CLASS=aiohttp.GunicornWebWorker)
+    python async_post.py                                  (development)
+"""
+
+from aiohttp import web
+import asyncio
+import os
+import logging
+import ranking
+import post_core
+from post_core import POSTS_TABLE, USER_TABLE, POST_KEY
+from common import aio, bulk, cache, db, feed, idempotency, singleflight, tracing
+
+app = web.Application(client_max_size=post_core.MAX_CONTENT_LENGTH)
+aio.init_app(app, "post-service", cors_origins=["http://localhost:8080"])
+logger = logging.getLogger(__name__)
+routes = web.RouteTableDef()
+
+# Initialize Supabase client
+supabase_url = os.environ.get("SUPABASE_URL", "your-supabase-url")
+supabase_key = os.environ.get("SUPABASE_KEY", "your-supabase-anon-key")
+supabase = tracing.trace_async_supabase(db.create_async_client(supabase_url, supabase_key))
+
+def authenticate(request):
+    payload, error = post_core.authenticate(request.headers.get('Authorization'))
+    return payload, aio.json_response(*error) if error else None
+
+# Concurrent feed loads share one query; the rows are read-only
+feed_reads = singleflight.AsyncSingleFlight()
+
+# Per-user rankings for GET /api/posts/personalized, dropped whenever the feed is purged
+ranker = ranking.Ranker()
+
+@cache.on_purge
+def drop_rankings(keys):
+    if cache.FEED_KEY in keys:
+        ranker.invalidate()
+
+# Replays create_post responses for retried requests with the same Idempotency-Key
+# Shared by all workers through the database; its queries run on a worker thread
+idempotency_store = idempotency.create_store(tracing.trace_supabase(db.create_client(supabase_url, supabase_key)))
+
+@routes.post('/api/posts')
+@idempotency.idempotent_async(idempotency_store)
+async def create_post(request):
+    payload, error = authenticate(request)
+    if error:
+        return error
+
+    # Get form data
+    form = await request.post()
+    title = form.get('title')
+    content = form.get('content')
+    location = form.get('location')
+    preferences = form.get('preferences')
+
+    if not all([title, content]):
+        return aio.json_response({'error': 'Missing required fields'}, 400)
+
+    try:
+        image_url = None
+        file = form.get('image')
+        if isinstance(file, web.FileField) and file.filename != '':
+            file.file.seek(0, os.SEEK_END)
+            size = file.file.tell()
+            file.file.seek(0)
+            image_url = await asyncio.to_thread(post_core.upload_image, file.file, file.filename, size)
+
+        post_data = post_core.new_post(payload, title, content, location, preferences, image_url)
+        response = await supabase.table(POSTS_TABLE).insert(post_data).execute()
+        new_post = response.data[0]
+        post_core.post_created(feed_reads, new_post)
+
+        return aio.json_response(post_core.created_response(new_post), 201)
+
+    except Exception as e:
+        return aio.json_response({'error': str(e)}, 500)
+
+async def load_feed():
+    response = await supabase.table(POSTS_TABLE).select('*').order('created_at', desc=True).execute()
+    return response.data
+
+@routes.get('/api/posts')
+async def get_posts(request):
+    payload, error = authenticate(request)
+    if error:
+        return error
+    try:
+        # Tags are filtered in Python instead of SQL
+        posts = await feed_reads.do("feed", load_feed)
+        return aio.json_response(post_core.posts_response(posts, request.query.get('tags')),
+                                 headers=cache.cacheable(cache.FEED_KEY))
+    except Exception as e:
+        return aio.json_response({'error': str(e)}, 500)
+
+# Posts ranked against the caller's taste preferences (ranking.py), best match first
+@routes.get('/api/posts/personalized')
+async def get_personalized_posts(request):
+    payload, error = authenticate(request)
+    if error:
+        return error
+
+    limit = post_core.page_limit(request.query.get('limit'))
+    offset = post_core.page_offset(request.query.get('offset'))
+    user_id = payload['user_id']
+    try:
+        # Read on every request, so a preferences change applies at once
+        result = await supabase.table(USER_TABLE).select('taste_preferences').eq('userId', user_id).execute()
+        vector = ranking.user_vector(result.data[0].get('taste_preferences') if result.data else None)
+
+        ranked = ranker.lookup(user_id, vector)
+        if ranked is None:
+            candidates = ranker.candidates()
+            if candidates is None:
+                generation = ranker.generation
+                candidates = ranker.set_candidates(await feed_reads.do("feed", load_feed), generation)
+            ranked = ranker.rank(user_id, vector, candidates)
+
+        return aio.json_response(post_core.personalized_response(ranked, offset, limit),
+                                 headers=cache.cacheable(cache.FEED_KEY, cache.preferences_key(user_id), per_user=True))
+    except Exception as e:
+        logger.exception("Error in get_personalized_posts")
+        return aio.json_response({'error': str(e)}, 500)
+
+# Feed cards with like and comment counts, from the read model kept by feed/projector.py
+@routes.get('/api/posts/feed')
+async def get_feed(request):
+    payload, error = authenticate(request)
+    if error:
+        return error
+
+    limit = post_core.page_limit(request.query.get('limit'))
+    # Cursor: created_at of the last card of the previous page
+    before = request.query.get('before')
+    try:
+        rows = await feed_reads.do(("cards", limit, before), lambda: load_feed_cards(limit, before))
+        return aio.json_response(post_core.feed_response(rows, limit, request.query.get('tags'), payload['user_id']),
+                                 headers=cache.cacheable(cache.FEED_CARDS_KEY, per_user=True))
+    except Exception as e:
+        logger.exception("Error in get_feed")
+        return aio.json_response({'error': str(e)}, 500)
+
+async def load_feed_cards(limit, before):
+    query = supabase.table(feed.FEED_TABLE).select('*')
+    if before:
+        query = query.lt('created_at', before)
+    response = await query.order('created_at', desc=True).limit(limit).execute()
+    return response.data
+
+@routes.get(r'/api/posts/user/{user_id:\d+}')
+async def get_user_posts(request):
+    payload, error = authenticate(request)
+    if error:
+        return error
+    user_id = int(request.match_info['user_id'])
+
+    try:
+        response = await supabase.table(POSTS_TABLE).select('*').eq('user_id', user_id) \
+            .order('created_at', desc=True).execute()
+        posts = response.data
+
+        return aio.json_response(post_core.user_posts_response(posts, payload),
+                                 headers=cache.cacheable(cache.user_key(user_id), per_user=not posts))
+    except Exception as e:
+        return aio.json_response({'error': str(e)}, 500)
+
+@routes.delete('/api/posts')
+async def delete_post(request):
+    payload, error = authenticate(request)
+    if error:
+        return error
+
+    try:
+        data = await aio.read_json(request)
+        if not data or 'post_id' not in data:
+            return aio.json_response({'error': 'Missing post_id in request body'}, 400)
+
+        post_id = data['post_id']
+
+        # First, get the post to check ownership
+        post_response = await supabase.table(POSTS_TABLE).select('user_id').eq('id', post_id).execute()
+        if not post_response.data:
+            logger.debug("Post %s not found", post_id)
+            return aio.json_response({'error': 'Post not found'}, 404)
+
+        post = post_response.data[0]
+        error = post_core.delete_error(post, post_id, payload)
+        if error:
+            return aio.json_response(*error)
+
+        await supabase.table(POSTS_TABLE).delete().eq('id', post_id).execute()
+        post_core.post_deleted(feed_reads, post_id, post.get('user_id'))
+
+        return aio.json_response({'message': 'Post deleted successfully'})
+
+    except Exception as e:
+        logger.exception("Error in delete_post")
+        return aio.json_response({'error': str(e)}, 500)
+
+# Delete all posts for a user
+@routes.delete('/api/posts/user/{user_id}')
+async def delete_user_posts(request):
+    payload, error = authenticate(request)
+    if error:
+        return error
+    user_id = request.match_info['user_id']
+
+    # Check if the authenticated user matches the requested user_id
+    if str(payload.get('user_id')) != str(user_id):
+        logger.warning("User %s may not delete the posts of user %s", payload.get('user_id'), user_id)
+        return aio.json_response({'error': 'Unauthorized to delete these posts'}, 403)
+
+    try:
+        result = await supabase.table(POSTS_TABLE).delete().eq('user_id', user_id).execute()
+        post_core.user_posts_deleted(feed_reads, user_id, result.data or [])
+        return aio.json_response({'message': 'All posts deleted successfully'})
+
+    except Exception as e:
+        logger.exception("Error deleting posts")
+        return aio.json_response({'error': str(e)}, 500)
+
+# Bulk export of the post table as NDJSON, for backfills and analytics (common/bulk.py)
+@routes.get('/api/posts/admin/export')
+async def export_posts(request):
+    payload, error = authenticate(request)
+    if error:
+        return error
+    if not bulk.is_admin(payload):
+        return aio.json_response({'error': 'Admin access required'}, 403)
+
+    return await bulk.export_response_async(request, supabase, POSTS_TABLE, POST_KEY)
+
+# Bulk import of NDJSON posts in batches; streams a report line per batch
+@routes.post('/api/posts/admin/import')
+async def import_posts(request):
+    payload, error = authenticate(request)
+    if error:
+        return error
+    if not bulk.is_admin(payload):
+        return aio.json_response({'error': 'Admin access required'}, 403)
+
+    logger.info("User %s is importing posts", payload.get('user_id'))
+    return await bulk.import_response_async(request, supabase, POSTS_TABLE, POST_KEY,
+                                            after_batch=lambda rows: post_core.posts_imported(feed_reads, rows))
+
+async def close_supabase(app):
+    await supabase.aclose()
+
+app.add_routes(routes)
+app.on_cleanup.append(close_supabase)
+
+if __name__ == '__main__':
+    web.run_app(app, host='0.0.0.0', port=5000, access_log=None)
@@ -0,0 +1,215 @@
+"""
+The parts of the post service that do not depend on the web framework, shared
+by post.py (Flask) and async_post.py (aiohttp): token checks, the rows that
+are written, the shape of every response, and what a write invalidates. The
+apps keep only request parsing and database I/O.
+"""
+
+import logging
+import os
+from datetime import datetime
+import cloudinary
+import cloudinary.uploader
+import jwt
+import ranking
+from common import cache, events, feed, tracing
+
+logger = logging.getLogger(__name__)
+
+# Define the table name for posts
+POSTS_TABLE = "post"
+# The user service's table, read for taste preferences
+USER_TABLE = "user"
+# Exports page through the table in this order
+POST_KEY = ("id",)
+
+# Set maximum file size to 10MB
+MAX_CONTENT_LENGTH = 10 * 1024 * 1024
+
+# Images larger than this are sent to Cloudinary in chunks of this size (5MB minimum)
+CLOUDINARY_CHUNK_SIZE = int(os.environ.get("CLOUDINARY_CHUNK_SIZE", str(6 * 1024 * 1024)))
+
+# Feed cards per page of GET /api/posts/feed
+FEED_PAGE_SIZE = int(os.environ.get("FEED_PAGE_SIZE", "50"))
+FEED_MAX_PAGE_SIZE = 200
+
+# Configure Cloudinary
+cloudinary.config(
+    cloud_name = os.getenv('CLOUDINARY_CLOUD_NAME'),
+    api_key = os.getenv('CLOUDINARY_API_KEY'),
+    api_secret = os.getenv('CLOUDINARY_API_SECRET')
+)
+
+
+def verify_token(token):
+    try:
+        payload = jwt.decode(
+            token,
+            os.getenv('JWT_SECRET', 'esd_jwt_secret_key'),
+            algorithms=[os.getenv('JWT_ALGORITHM', 'HS256')]
+        )
+        return payload
+    except jwt.ExpiredSignatureError:
+        logger.info("Token expired")
+        return None
+    except jwt.InvalidTokenError:
+        logger.info("Invalid token")
+        return None
+
+
+def authenticate(auth_header):
+    """(payload, None), or (None, (error body, status)) for a missing or bad bearer token."""
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None, ({'error': 'No token provided'}, 401)
+    payload = verify_token(auth_header.split(' ')[1])
+    if not payload:
+        return None, ({'error': 'Invalid or expired token'}, 401)
+    return payload, None
+
+
+def page_limit(value):
+    try:
+        return max(1, min(int(value if value is not None else FEED_PAGE_SIZE), FEED_MAX_PAGE_SIZE))
+    except ValueError:
+        return FEED_PAGE_SIZE
+
+
+def page_offset(value):
+    try:
+        return max(0, int(value or 0))
+    except ValueError:
+        return 0
+
+
+def upload_image(stream, filename, size):
+    """Upload to Cloudinary straight from the spooled file, chunked when large; blocking."""
+    with tracing.span("cloudinary.upload", bytes=size, chunked=size > CLOUDINARY_CHUNK_SIZE):
+        if size > CLOUDINARY_CHUNK_SIZE:
+            upload_result = cloudinary.uploader.upload_large(
+                stream, chunk_size=CLOUDINARY_CHUNK_SIZE, filename=filename, resource_type="image"
+            )
+        else:
+            upload_result = cloudinary.uploader.upload(stream)
+    return upload_result['secure_url']
+
+
+def new_post(payload, title, content, location, preferences, image_url):
+    return {
+        'user_id': payload['user_id'],
+        'username': payload['username'],
+        'title': title,
+        'content': content,
+        'location': location,
+        'preferences': preferences,
+        'image_url': image_url,
+        'created_at': datetime.now().isoformat()
+    }
+
+
+def post_summary(post):
+    return {
+        'id': post['id'],
+        'title': post['title'],
+        'content': post['content'],
+        'image_url': post['image_url'],
+        'created_at': post['created_at'],
+        'user_id': post['user_id'],
+        'username': post['username']
+    }
+
+
+def feed_post(post):
+    return dict(post_summary(post),
+                preference=[tag.strip() for tag in (post.get('preferences') or '').split(',') if tag],
+                location=post['location'])
+
+
+def filter_by_tags(posts, tags_param):
+    """Posts whose preferences mention any of the comma-separated tags (all posts without tags)."""
+    if not tags_param:
+        return posts
+    tags = [tag.strip().lower() for tag in tags_param.split(',') if tag.strip()]
+    # Handle case where preferences might be None
+    return [post for post in posts if any(tag in (post.get('preferences') or '').lower() for tag in tags)]
+
+
+def created_response(post):
+    return {
+        'message': 'Post created successfully',
+        'post': post_summary(post)
+    }
+
+
+def posts_response(posts, tags_param):
+    return {'posts': [feed_post(post) for post in filter_by_tags(posts, tags_param)]}
+
+
+def personalized_response(ranked, offset, limit):
+    return {
+        'posts': [dict(feed_post(post), score=score) for post, score in ranking.page(ranked, offset, limit)],
+        'next_offset': offset + limit if offset + limit < len(ranked.order) else None
+    }
+
+
+def feed_response(rows, limit, tags_param, user_id):
+    # Tags filter the page, as in get_posts; next_before still moves past the whole page
+    return {
+        'posts': [feed.card(row, user_id) for row in filter_by_tags(rows, tags_param)],
+        'next_before': rows[-1]['created_at'] if len(rows) == limit else None
+    }
+
+
+def user_posts_response(posts, payload):
+    # Get the username from the first post or use the token if no posts
+    # (which makes the response specific to the caller)
+    username = posts[0]['username'] if posts else payload['username']
+    return {
+        'username': username,
+        'posts': [post_summary(post) for post in posts]
+    }
+
+
+def delete_error(post, post_id, payload):
+    """(body, status) when the caller may not delete the post, else None."""
+    try:
+        # Both IDs must be numeric
+        int(str(post.get('user_id')))
+        int(str(payload.get('user_id')))
+    except (ValueError, TypeError) as e:
+        logger.error("Error converting user IDs: %s", e)
+        return {'error': 'Error comparing user IDs'}, 500
+    if str(post.get('user_id')) != str(payload.get('user_id')):
+        logger.warning("User %s may not delete post %s", payload.get('user_id'), post_id)
+        return {'error': 'Unauthorized to delete this post'}, 403
+    return None
+
+
+def post_created(feed_reads, post):
+    feed_reads.forget("feed")
+    cache.purge(cache.FEED_KEY, cache.user_key(post['user_id']))
+    events.publish("post_created", {"post_id": post['id'], "user_id": post['user_id']})
+
+
+def post_deleted(feed_reads, post_id, user_id):
+    feed_reads.forget("feed")
+    cache.purge(cache.FEED_KEY, cache.user_key(user_id), cache.post_key(post_id))
+    events.publish("post_deleted", {"post_id": post_id, "user_id": user_id})
+    logger.info("Deleted post %s", post_id, extra={"post_id": post_id, "user_id": user_id})
+
+
+def user_posts_deleted(feed_reads, user_id, posts):
+    feed_reads.forget("feed")
+    cache.purge(cache.FEED_KEY, cache.user_key(user_id), *(cache.post_key(p['id']) for p in posts))
+    if posts:
+        events.publish("post_deleted", {"post_ids": [p['id'] for p in posts], "user_id": user_id})
+    logger.info("Deleted %d posts of user %s", len(posts), user_id)
+
+
+def posts_imported(feed_reads, rows):
+    feed_reads.forget("feed")
+    cache.purge(cache.FEED_KEY,
+                *{cache.user_key(row.get('user_id')) for row in rows},
+                *(cache.post_key(row['id']) for row in rows if row.get('id') is not None))
+    post_ids = [row['id'] for row in rows if row.get('id') is not None]
+    if post_ids:
+        events.publish("data_imported", {"table": POSTS_TABLE, "post_ids": post_ids})
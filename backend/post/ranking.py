@@ -0,0 +1,138 @@
+"""
+Personalized ranking of the feed against a user's taste preferences.
+
+Post tags (the comma-separated preferences the create service stores) and a
+user's taste_preferences (diet, travel_style, tourist_sites) map onto one
+fixed vocabulary, PREFERENCE_TAGS, so each post is a 0/1 vector and each
+user a weighted one. The candidate posts form a single matrix, built once
+per set of posts and shared by every user; a user's scores are one
+matrix-vector product, and the ranking a stable argsort, so ties keep the
+feed's newest-first order.
+
+Ranked lists are cached per user and reused while
+  - the user's preference vector is the same (the caller reads the
+    preferences on every request, so a change takes effect at once), and
+  - the candidates are the same: invalidate() drops them, and the post
+    service calls it whenever it purges the feed (create/delete). Writes in
+    other processes show up after PERSONAL_FEED_TTL seconds.
+
+Configuration (environment):
+    PERSONAL_FEED_TTL          seconds candidates and ranked lists are reused (default 60)
+    PERSONAL_FEED_CACHE_USERS  users whose ranked lists are kept (default 10000)
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+import numpy as np
+
+PERSONAL_FEED_TTL = float(os.environ.get("PERSONAL_FEED_TTL", "60"))
+PERSONAL_FEED_CACHE_USERS = int(os.environ.get("PERSONAL_FEED_CACHE_USERS", "10000"))
+
+# The options offered by the preferences editor; "None" is not a preference
+PREFERENCE_TAGS = {
+    "travel_style": ["Adventure", "Solo", "Family", "Shopping", "Relaxation"],
+    "tourist_sites": ["Nature Sites", "Cultural Sites", "Leisure Attractions", "Sports Activities"],
+    "diet": ["Halal", "Vegetarian", "Kosher"],
+}
+# A post that fits a dietary restriction counts for more than a shared interest
+CATEGORY_WEIGHTS = {"travel_style": 1.0, "tourist_sites": 1.0, "diet": 2.0}
+
+TAGS = [tag for tags in PREFERENCE_TAGS.values() for tag in tags]
+TAG_INDEX = {tag.lower(): i for i, tag in enumerate(TAGS)}
+WEIGHTS = np.array([CATEGORY_WEIGHTS[category] for category, tags in PREFERENCE_TAGS.items() for _ in tags],
+                   dtype=np.float32)
+
+Candidates = namedtuple("Candidates", ["generation", "expires", "posts", "matrix"])
+# order: indexes into posts, best first
+Ranking = namedtuple("Ranking", ["posts", "order", "scores"])
+
+
+def post_vector(preferences):
+    """0/1 vector of a post's comma-separated tags; unknown tags are ignored."""
+    vector = np.zeros(len(TAGS), dtype=np.float32)
+    for tag in (preferences or '').split(','):
+        index = TAG_INDEX.get(tag.strip().lower())
+        if index is not None:
+            vector[index] = 1
+    return vector
+
+
+def user_vector(taste_preferences):
+    """Weighted vector of a user's taste_preferences ({"diet": [...], ...})."""
+    vector = np.zeros(len(TAGS), dtype=np.float32)
+    for category in PREFERENCE_TAGS:
+        values = (taste_preferences or {}).get(category) or []
+        if isinstance(values, str):
+            values = [values]
+        for value in values:
+            index = TAG_INDEX.get(str(value).strip().lower())
+            if index is not None:
+                vector[index] = WEIGHTS[index]
+    return vector
+
+
+class Ranker:
+    def __init__(self, ttl=PERSONAL_FEED_TTL, max_users=PERSONAL_FEED_CACHE_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.generation = 0
+        self._candidates = None
+        self._ranked = OrderedDict()
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._candidates = None
+            self._ranked.clear()
+
+    def candidates(self):
+        """The current candidates, or None if they must be loaded and passed to set_candidates()."""
+        candidates = self._candidates
+        if candidates is None or candidates.expires < time.monotonic():
+            return None
+        return candidates
+
+    def set_candidates(self, posts, generation):
+        """
+        Build the candidate matrix from posts (newest first). generation is
+        self.generation from before the posts were loaded; if the posts changed
+        since, the matrix is used for this request only.
+        """
+        matrix = np.vstack([post_vector(post.get('preferences')) for post in posts]) if posts \
+            else np.zeros((0, len(TAGS)), dtype=np.float32)
+        candidates = Candidates(generation, time.monotonic() + self.ttl, posts, matrix)
+        with self._lock:
+            if generation == self.generation:
+                self._candidates = candidates
+        return candidates
+
+    def lookup(self, user_id, vector):
+        """The cached ranking of user_id, if neither the posts nor the preferences changed."""
+        candidates = self.candidates()
+        with self._lock:
+            entry = self._ranked.get(user_id)
+            if entry is None or candidates is None or entry[0] is not candidates \
+                    or not np.array_equal(entry[1], vector):
+                return None
+            self._ranked.move_to_end(user_id)
+            return entry[2]
+
+    def rank(self, user_id, vector, candidates):
+        """Rank the candidates for user_id; posts matching nothing keep their feed order at the end."""
+        scores = candidates.matrix @ vector
+        ranked = Ranking(candidates.posts, np.argsort(-scores, kind="stable"), scores)
+        with self._lock:
+            if candidates is self._candidates:
+                self._ranked[user_id] = (candidates, vector, ranked)
+                self._ranked.move_to_end(user_id)
+                while len(self._ranked) > self.max_users:
+                    self._ranked.popitem(last=False)
+        return ranked
+
+
+def page(ranked, offset, limit):
+    """[(post, score)] for one page of a Ranking."""
+    return [(ranked.posts[i], float(ranked.scores[i])) for i in ranked.order[offset:offset + limit]]
@@ -0,0 +1,126 @@
+"""
+Local collector for the spans written by common/tracing.py.
+
+Groups spans by trace ID and, once a trace has been quiet for --idle seconds,
+prints it as a tree with per-span durations across services:
+
+    3f2a9c...  POST /api/cposts  412.3 ms
+      create-post-service  POST /api/cposts                    412.3 ms
+        create-post-service  http POST http://post-service...  380.1 ms
+          post-service  POST /api/posts                        375.0 ms
+            post-service  cloudinary.upload                    301.2 ms
+            post-service  supabase.insert post                  41.7 ms
+
+Listen for TRACE_EXPORT=udp://<host>:6000:
+    python tools/trace_collector.py --udp 0.0.0.0:6000
+
+Or read TRACE_EXPORT=stdout output (docker-compose log prefixes are skipped):
+    docker-compose logs --no-color | python tools/trace_collector.py
+"""
+
+import argparse
+import json
+import socket
+import sys
+import time
+from collections import defaultdict
+
+
+def parse_span(line):
+    start = line.find('{"trace_id"')
+    if start < 0:
+        return None
+    try:
+        return json.loads(line[start:])
+    except ValueError:
+        return None
+
+
+def format_trace(spans):
+    by_id = {s["span_id"]: s for s in spans}
+    children = defaultdict(list)
+    roots = []
+    for s in spans:
+        if s.get("parent_id") in by_id:
+            children[s["parent_id"]].append(s)
+        else:
+            # Root, or its parent was never received (e.g. Kong or a client outside the trace)
+            roots.append(s)
+
+    lines = []
+
+    def walk(s, depth):
+        status = "" if s["status"] == "ok" else f"  [{s['status']}: {s['attrs'].get('error', '')}]"
+        label = f"{'  ' * depth}{s['service']}  {s['name']}"
+        lines.append(f"  {label:<72} {s['duration_ms']:>9.1f} ms{status}")
+        for child in sorted(children[s["span_id"]], key=lambda c: c["start"]):
+            walk(child, depth + 1)
+
+    roots.sort(key=lambda s: s["start"])
+    for root in roots:
+        walk(root, 0)
+
+    first = roots[0]
+    total_ms = max(s["start"] * 1000 + s["duration_ms"] for s in spans) - first["start"] * 1000
+    return f"{first['trace_id']}  {first['name']}  {total_ms:.1f} ms\n" + "\n".join(lines)
+
+
+class Collector:
+    def __init__(self, idle, min_ms):
+        self.idle = idle
+        self.min_ms = min_ms
+        self.traces = defaultdict(list)
+        self.last_seen = {}
+
+    def add(self, span):
+        self.traces[span["trace_id"]].append(span)
+        self.last_seen[span["trace_id"]] = time.monotonic()
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        for trace_id in [t for t, seen in self.last_seen.items() if force or now - seen >= self.idle]:
+            spans = self.traces.pop(trace_id)
+            del self.last_seen[trace_id]
+            if max(s["duration_ms"] for s in spans) >= self.min_ms:
+                print(format_trace(spans) + "\n", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--udp", help="host:port to listen on, e.g. 0.0.0.0:6000 (default: read stdin)")
+    parser.add_argument("--idle", type=float, default=2.0, help="seconds without new spans before a trace is printed")
+    parser.add_argument("--min-ms", type=float, default=0.0, help="only print traces with a span at least this slow")
+    args = parser.parse_args()
+
+    collector = Collector(args.idle, args.min_ms)
+
+    if not args.udp:
+        for line in sys.stdin:
+            span = parse_span(line)
+            if span:
+                collector.add(span)
+            collector.flush()
+        collector.flush(force=True)
+        return
+
+    host, port = args.udp.rsplit(":", 1)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((host, int(port)))
+    sock.settimeout(0.5)
+    print(f"Collecting spans on udp://{args.udp}", flush=True)
+    try:
+        while True:
+            try:
+                data, _ = sock.recvfrom(65535)
+                span = parse_span(data.decode("utf-8", "replace"))
+                if span:
+                    collector.add(span)
+            except socket.timeout:
+                pass
+            collector.flush()
+    except KeyboardInterrupt:
+        collector.flush(force=True)
+
+
+if __name__ == "__main__":
+    main()
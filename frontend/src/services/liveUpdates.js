@@ -0,0 +1,128 @@
+import authService from './auth';
+
+const API_BASE_URL = 'http://localhost:8000'; // Kong API Gateway URL
+
+// The social service accepts this many post_ids per stream (LIVE_MAX_POSTS_PER_STREAM)
+const MAX_POSTS_PER_STREAM = 200;
+// Cards mounted together (a feed or profile list) are subscribed with one reconnect
+const SUBSCRIBE_DELAY = 100;
+const RECONNECT_DELAY = 3000;
+
+/**
+ * One Server-Sent Events stream of like/comment deltas for every post on the
+ * page, shared by all post cards. Browsers allow only a few connections per
+ * host over HTTP/1.1, so a stream per card would block the page's other calls.
+ */
+class LiveUpdates {
+  // post id -> Set of handlers ({ like, comment, resync })
+  subscribers = new Map();
+  sources = [];
+  timer = null;
+  // Bumped by every connect, so a slower earlier one gives way
+  attempt = 0;
+  // Set when a stream dropped: events published meanwhile were missed
+  missed = false;
+
+  /**
+   * Receive live events for a post
+   * @param {string|number} postId - Post identifier
+   * @param {Object} handlers - like(data) and comment(data); resync() after a reconnect
+   * @returns {Function} - Call to unsubscribe
+   */
+  subscribe(postId, handlers) {
+    const key = String(postId);
+    if (!this.subscribers.has(key)) {
+      this.subscribers.set(key, new Set());
+      this.schedule(SUBSCRIBE_DELAY);
+    }
+    this.subscribers.get(key).add(handlers);
+
+    return () => {
+      const handlersForPost = this.subscribers.get(key);
+      if (!handlersForPost) return;
+      handlersForPost.delete(handlers);
+      if (handlersForPost.size === 0) {
+        this.subscribers.delete(key);
+        this.schedule(SUBSCRIBE_DELAY);
+      }
+    };
+  }
+
+  schedule(delay) {
+    clearTimeout(this.timer);
+    this.timer = setTimeout(() => this.connect(), delay);
+  }
+
+  close() {
+    this.sources.forEach((source) => source.close());
+    this.sources = [];
+  }
+
+  /**
+   * (Re)open the streams for the subscribed posts with a fresh ticket;
+   * tickets are short-lived, so every reconnect asks for a new one
+   */
+  async connect() {
+    this.close();
+    const attempt = ++this.attempt;
+    const postIds = [...this.subscribers.keys()];
+    const token = authService.getToken();
+    if (postIds.length === 0 || !token) return;
+
+    let ticket;
+    try {
+      const response = await fetch(`${API_BASE_URL}/api/social/stream/ticket`, {
+        method: 'POST',
+        headers: {
+          Authorization: `Bearer ${token}`,
+        },
+      });
+      if (!response.ok) throw new Error(`Failed to get stream ticket: ${response.status}`);
+      ticket = (await response.json()).ticket;
+    } catch (error) {
+      if (attempt !== this.attempt) return;
+      console.error('Error opening live updates:', error);
+      this.missed = true;
+      this.schedule(RECONNECT_DELAY);
+      return;
+    }
+    // Subscriptions changed while the ticket was requested; the newer connect opens the streams
+    if (attempt !== this.attempt) return;
+
+    for (let i = 0; i < postIds.length; i += MAX_POSTS_PER_STREAM) {
+      const ids = postIds.slice(i, i + MAX_POSTS_PER_STREAM);
+      const source = new EventSource(
+        `${API_BASE_URL}/api/social/stream?post_ids=${ids.map(encodeURIComponent).join(',')}&ticket=${encodeURIComponent(ticket)}`
+      );
+      source.addEventListener('like', (event) => this.dispatch('like', event));
+      source.addEventListener('comment', (event) => this.dispatch('comment', event));
+      // EventSource would retry with the same, soon expired, ticket
+      source.onerror = () => {
+        if (!this.sources.includes(source)) return;
+        this.close();
+        this.missed = true;
+        this.schedule(RECONNECT_DELAY);
+      };
+      this.sources.push(source);
+    }
+
+    // Let the cards reload what they missed while disconnected
+    if (this.missed) {
+      this.missed = false;
+      postIds.forEach((postId) => this.notify(postId, 'resync'));
+    }
+  }
+
+  dispatch(type, event) {
+    const data = JSON.parse(event.data);
+    this.notify(String(data.post_id), type, data);
+  }
+
+  notify(postId, type, data) {
+    (this.subscribers.get(postId) || []).forEach((handlers) => {
+      if (handlers[type]) handlers[type](data);
+    });
+  }
+}
+
+export default new LiveUpdates();